@@ -0,0 +1,315 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+from agent.tracing import process_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """A turn was refused because the server is over capacity."""
+
+    def __init__(self, reason: str, retry_after: float):
+        """
+        Args:
+            reason (str): "queue_timeout", "token_budget" or "session_token_budget".
+            retry_after (float): Seconds after which the client may try again.
+        """
+        super().__init__(f"Turn rejected ({reason}), retry after {retry_after:.0f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenWindow:
+    """The tokens used over the last ``window`` seconds."""
+
+    def __init__(self, window: float = 60.0):
+        self.window = window
+        self.total = 0
+        self.entries = deque()
+
+    def prune(self, now: float):
+        while self.entries and self.entries[0][0] <= now - self.window:
+            self.total -= self.entries.popleft()[1]
+
+    def add(self, now: float, tokens: int):
+        self.entries.append((now, tokens))
+        self.total += tokens
+
+    def seconds_until_below(self, budget: int, now: float) -> float:
+        """
+        Compute how long until the window holds fewer than ``budget`` tokens.
+
+        Args:
+            budget (int): The token budget.
+            now (float): The current time.
+
+        Returns:
+            float: Seconds to wait, 0 if the window is already below the budget.
+        """
+        total, wait = self.total, 0.0
+        for timestamp, tokens in self.entries:
+            if total < budget:
+                break
+            total -= tokens
+            wait = timestamp + self.window - now
+        return max(wait, 0.0)
+
+
+class Admission:
+    """An admitted turn; ``release`` must be called once the turn is over."""
+
+    def __init__(self, controller, session_id: str, degraded: bool, waited: float):
+        self.controller = controller
+        self.session_id = session_id
+        self.degraded = degraded
+        self.waited = waited
+        self.released = False
+
+    def release(self):
+        """
+        Give the turn's slot back. Safe to call more than once.
+        """
+        if not self.released:
+            self.released = True
+            self.controller._release(self.session_id)
+
+
+class AdmissionController:
+    """Accounts tokens and in-flight turns, and decides which turns to serve.
+
+    Agents report the ``usage`` of every completion through ``record_usage``,
+    which feeds one-minute token windows for the process and for each
+    session. A new turn waits at most ``max_queue_wait`` seconds for one of
+    ``max_in_flight`` slots. A turn is rejected with a Retry-After delay when
+    no slot frees up in time or the process or its session used up its token
+    budget for the last minute. Turns admitted while the process is above
+    ``degrade_ratio`` of its slots or token budget are served degraded, which
+    skips the technique and stage planning.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 64,
+        max_queue_wait: float = 2.0,
+        tokens_per_minute: int = None,
+        session_tokens_per_minute: int = None,
+        degrade_ratio: float = 0.8,
+        clock=time.monotonic,
+    ):
+        """
+        Initialize the controller.
+
+        Args:
+            max_in_flight (int): Maximum number of turns served at once.
+            max_queue_wait (float): Seconds a turn may wait for a slot.
+            tokens_per_minute (int): Optional token budget of the process.
+            session_tokens_per_minute (int): Optional token budget of each session.
+            degrade_ratio (float): Share of the slots or token budget above which
+                turns are served degraded.
+            clock (Callable[[], float]): Monotonic clock, overridable for testing.
+        """
+        self.max_in_flight = max_in_flight
+        self.max_queue_wait = max_queue_wait
+        self.tokens_per_minute = tokens_per_minute
+        self.session_tokens_per_minute = session_tokens_per_minute
+        self.degrade_ratio = degrade_ratio
+        self.clock = clock
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.tokens = TokenWindow()
+        self.sessions = dict()
+        self.counters = {
+            "admitted": 0,
+            "degraded": 0,
+            "rejected_queue_timeout": 0,
+            "rejected_token_budget": 0,
+            "rejected_session_token_budget": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+        }
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._lock = threading.Lock()
+
+    def _session(self, session_id: str) -> dict:
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.sessions[session_id] = {
+                "in_flight": 0,
+                "tokens": TokenWindow(),
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+            }
+        return session
+
+    def _prune(self, now: float, session_ids=None):
+        self.tokens.prune(now)
+        for session_id in list(self.sessions if session_ids is None else session_ids):
+            session = self.sessions.get(session_id)
+            if session is None:
+                continue
+            session["tokens"].prune(now)
+            if not session["in_flight"] and not session["tokens"].entries:
+                del self.sessions[session_id]
+
+    def _publish(self):
+        process_metrics.set("cocoa_turns_in_flight", self.in_flight)
+        process_metrics.set("cocoa_turns_waiting", self.waiting)
+        process_metrics.set("cocoa_tokens_last_minute", self.tokens.total)
+
+    def record_usage(self, session_id: str, usage):
+        """
+        Account the tokens of one completion.
+
+        Args:
+            session_id (str): The session that made the call.
+            usage (CompletionUsage): The ``usage`` of the completion, may be None.
+        """
+        if usage is None:
+            return
+        prompt_tokens = usage.prompt_tokens or 0
+        completion_tokens = usage.completion_tokens or 0
+        now = self.clock()
+        with self._lock:
+            session = self._session(session_id)
+            for account in (self.counters, session):
+                account["prompt_tokens"] += prompt_tokens
+                account["completion_tokens"] += completion_tokens
+            self.tokens.add(now, prompt_tokens + completion_tokens)
+            session["tokens"].add(now, prompt_tokens + completion_tokens)
+            self._prune(now, [session_id])
+            self._publish()
+
+    def _over_budget(self, session_id: str, now: float):
+        if self.tokens_per_minute and self.tokens.total >= self.tokens_per_minute:
+            wait = self.tokens.seconds_until_below(self.tokens_per_minute, now)
+            return AdmissionRejected("token_budget", wait)
+        session = self.sessions.get(session_id)
+        if (
+            session is not None
+            and self.session_tokens_per_minute
+            and session["tokens"].total >= self.session_tokens_per_minute
+        ):
+            wait = session["tokens"].seconds_until_below(self.session_tokens_per_minute, now)
+            return AdmissionRejected("session_token_budget", wait)
+        return None
+
+    def _pressure(self) -> float:
+        pressure = self.in_flight / self.max_in_flight
+        if self.tokens_per_minute:
+            pressure = max(pressure, self.tokens.total / self.tokens_per_minute)
+        return pressure
+
+    def _reject(self, error: AdmissionRejected):
+        self.counters[f"rejected_{error.reason}"] += 1
+        process_metrics.increment("cocoa_admissions_total", outcome=f"rejected_{error.reason}")
+        logger.info("%s", error)
+        raise error
+
+    async def admit(self, session_id: str) -> Admission:
+        """
+        Wait for a slot for a turn of a session.
+
+        Args:
+            session_id (str): The session of the turn.
+
+        Returns:
+            Admission: The admitted turn, possibly degraded.
+
+        Raises:
+            AdmissionRejected: If the turn is over budget or waited too long.
+        """
+        with self._lock:
+            now = self.clock()
+            self._prune(now, [session_id])
+            error = self._over_budget(session_id, now)
+            if error is not None:
+                self._reject(error)
+            self.waiting += 1
+            self._publish()
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.max_queue_wait)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._reject(AdmissionRejected("queue_timeout", self.max_queue_wait))
+        finally:
+            with self._lock:
+                self.waiting -= 1
+                self._publish()
+        waited = time.perf_counter() - started
+        process_metrics.observe("cocoa_admission_wait_seconds", waited)
+
+        with self._lock:
+            degraded = self._pressure() >= self.degrade_ratio
+            self.in_flight += 1
+            self._session(session_id)["in_flight"] += 1
+            outcome = "degraded" if degraded else "admitted"
+            self.counters[outcome] += 1
+            self._publish()
+        process_metrics.increment("cocoa_admissions_total", outcome=outcome)
+        return Admission(self, session_id, degraded, waited)
+
+    def _release(self, session_id: str):
+        with self._lock:
+            self.in_flight -= 1
+            session = self.sessions.get(session_id)
+            if session is not None:
+                session["in_flight"] -= 1
+            self._prune(self.clock(), [session_id])
+            self._publish()
+        self._slots.release()
+
+    def stats(self) -> dict:
+        """
+        Report in-flight turns, token use and admission counters.
+
+        Sessions are only reported in aggregate: their ids are the credential
+        of /chat and must not leak.
+
+        Returns:
+            dict: Counters suitable for JSON serialization.
+        """
+        with self._lock:
+            self._prune(self.clock())
+            session_tokens = [session["tokens"].total for session in self.sessions.values()]
+            return {
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "max_in_flight": self.max_in_flight,
+                "tokens_last_minute": self.tokens.total,
+                "tokens_per_minute": self.tokens_per_minute,
+                "active_sessions": len(self.sessions),
+                "sessions_in_flight": sum(
+                    1 for session in self.sessions.values() if session["in_flight"]
+                ),
+                "max_session_tokens_last_minute": max(session_tokens, default=0),
+                "sessions_over_budget": (
+                    sum(
+                        1
+                        for tokens in session_tokens
+                        if tokens >= self.session_tokens_per_minute
+                    )
+                    if self.session_tokens_per_minute
+                    else 0
+                ),
+                **self.counters,
+            }
+
+
+def retry_after_header(seconds: float) -> str:
+    """
+    Format a Retry-After delay, rounded up to whole seconds.
+
+    Args:
+        seconds (float): The delay.
+
+    Returns:
+        str: The header value, at least "1".
+    """
+    return str(max(1, math.ceil(seconds)))
@@ -0,0 +1,554 @@
+import asyncio
+import json
+import logging
+import time
+
+from agent.clients import get_async_llm_client
+from agent.cocoa import CoCoAgent, as_messages
+from agent.resilience import get_resilient_caller
+from agent.speculation import SpeculativeStream
+from agent.tracing import TurnTrace, process_metrics
+from memory.write_behind import MemoryWriteBehind
+from prompts.prompts import CBTPrompt
+from prompts.structured_outputs import RetrievedMemory, TurnAnalysis
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncCoCoAgent(CoCoAgent):
+    """Asynchronous variant of CoCoAgent built on AsyncOpenAI.
+
+    The OpenAI calls are coroutines, so the step helpers inherited from
+    CoCoAgent (detect_cognitive_distortion, extract_insight, ...) return
+    awaitables. Blocking Chroma calls run in a worker thread so that no step
+    holds up the event loop, and memory writes go through a write-behind queue
+    so that embedding never delays the reply.
+    """
+
+    def __init__(
+        self,
+        api_key,
+        session_id: str = "default",
+        llm_client=None,
+        fused_analysis: bool = False,
+        context_max_tokens: int = 2000,
+        response_cache=None,
+        neutral_gate=None,
+        memory_backend=None,
+        memory_consolidator=None,
+        consolidate_every: int = 8,
+        trace_sample_rate: float = 0.01,
+        resilience=None,
+        speculative: bool = False,
+        usage_meter=None,
+    ):
+        """
+        Initialize the AsyncCoCoAgent with the given API key.
+
+        Args:
+            api_key (str): The API key for accessing the OpenAI service.
+            session_id (str): Identifier of the conversation this agent serves.
+            llm_client (AsyncOpenAI): Optional client, defaults to the shared pooled client.
+            fused_analysis (bool): Analyze each turn with a single structured call
+                instead of separate detection, insight, technique and stage calls.
+            context_max_tokens (int): Token budget of the recent conversation window;
+                older turns are folded into a rolling summary.
+            response_cache (ResponseCache): Optional cache for the deterministic
+                (non-streamed) calls.
+            neutral_gate (NeutralUtteranceGate): Optional local gate that skips
+                distortion detection and insight extraction for neutral utterances.
+            memory_backend (MemoryBackend): Where basic_memory and cd_memory are kept,
+                defaults to an in-process ephemeral Chroma client.
+            memory_consolidator (MemoryConsolidator): Optional pass that merges
+                near-duplicate memories of the session and caps their number.
+            consolidate_every (int): Number of memory writes between consolidations.
+            trace_sample_rate (float): Share of turns whose trace is logged.
+            resilience (ResilientCaller): Deadlines, retries, hedging and rate limits
+                of the OpenAI calls, defaults to the shared caller.
+            speculative (bool): Start streaming the reply with the previous turn's
+                technique and stage while the new ones are being selected.
+            usage_meter (AdmissionController): Optional process-wide accounting that
+                receives the usage of every completion with the session id.
+        """
+        super().__init__(
+            api_key,
+            session_id=session_id,
+            llm_client=llm_client or get_async_llm_client(api_key),
+            context_max_tokens=context_max_tokens,
+            response_cache=response_cache,
+            neutral_gate=neutral_gate,
+            memory_backend=memory_backend,
+            memory_consolidator=memory_consolidator,
+            consolidate_every=consolidate_every,
+            usage_meter=usage_meter,
+        )
+        self.fused_analysis = fused_analysis
+        self.resilience = resilience or get_resilient_caller()
+        self.speculative = speculative
+        self.last_plan = None
+        self.speculation_counters = {"hit": 0, "miss": 0, "error": 0}
+        self.trace_sample_rate = trace_sample_rate
+        self.trace = TurnTrace(session_id, sample_rate=0)
+        self.turn_timings = dict()
+        self.last_turn = dict()
+        self.memory_writer = MemoryWriteBehind()
+        self.summary_task = None
+        self.consolidation_task = None
+        self.close_task = None
+        self.cd_memory_count = self.memory_count(self.cd_memory)
+
+    async def _timed(self, step: str, awaitable):
+        """
+        Await a pipeline step in a span of the turn trace and record its
+        duration in turn_timings.
+
+        Args:
+            step (str): The name of the step.
+            awaitable (Awaitable): The step to run.
+
+        Returns:
+            Any: The result of the step.
+        """
+        start = time.perf_counter()
+        try:
+            with self.trace.span(step):
+                return await awaitable
+        finally:
+            self.turn_timings[step] = time.perf_counter() - start
+
+    async def _plan_cbt(self, cd_star: str):
+        """
+        Select the CBT technique and then the stage that depends on it.
+
+        Args:
+            cd_star (str): The detected cognitive distortion type.
+
+        Returns:
+            tuple[str, str]: The selected technique and stage name.
+        """
+        cbt_technique = await self._timed(
+            "technique_selection", self.select_cbt_technique(cd_star)
+        )
+        logger.debug("Selected CBT technique: %s", cbt_technique)
+
+        cbt_stage_example = await self._timed(
+            "stage_selection",
+            self.cbt_stage_and_example(
+                technique=cbt_technique, latest_dialogue=self.context.render()
+            ),
+        )
+        logger.debug("Selected CBT stage and example: %s", cbt_stage_example)
+        return cbt_technique, cbt_stage_example.stage_name
+
+    async def _plan_turn(self, cd_star: str, latest_dialogue: str, analysis):
+        """
+        Retrieve memory and plan the technique and stage of a turn.
+
+        Args:
+            cd_star (str): The detected cognitive distortion type.
+            latest_dialogue (str): The latest turns of the conversation.
+            analysis (TurnAnalysis): The fused analysis of the turn, if any.
+
+        Returns:
+            tuple[str, str]: The selected technique and stage name.
+        """
+        # Retrieval and planning only depend on the detected distortion;
+        # stage selection waits on the technique inside _plan_cbt.
+        retrieval = self._timed("retrieval", self.retrieve_memory(cd_star, latest_dialogue))
+        if analysis is not None:
+            relevant_memory = await retrieval
+            plan = analysis.technique, analysis.stage_name
+        else:
+            relevant_memory, plan = await asyncio.gather(
+                retrieval, self._plan_cbt(cd_star)
+            )
+        logger.debug("Retrieved memory: %s", relevant_memory)
+        return plan
+
+    def _record_speculation(self, outcome: str):
+        self.speculation_counters[outcome] += 1
+        self.last_turn["speculation"] = outcome
+        process_metrics.increment("cocoa_speculation_total", outcome=outcome)
+
+    async def analyze_turn(self, client_utterance: str):
+        """
+        Detect the distortion, extract the insight and plan the technique and
+        stage of a turn in one structured call.
+
+        Args:
+            client_utterance (str): The latest dialogue from the user.
+
+        Returns:
+            TurnAnalysis: The analysis, or None if the response could not be parsed.
+        """
+        try:
+            analysis = await self.structured_response_from_openai(
+                CBTPrompt.turn_analysis(
+                    client_utterance=client_utterance,
+                    latest_dialogue=self.context.render(),
+                    cbt_usage_log=self.cbt_usage_log,
+                ),
+                TurnAnalysis,
+                step="turn_analysis",
+            )
+        except Exception as e:
+            logger.warning("Fused turn analysis failed, falling back: %s", e)
+            return None
+        if analysis is None:
+            logger.warning("Fused turn analysis was refused, falling back")
+        return analysis
+
+    async def cache_lookup(self, messages: list, step: str, structure=None):
+        # The disk tier blocks on SQLite, so it is read in a worker thread.
+        if self.response_cache is not None and self.response_cache.on_disk:
+            return await asyncio.to_thread(super().cache_lookup, messages, step, structure)
+        return super().cache_lookup(messages, step, structure)
+
+    async def cache_store(self, key: str, response):
+        if self.response_cache is not None and self.response_cache.on_disk:
+            await asyncio.to_thread(super().cache_store, key, response)
+        else:
+            super().cache_store(key, response)
+
+    async def response_from_opanai(self, prompt, step: str = "response") -> str:
+        """
+        Generate a response from OpenAI for the given prompt.
+
+        Args:
+            prompt (str | list[dict]): The prompt to send to OpenAI.
+            step (str): The pipeline step, used for usage accounting.
+
+        Returns:
+            str: The response from OpenAI.
+        """
+        messages = as_messages(prompt)
+        key, cached = await self.cache_lookup(messages, step)
+        if cached is not None:
+            return cached
+        completion = await self.resilience.call(
+            step,
+            lambda: self.llm_client.chat.completions.create(
+                model=self.model_name,
+                messages=messages,
+                temperature=0,
+            ),
+        )
+        self.record_usage(step, completion.usage)
+        response = completion.choices[0].message.content
+        await self.cache_store(key, response)
+        return response
+
+    async def stream_from_opanai(self, prompt):
+        """
+        Stream a response from OpenAI for the given prompt.
+
+        Args:
+            prompt (str | list[dict]): The prompt to send to OpenAI.
+
+        Yields:
+            str: The chunks of the response from OpenAI.
+        """
+        stream = self.resilience.stream(
+            "response",
+            lambda messages: self.llm_client.chat.completions.create(
+                model=self.model_name,
+                messages=messages,
+                temperature=0.5,
+                stream=True,
+                stream_options={"include_usage": True},
+            ),
+            self.final_messages(prompt),
+        )
+        async for chunk in stream:
+            if chunk.usage is not None:
+                self.record_usage("response", chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def structured_response_from_openai(
+        self, prompt, structure, step: str = "structured"
+    ):
+        """
+        Generate a structured response from OpenAI for the given prompt.
+
+        Args:
+            prompt (str | list[dict]): The prompt to send to OpenAI.
+            structure (type[BaseModel]): The pydantic model to parse the response into.
+            step (str): The pipeline step, used for usage accounting.
+
+        Returns:
+            BaseModel: The structured response from OpenAI.
+        """
+        messages = as_messages(prompt)
+        key, cached = await self.cache_lookup(messages, step, structure)
+        if cached is not None:
+            return cached
+        completion = await self.resilience.call(
+            step,
+            lambda: self.llm_client.beta.chat.completions.parse(
+                model=self.model_name,
+                messages=messages,
+                response_format=structure,
+            ),
+        )
+        self.record_usage(step, completion.usage)
+        response = completion.choices[0].message.parsed
+        await self.cache_store(key, response)
+        return response
+
+    async def chat(self, client_utterance: str) -> str:
+        """
+        Run a turn and return the whole reply, for callers that do not stream.
+
+        Args:
+            client_utterance (str): The latest dialogue from the user.
+
+        Returns:
+            str: The assistant's reply.
+        """
+        return "".join([chunk async for chunk in self.process_dialogue(client_utterance)])
+
+    def store_memory(self, cognitive_distortion, utterence_insight: str):
+        """
+        Enqueue the detected cognitive distortion and insight of a turn, tagged
+        with the session id, for a background write.
+
+        Args:
+            cognitive_distortion (CognitiveDistortion): The detected cognitive distortion.
+            utterence_insight (str): The extracted insight.
+        """
+        if cognitive_distortion.distortion_type != "None":
+            self.memory_writer.add(
+                self.cd_memory,
+                cognitive_distortion.utterance,
+                metadata=self.memory_metadata(**dict(cognitive_distortion)),
+            )
+            self.cd_memory_count += 1
+            self.memory_writes += 1
+
+        if utterence_insight != "None":
+            self.memory_writer.add(
+                self.basic_memory, utterence_insight, metadata=self.memory_metadata()
+            )
+            self.memory_writes += 1
+
+    def snapshot(self, include_memory: bool = False) -> dict:
+        state = super().snapshot(include_memory)
+        # Memories still queued for writing are not counted by the backend yet.
+        state["cd_memory_count"] = self.cd_memory_count
+        return state
+
+    def restore(self, state: dict):
+        super().restore(state)
+        if "memory" in state:
+            self.cd_memory_count = self.memory_count(self.cd_memory)
+        self.cd_memory_count = max(self.cd_memory_count, state.get("cd_memory_count", 0))
+
+    async def consolidate_memory(self):
+        """
+        Write the pending memories, then merge near-duplicates of this session
+        and cap their number in a worker thread.
+        """
+        try:
+            await self.memory_writer.flush()
+            await asyncio.to_thread(super().consolidate_memory)
+        except Exception as e:
+            logger.warning("Memory consolidation failed: %s", e)
+
+    async def update_summary(self):
+        """
+        Fold the messages that left the recent window into the rolling summary.
+        """
+        summary, dialogue, folded = self.context.summary_input()
+        try:
+            new_summary = await self.response_from_opanai(
+                CBTPrompt.summarize_context(summary=summary, dialogue=dialogue),
+                step="summary",
+            )
+        except Exception as e:
+            # The pending messages stay in the context and are retried next turn.
+            logger.warning("Summary update failed: %s", e)
+            return
+        self.context.apply_summary(new_summary, folded)
+
+    async def retrieve_memory(
+        self, cd_star: str, latest_dialogue: str, n_results: int = 3
+    ) -> RetrievedMemory:
+        # Flush first so the query sees every write from earlier turns.
+        try:
+            await self.memory_writer.flush()
+        except Exception as e:
+            # A failed memory write must not fail the turn; the query sees
+            # whatever is already persisted.
+            logger.warning("Memory flush failed, retrieving without pending writes: %s", e)
+        return await asyncio.to_thread(
+            super().retrieve_memory, cd_star, latest_dialogue, n_results
+        )
+
+    async def process_dialogue(self, client_utterance: str, plan: bool = True):
+        """
+        Process a single dialogue message and stream the assistant's reply.
+
+        Args:
+            client_utterance (str): The latest dialogue from the user.
+            plan (bool): Select a CBT technique and stage for the reply; False
+                serves a degraded turn that answers without them, to shed load.
+
+        Yields:
+            str: The chunks of the assistant's reply.
+        """
+        self.trace = TurnTrace(self.session_id, sample_rate=self.trace_sample_rate)
+        self.turn_timings = dict()
+        self.chat_history.append({"role": "user", "content": client_utterance})
+
+        latest_dialogue = "".join([json.dumps(item) for item in self.chat_history[-4:]])
+
+        analysis = None
+        neutral = self.neutral_analysis(client_utterance)
+        if neutral is None and self.fused_analysis:
+            analysis = await self._timed(
+                "turn_analysis", self.analyze_turn(client_utterance)
+            )
+
+        if neutral is not None:
+            cognitive_distortion, utterence_insight = neutral
+        elif analysis is not None:
+            cognitive_distortion = analysis.cognitive_distortion
+            utterence_insight = analysis.insight
+        else:
+            # Detection and insight extraction only need the utterance.
+            cognitive_distortion, utterence_insight = await asyncio.gather(
+                self._timed(
+                    "detection", self.detect_cognitive_distortion(client_utterance)
+                ),
+                self._timed("insight", self.extract_insight(client_utterance)),
+            )
+        logger.debug("Detected cognitive distortion: %s", cognitive_distortion)
+        logger.debug("Extracted insight: %s", utterence_insight)
+
+        with self.trace.span("memory_enqueue"):
+            self.store_memory(cognitive_distortion, utterence_insight)
+        self.last_turn = {
+            "cognitive_distortion": cognitive_distortion.model_dump(),
+            "insight": utterence_insight,
+            "technique": None,
+            "stage": None,
+            "degraded": not plan,
+        }
+
+        ai_response = ""
+        planning, speculation = None, None
+        try:
+            if self.cd_memory_count < 1 or not plan:
+                final_prompt = CBTPrompt.final_prompt(latest_dialogue)
+                chunks = self.stream_from_opanai(prompt=final_prompt)
+            else:
+                cd_star = cognitive_distortion.distortion_type
+                planning = asyncio.ensure_future(
+                    self._plan_turn(cd_star, latest_dialogue, analysis)
+                )
+                if self.speculative and analysis is None and self.last_plan is not None:
+                    # Stream with the previous plan until the new one is ready.
+                    speculated_technique, speculated_stage = self.last_plan
+                    speculation = SpeculativeStream(
+                        self.stream_from_opanai(
+                            CBTPrompt.final_prompt(
+                                latest_dialogue=latest_dialogue,
+                                technique=speculated_technique,
+                                stage=speculated_stage,
+                                distortion_type=cd_star,
+                            )
+                        )
+                    )
+                    with self.trace.span("speculative_streaming"):
+                        async for chunk in speculation.until(planning):
+                            if not ai_response:
+                                self.turn_timings["ttft"] = self.trace.mark("ttft")
+                            ai_response += chunk
+                            yield chunk
+
+                cbt_technique, cbt_stage = await planning
+                final_prompt = CBTPrompt.final_prompt(
+                    latest_dialogue=latest_dialogue,
+                    technique=cbt_technique,
+                    stage=cbt_stage,
+                    distortion_type=cd_star,
+                )
+                # The plan that the reply is actually written under.
+                reply_plan = (cbt_technique, cbt_stage)
+
+                if speculation is None:
+                    chunks = self.stream_from_opanai(prompt=final_prompt)
+                elif speculation.error is None and self.last_plan == reply_plan:
+                    self._record_speculation("hit")
+                    chunks = speculation.rest()
+                elif speculation.complete:
+                    # The client already has a complete reply under the old plan.
+                    self._record_speculation("miss")
+                    reply_plan = self.last_plan
+                    chunks = speculation.rest()
+                else:
+                    # Continue what the client has already seen under the new plan.
+                    self._record_speculation(
+                        "error" if speculation.error is not None else "miss"
+                    )
+                    speculation.cancel()
+                    if ai_response:
+                        final_prompt = CBTPrompt.continue_reply(final_prompt, ai_response)
+                    chunks = self.stream_from_opanai(prompt=final_prompt)
+                self.cbt_usage_log[reply_plan[0]] = reply_plan[1]
+                self.last_turn.update(technique=reply_plan[0], stage=reply_plan[1])
+                self.last_plan = (cbt_technique, cbt_stage)
+            self.turn_timings["planning"] = self.trace.mark("planning")
+
+            with self.trace.span("streaming"):
+                async for chunk in chunks:
+                    if not ai_response:
+                        self.turn_timings["ttft"] = self.trace.mark("ttft")
+                    ai_response += chunk
+                    yield chunk
+        finally:
+            # Nothing keeps running upstream once the client has gone.
+            if planning is not None:
+                planning.cancel()
+            if speculation is not None:
+                speculation.cancel()
+        self.turn_timings["total"] = self.trace.mark("total")
+
+        self.chat_history.append({"role": "assistant", "content": ai_response})
+        logger.debug("Last chat_history: %s", self.chat_history[-1])
+        self.trace.log()
+
+        # Summarize in the background; until then the folded messages are
+        # still part of the rendered context.
+        if self.context.trim() and (self.summary_task is None or self.summary_task.done()):
+            self.summary_task = asyncio.create_task(self.update_summary())
+        if self.consolidation_due() and (
+            self.consolidation_task is None or self.consolidation_task.done()
+        ):
+            self.consolidation_task = asyncio.create_task(self.consolidate_memory())
+
+    async def aclose(self):
+        """
+        Flush pending memory writes, finish the summary update and consolidate
+        the session's memories when the session is closed. Safe to call more
+        than once; later calls wait for the first one.
+        """
+        if self.close_task is None:
+            self.close_task = asyncio.ensure_future(self._close())
+        await asyncio.shield(self.close_task)
+
+    async def _close(self):
+        try:
+            for task in (self.summary_task, self.consolidation_task):
+                if task is None:
+                    continue
+                try:
+                    await task
+                except Exception as e:
+                    logger.warning("Background task of session %s failed: %s", self.session_id, e)
+            if self.memory_consolidator is not None and self.memory_writes:
+                await self.consolidate_memory()
+        finally:
+            # Whatever happened above, pending writes land before the session goes.
+            await self.memory_writer.close()
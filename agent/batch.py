@@ -0,0 +1,206 @@
+import asyncio
+import json
+import logging
+import os
+
+from agent.async_cocoa import AsyncCoCoAgent
+from agent.resilience import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+def load_corpus(path: str) -> list:
+    """
+    Load a JSONL corpus of conversations.
+
+    Each line is an object with an optional ``id`` and the client turns in
+    ``turns``: a list of utterances, or of chat messages of which only the
+    ``user`` ones are replayed.
+
+    Args:
+        path (str): Path of the corpus.
+
+    Returns:
+        list[tuple[str, list[str]]]: The conversation ids and their client utterances.
+    """
+    conversations = list()
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            turns = [
+                turn if isinstance(turn, str) else turn["content"]
+                for turn in record.get("turns", record.get("messages", []))
+                if isinstance(turn, str) or turn.get("role", "user") == "user"
+            ]
+            conversations.append((str(record.get("id", f"line-{number}")), turns))
+    return conversations
+
+
+def completed_conversations(path: str) -> set:
+    """
+    Find the conversations an earlier run finished and drop the records of
+    the ones it left half-done, so they can be replayed from the start.
+
+    Args:
+        path (str): Path of the output JSONL.
+
+    Returns:
+        set[str]: The ids of the finished conversations.
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path, "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    done = {record["conversation_id"] for record in records if record.get("done")}
+    kept = [record for record in records if record["conversation_id"] in done]
+    if len(kept) != len(records):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(record) + "\n" for record in kept)
+        os.replace(tmp_path, path)
+    return done
+
+
+class BatchRunner:
+    """Replays a corpus of conversations through AsyncCoCoAgent.
+
+    Every conversation gets its own agent, whose session id is the
+    conversation id, so memories never leak between conversations. Up to
+    ``concurrency`` conversations run at once and client turns start at no
+    more than ``turns_per_second``. Each turn is appended to the output JSONL
+    as soon as it completes, followed by a ``done`` record per conversation;
+    a rerun skips the conversations that are done.
+    """
+
+    def __init__(
+        self,
+        agent_factory,
+        output_path: str,
+        concurrency: int = 8,
+        turns_per_second: float = None,
+    ):
+        """
+        Initialize the runner.
+
+        Args:
+            agent_factory (Callable[[str], AsyncCoCoAgent]): Creates the agent of a
+                conversation from its id.
+            output_path (str): Path of the output JSONL.
+            concurrency (int): Maximum number of conversations replayed at once.
+            turns_per_second (float): Optional limit on the rate of client turns.
+        """
+        self.agent_factory = agent_factory
+        self.output_path = output_path
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.rate_limiter = RateLimiter(turns_per_second) if turns_per_second else None
+        self.counters = {"conversations": 0, "turns": 0, "failed": 0, "skipped": 0}
+        self._output = None
+
+    def _write(self, record: dict):
+        self._output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._output.flush()
+
+    async def run(self, conversations: list) -> dict:
+        """
+        Replay the conversations that are not finished yet.
+
+        Args:
+            conversations (list[tuple[str, list[str]]]): The conversations, as
+                returned by load_corpus.
+
+        Returns:
+            dict: How many conversations and turns were replayed, failed or skipped.
+        """
+        done = completed_conversations(self.output_path)
+        pending = [(id, turns) for id, turns in conversations if id not in done]
+        self.counters["skipped"] = len(conversations) - len(pending)
+        with open(self.output_path, "a", encoding="utf-8") as self._output:
+            await asyncio.gather(
+                *(self.replay(id, turns) for id, turns in pending)
+            )
+        return dict(self.counters)
+
+    async def replay(self, conversation_id: str, turns: list):
+        """
+        Replay one conversation in a fresh agent.
+
+        Args:
+            conversation_id (str): The conversation id, used as the session id.
+            turns (list[str]): The client utterances.
+        """
+        async with self.semaphore:
+            agent = self.agent_factory(conversation_id)
+            records = list()
+            try:
+                try:
+                    # A replay of a half-done conversation starts from empty memory.
+                    for collection in (agent.basic_memory, agent.cd_memory):
+                        await asyncio.to_thread(collection.delete, where=agent.memory_filter)
+                    agent.cd_memory_count = 0
+                    for number, utterance in enumerate(turns):
+                        if self.rate_limiter is not None:
+                            await self.rate_limiter.acquire()
+                        tokens_before = agent.usage.totals()
+                        reply = ""
+                        async for chunk in agent.process_dialogue(utterance):
+                            reply += chunk
+                        tokens_after = agent.usage.totals()
+                        record = {
+                            "conversation_id": conversation_id,
+                            "turn": number,
+                            "utterance": utterance,
+                            **agent.last_turn,
+                            "reply": reply,
+                            "timings": agent.turn_timings,
+                            "tokens": {
+                                field: tokens_after[field] - tokens_before[field]
+                                for field in ("prompt_tokens", "cached_tokens", "completion_tokens")
+                            },
+                        }
+                        self._write(record)
+                        self.counters["turns"] += 1
+                        records.append(record)
+                finally:
+                    # Flushes memory writes and the summary even if a turn failed.
+                    await agent.aclose()
+            except Exception as e:
+                logger.exception("Conversation %s failed", conversation_id)
+                self._write({"conversation_id": conversation_id, "error": str(e)})
+                self.counters["failed"] += 1
+                return
+            self._write(
+                {
+                    "conversation_id": conversation_id,
+                    "done": True,
+                    "turns": len(records),
+                    "usage": agent.usage.totals(),
+                }
+            )
+            self.counters["conversations"] += 1
+
+
+def default_agent_factory(api_key: str, **agent_kwargs):
+    """
+    Build an agent factory that shares one LLM client and memory backend.
+
+    Args:
+        api_key (str): The OpenAI API key.
+        **agent_kwargs: Extra AsyncCoCoAgent arguments.
+
+    Returns:
+        Callable[[str], AsyncCoCoAgent]: The factory.
+    """
+    from agent.clients import get_async_llm_client
+    from memory.backends import create_memory_backend
+
+    llm_client = get_async_llm_client(api_key)
+    memory_backend = create_memory_backend()
+    return lambda conversation_id: AsyncCoCoAgent(
+        api_key,
+        session_id=conversation_id,
+        llm_client=llm_client,
+        memory_backend=memory_backend,
+        **agent_kwargs,
+    )
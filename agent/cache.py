@@ -0,0 +1,204 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """A content-addressed cache for deterministic LLM responses.
+
+    Entries are keyed by the hash of (model, messages, response schema) and
+    live in an in-memory LRU tier, optionally backed by an on-disk SQLite tier
+    that survives restarts and can be shared between worker processes. Both
+    tiers are size-bounded and entries expire after ``ttl_seconds``.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        ttl_seconds: float = 3600,
+        sqlite_path: str = None,
+        sqlite_max_entries: int = 100000,
+        clock=time.time,
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries (int): Maximum number of entries kept in memory.
+            ttl_seconds (float): Lifetime of an entry.
+            sqlite_path (str): Optional path of the SQLite database of the disk tier.
+            sqlite_max_entries (int): Maximum number of entries kept on disk.
+            clock (Callable[[], float]): Wall clock, overridable for testing.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.sqlite_max_entries = sqlite_max_entries
+        self.clock = clock
+        self.counters = {
+            "hits": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "evictions": 0,
+            "expired": 0,
+        }
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS response_cache_accessed "
+                "ON response_cache (accessed_at)"
+            )
+            self._db.commit()
+
+    @property
+    def on_disk(self) -> bool:
+        """Whether lookups may read, and sets write, the SQLite tier."""
+        return self._db is not None
+
+    @staticmethod
+    def make_key(model: str, messages: list, structure=None) -> str:
+        """
+        Hash a request into a cache key.
+
+        Args:
+            model (str): The model name.
+            messages (list[dict]): The chat messages.
+            structure (type[BaseModel]): The response schema of structured calls.
+
+        Returns:
+            str: The hex digest identifying the request.
+        """
+        schema = structure.model_json_schema() if structure is not None else None
+        payload = json.dumps(
+            {"model": model, "messages": messages, "schema": schema},
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """
+        Look up a cached response.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            str: The cached response, or None on a miss.
+        """
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.counters["hits"] += 1
+                    self.counters["memory_hits"] += 1
+                    return value
+                del self._entries[key]
+                self.counters["expired"] += 1
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM response_cache WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row is not None:
+                    value, expires_at = row
+                    if expires_at > now:
+                        self._db.execute(
+                            "UPDATE response_cache SET accessed_at = ? WHERE key = ?",
+                            (now, key),
+                        )
+                        self._db.commit()
+                        self._remember(key, value, expires_at)
+                        self.counters["hits"] += 1
+                        self.counters["disk_hits"] += 1
+                        return value
+                    self._db.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                    self._db.commit()
+                    self.counters["expired"] += 1
+
+            self.counters["misses"] += 1
+            return None
+
+    def set(self, key: str, value: str):
+        """
+        Store a response.
+
+        Args:
+            key (str): The cache key.
+            value (str): The response, serialized as a string.
+        """
+        now = self.clock()
+        expires_at = now + self.ttl_seconds
+        with self._lock:
+            self._remember(key, value, expires_at)
+            self.counters["sets"] += 1
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?)",
+                        (key, value, expires_at, now),
+                    )
+                    # Counting rows scans the table, so trim only now and then.
+                    if self.counters["sets"] % 100 == 0:
+                        self._trim_disk(now)
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.warning("Response cache disk write failed: %s", e)
+
+    def _remember(self, key: str, value: str, expires_at: float):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def _trim_disk(self, now: float):
+        self._db.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+        (count,) = self._db.execute("SELECT COUNT(*) FROM response_cache").fetchone()
+        excess = count - self.sqlite_max_entries
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM response_cache WHERE key IN ("
+                "SELECT key FROM response_cache ORDER BY accessed_at LIMIT ?)",
+                (excess,),
+            )
+            self.counters["evictions"] += excess
+
+    def stats(self) -> dict:
+        """
+        Report hit/miss counters and the size of each tier.
+
+        Returns:
+            dict: Counters suitable for JSON serialization.
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            stats["memory_entries"] = len(self._entries)
+            if self._db is not None:
+                (stats["disk_entries"],) = self._db.execute(
+                    "SELECT COUNT(*) FROM response_cache"
+                ).fetchone()
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
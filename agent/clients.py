@@ -0,0 +1,57 @@
+import os
+import threading
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+_async_clients = {}
+_lock = threading.Lock()
+
+
+def get_async_llm_client(
+    api_key: str = None,
+    max_connections: int = None,
+    max_keepalive_connections: int = None,
+) -> AsyncOpenAI:
+    """
+    Return the process-wide AsyncOpenAI client for the given API key.
+
+    All agents share one client, so every session reuses the same pool of
+    keep-alive HTTP connections instead of opening its own. The client does
+    not retry by itself; retries are left to the ResilientCaller.
+
+    Args:
+        api_key (str): The API key for accessing the OpenAI service.
+        max_connections (int): Upper bound on open connections in the pool.
+        max_keepalive_connections (int): Upper bound on idle connections kept open.
+
+    Returns:
+        AsyncOpenAI: The shared client.
+    """
+    with _lock:
+        client = _async_clients.get(api_key)
+        if client is None:
+            limits = httpx.Limits(
+                max_connections=max_connections
+                or int(os.getenv("COCOA_HTTP_MAX_CONNECTIONS", "200")),
+                max_keepalive_connections=max_keepalive_connections
+                or int(os.getenv("COCOA_HTTP_MAX_KEEPALIVE", "50")),
+            )
+            client = AsyncOpenAI(
+                api_key=api_key,
+                max_retries=0,
+                http_client=DefaultAsyncHttpxClient(limits=limits),
+            )
+            _async_clients[api_key] = client
+        return client
+
+
+async def close_async_llm_clients():
+    """
+    Close every shared AsyncOpenAI client and its connection pool.
+    """
+    with _lock:
+        clients = list(_async_clients.values())
+        _async_clients.clear()
+    for client in clients:
+        await client.close()
@@ -1,13 +1,19 @@
 import json
 import logging
+import time
 import uuid
-from collections import defaultdict
-
-import chromadb
-from openai import OpenAI
 
+from agent.context import ConversationContext
+from agent.session_store import SNAPSHOT_VERSION
+from agent.tracing import current_span
+from agent.usage import UsageTracker, process_usage
+from memory.backends import ChromaMemoryBackend
 from prompts.prompts import CBTPrompt
-from prompts.structured_outputs import CognitiveDistortion, StageExample
+from prompts.structured_outputs import (
+    CognitiveDistortion,
+    RetrievedMemory,
+    StageExample,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -17,59 +23,216 @@ logger = logging.getLogger(__name__)
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
 
+def as_messages(prompt) -> list:
+    """
+    Normalize a prompt to a list of chat messages.
+
+    Args:
+        prompt (str | list[dict]): A plain prompt or the messages built by CBTPrompt.
+
+    Returns:
+        list[dict]: The chat messages.
+    """
+    if isinstance(prompt, str):
+        return [{"role": "user", "content": prompt}]
+    return list(prompt)
+
+
+def nearest_results(result: dict, n_results: int) -> list:
+    """
+    Merge the per-query results of a collection query into one ranking.
+
+    Args:
+        result (dict): The result of ``collection.query`` for several query texts.
+        n_results (int): How many results to keep.
+
+    Returns:
+        list[tuple[float, str, dict]]: The closest (distance, document, metadata)
+            triples, each memory at most once.
+    """
+    best = dict()
+    for ids, documents, metadatas, distances in zip(
+        result["ids"], result["documents"], result["metadatas"], result["distances"]
+    ):
+        for id, document, metadata, distance in zip(ids, documents, metadatas, distances):
+            if id not in best or distance < best[id][0]:
+                best[id] = (distance, document, metadata or {})
+    return sorted(best.values(), key=lambda item: item[0])[:n_results]
+
+
 class CoCoAgent:
     """CoCoAgent is a conversational agent that interacts with users and detects cognitive distortions
     in their dialogue using OpenAI's language model.
     """
 
-    def __init__(self, api_key):
+    def __init__(
+        self,
+        api_key,
+        session_id: str = "default",
+        llm_client=None,
+        context_max_tokens: int = 2000,
+        response_cache=None,
+        neutral_gate=None,
+        memory_backend=None,
+        memory_consolidator=None,
+        consolidate_every: int = 8,
+        usage_meter=None,
+    ):
         """
         Initialize the CoCoAgent with the given API key.
 
         Args:
             api_key (str): The API key for accessing the OpenAI service.
+            session_id (str): Identifier of the conversation this agent serves.
+            llm_client (OpenAI): Optional client shared between agents.
+            context_max_tokens (int): Token budget of the recent conversation window;
+                older turns are folded into a rolling summary.
+            response_cache (ResponseCache): Optional cache for the deterministic
+                (non-streamed) calls.
+            neutral_gate (NeutralUtteranceGate): Optional local gate that skips
+                distortion detection and insight extraction for neutral utterances.
+            memory_backend (MemoryBackend): Where basic_memory and cd_memory are kept,
+                defaults to an in-process ephemeral Chroma client.
+            memory_consolidator (MemoryConsolidator): Optional pass that merges
+                near-duplicate memories of the session and caps their number.
+            consolidate_every (int): Number of memory writes between consolidations.
+            usage_meter (AdmissionController): Optional process-wide accounting that
+                receives the usage of every completion with the session id.
         """
         self.model_name = "gpt-4o-mini"
-        self.llm_client = OpenAI(api_key=api_key)
-        self.chroma_client = chromadb.Client()
+        self.session_id = session_id
+        if llm_client is None:
+            from openai import OpenAI
+
+            llm_client = OpenAI(api_key=api_key)
+        self.llm_client = llm_client
+        self.response_cache = response_cache
+        self.neutral_gate = neutral_gate
+        self.memory_backend = memory_backend or ChromaMemoryBackend()
+        self.memory_consolidator = memory_consolidator
+        self.consolidate_every = consolidate_every
+        self.usage_meter = usage_meter
+        self.memory_writes = 0
         self.cbt_usage_log = dict()
-        self.cbt_usage_log = defaultdict(lambda: ["not_started_yet"])
 
+        self.usage = UsageTracker(parent=process_usage)
         self.chat_history = list()
-        self.basic_memory = self.chroma_client.get_or_create_collection(
-            name="basic_memory"
+        self.context = ConversationContext(
+            self.chat_history, max_tokens=context_max_tokens
         )
-        self.cd_memory = self.chroma_client.get_or_create_collection(name="cd_memory")
+        self.basic_memory = self.memory_backend.get_collection("basic_memory")
+        self.cd_memory = self.memory_backend.get_collection("cd_memory")
 
+        # Reads the doc on the first agent of the process only.
         CBTPrompt.load_docs()
         # logger.info("CoCoAgent initialized with model: %s", self.model_name)
 
-    def response_from_opanai(self, prompt: str) -> str:
+    def final_messages(self, prompt) -> list:
+        """
+        Place the conversation context between the static system prefix of the
+        final prompt and its per-turn instructions.
+
+        Args:
+            prompt (str | list[dict]): The final prompt.
+
+        Returns:
+            list[dict]: The messages to stream the reply from.
+        """
+        messages = as_messages(prompt)
+        prefix = 0
+        while prefix < len(messages) and messages[prefix]["role"] == "system":
+            prefix += 1
+        return [*messages[:prefix], *self.context.messages(), *messages[prefix:]]
+
+    def record_usage(self, step: str, usage):
+        """
+        Record the usage of a completion for the session and the open span.
+
+        Args:
+            step (str): The pipeline step that made the call.
+            usage (CompletionUsage): The ``usage`` of the completion, may be None.
+        """
+        self.usage.record(step, usage)
+        if self.usage_meter is not None:
+            self.usage_meter.record_usage(self.session_id, usage)
+        span = current_span()
+        if span is not None:
+            span.add_usage(usage)
+
+    def cache_lookup(self, messages: list, step: str, structure=None):
+        """
+        Look up a deterministic call in the response cache.
+
+        Args:
+            messages (list[dict]): The chat messages of the call.
+            step (str): The pipeline step, used for usage accounting.
+            structure (type[BaseModel]): The response schema of structured calls.
+
+        Returns:
+            tuple[str, Any]: The cache key (None without a cache) and the cached
+                response (None on a miss).
+        """
+        if self.response_cache is None:
+            return None, None
+        key = self.response_cache.make_key(self.model_name, messages, structure)
+        cached = self.response_cache.get(key)
+        if cached is None:
+            return key, None
+        self.usage.record_cache_hit(step)
+        span = current_span()
+        if span is not None:
+            span.cache_hits += 1
+        if structure is not None:
+            return key, structure.model_validate_json(cached)
+        return key, cached
+
+    def cache_store(self, key: str, response):
+        """
+        Store the response of a deterministic call in the response cache.
+
+        Args:
+            key (str): The key returned by cache_lookup.
+            response (str | BaseModel): The response, refusals (None) are not cached.
+        """
+        if key is None or response is None:
+            return
+        if not isinstance(response, str):
+            response = response.model_dump_json()
+        self.response_cache.set(key, response)
+
+    def response_from_opanai(self, prompt, step: str = "response") -> str:
         """
         Generate a response from OpenAI for the given prompt.
 
         Args:
-            prompt (str): The prompt to send to OpenAI.
+            prompt (str | list[dict]): The prompt to send to OpenAI.
+            step (str): The pipeline step, used for usage accounting.
 
         Returns:
             str: The response from OpenAI.
         """
         # logger.info("Generating response from OpenAI for prompt: %s", prompt)
+        messages = as_messages(prompt)
+        key, cached = self.cache_lookup(messages, step)
+        if cached is not None:
+            return cached
         completion = self.llm_client.chat.completions.create(
             model=self.model_name,
-            messages=[{"role": "user", "content": prompt}],
+            messages=messages,
             temperature=0,
         )
+        self.record_usage(step, completion.usage)
         response = completion.choices[0].message.content
+        self.cache_store(key, response)
         # logger.info("Received response: %s", response)
         return response
 
-    def stream_from_opanai(self, prompt: str):
+    def stream_from_opanai(self, prompt):
         """
         Stream a response from OpenAI for the given prompt.
 
         Args:
-            prompt (str): The prompt to send to OpenAI.
+            prompt (str | list[dict]): The prompt to send to OpenAI.
 
         Returns:
             str: The response from OpenAI.
@@ -77,36 +240,44 @@ class CoCoAgent:
         # logger.info("Generating response from OpenAI for prompt: %s", prompt)
         completion = self.llm_client.chat.completions.create(
             model=self.model_name,
-            messages=[
-                *self.chat_history,
-                {"role": "user", "content": prompt},
-            ],
+            messages=self.final_messages(prompt),
             temperature=0.5,
             stream=True,
+            stream_options={"include_usage": True},
         )
         for chunk in completion:
-            if chunk.choices[0].delta.content:
+            if chunk.usage is not None:
+                self.record_usage("response", chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
                 yield chunk.choices[0].delta.content
 
-    def structured_response_from_openai(self, prompt, structure):
+    def structured_response_from_openai(
+        self, prompt, structure, step: str = "structured"
+    ):
         """
         Generate a structured response from OpenAI for the given prompt.
 
         Args:
-            prompt (str): The prompt to send to OpenAI.
+            prompt (str | list[dict]): The prompt to send to OpenAI.
+            structure (type[BaseModel]): The pydantic model to parse the response into.
+            step (str): The pipeline step, used for usage accounting.
 
         Returns:
             CognitiveDistortion: The structured response from OpenAI.
         """
         # logger.info("Generating structured response from OpenAI for prompt: %s", prompt)
+        messages = as_messages(prompt)
+        key, cached = self.cache_lookup(messages, step, structure)
+        if cached is not None:
+            return cached
         completion = self.llm_client.beta.chat.completions.parse(
             model=self.model_name,
-            messages=[
-                {"role": "user", "content": prompt},
-            ],
+            messages=messages,
             response_format=structure,
         )
+        self.record_usage(step, completion.usage)
         response = completion.choices[0].message.parsed
+        self.cache_store(key, response)
         # logger.info("Received structured response: %s", response)
         return response
 
@@ -122,7 +293,7 @@ class CoCoAgent:
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": CBTPrompt.static},
-                *self.chat_history,
+                *self.context.messages(),
             ],
             temperature=0,
         )
@@ -130,6 +301,23 @@ class CoCoAgent:
         # logger.info("Received chat response: %s", chat_response)
         return chat_response
 
+    def neutral_analysis(self, client_utterance: str):
+        """
+        Short-circuit the analysis of an utterance the neutral gate is confident about.
+
+        Args:
+            client_utterance (str): The latest dialogue from the user.
+
+        Returns:
+            tuple[CognitiveDistortion, str]: A "None" distortion and insight, or None
+                if the utterance has to go to the LLM.
+        """
+        if self.neutral_gate is None or not self.neutral_gate.is_neutral(
+            client_utterance
+        ):
+            return None
+        return CognitiveDistortion(distortion_type="None", utterance="", score=0), "None"
+
     def detect_cognitive_distortion(self, latest_dialogue):
         """
         Detect cognitive distortions in the latest dialogue.
@@ -143,6 +331,7 @@ class CoCoAgent:
         return self.structured_response_from_openai(
             CBTPrompt.cognitive_distortion_detection(latest_dialogue),
             CognitiveDistortion,
+            step="detection",
         )
 
     def cbt_stage_and_example(self, technique: str, latest_dialogue: str):
@@ -159,6 +348,7 @@ class CoCoAgent:
                 latest_dialogue=latest_dialogue,
             ),
             StageExample,
+            step="stage_selection",
         )
 
     def extract_insight(self, latest_dialogue):
@@ -171,7 +361,9 @@ class CoCoAgent:
         Returns:
             str: The extracted insights.
         """
-        return self.response_from_opanai(CBTPrompt.extract_insight(latest_dialogue))
+        return self.response_from_opanai(
+            CBTPrompt.extract_insight(latest_dialogue), step="insight"
+        )
 
     def select_cbt_technique(self, distortion_type):
         """
@@ -182,22 +374,219 @@ class CoCoAgent:
         """
         return self.response_from_opanai(
             CBTPrompt.technique_selection(
-                distortion_type=distortion_type, memory=self.chat_history
-            )
+                distortion_type=distortion_type, memory=self.context.render()
+            ),
+            step="technique_selection",
+        )
+
+    def update_summary(self):
+        """
+        Fold the messages that left the recent window into the rolling summary.
+        """
+        summary, dialogue, folded = self.context.summary_input()
+        self.context.apply_summary(
+            self.response_from_opanai(
+                CBTPrompt.summarize_context(summary=summary, dialogue=dialogue),
+                step="summary",
+            ),
+            folded,
         )
 
+    @property
+    def memory_filter(self) -> dict:
+        """The metadata filter that restricts memory queries to this session."""
+        return {"session_id": self.session_id}
+
+    def memory_metadata(self, **fields) -> dict:
+        """
+        Build the metadata of a new memory of this session.
+
+        Args:
+            **fields: Extra metadata fields.
+
+        Returns:
+            dict: The fields tagged with the session id and creation time.
+        """
+        return {**fields, **self.memory_filter, "created_at": time.time()}
+
+    def memory_count(self, collection) -> int:
+        """
+        Count the memories of this session in a collection.
+
+        Args:
+            collection (Collection): basic_memory or cd_memory.
+
+        Returns:
+            int: The number of memories.
+        """
+        return len(collection.get(where=self.memory_filter, include=[])["ids"])
+
     def retrieve_memory(
         self, cd_star: str, latest_dialogue: str, n_results: int = 3
-    ) -> str:
+    ) -> RetrievedMemory:
+        """
+        Retrieve this session's memories closest to the distortion and the dialogue.
+
+        Both query texts are embedded once and the embeddings are reused for
+        basic_memory and cd_memory.
+
+        Args:
+            cd_star (str): The detected cognitive distortion type.
+            latest_dialogue (str): The latest turns of the conversation.
+            n_results (int): How many memories to return from each collection.
+
+        Returns:
+            RetrievedMemory: The closest insights and cognitive distortions.
+        """
+        query_embeddings = self.memory_backend.embed([cd_star, latest_dialogue])
         b_k = self.basic_memory.query(
-            query_texts=[cd_star, latest_dialogue],
+            query_embeddings=query_embeddings,
             n_results=n_results,
+            where=self.memory_filter,
         )
         d_k = self.cd_memory.query(
-            query_texts=[cd_star, latest_dialogue],
+            query_embeddings=query_embeddings,
             n_results=n_results,
+            where=self.memory_filter,
+        )
+        distortion_fields = CognitiveDistortion.model_fields
+        return RetrievedMemory(
+            insights=[document for _, document, _ in nearest_results(b_k, n_results)],
+            distortions=[
+                CognitiveDistortion(
+                    **{k: v for k, v in metadata.items() if k in distortion_fields}
+                )
+                for _, _, metadata in nearest_results(d_k, n_results)
+            ],
+        )
+
+    def store_memory(self, cognitive_distortion, utterence_insight: str):
+        """
+        Store the detected cognitive distortion and insight of a turn, tagged
+        with the session id.
+
+        Args:
+            cognitive_distortion (CognitiveDistortion): The detected cognitive distortion.
+            utterence_insight (str): The extracted insight.
+        """
+        if cognitive_distortion.distortion_type != "None":
+            self.cd_memory.upsert(
+                documents=[cognitive_distortion.utterance],
+                ids=[f"{uuid.uuid4()}"],
+                metadatas=[self.memory_metadata(**dict(cognitive_distortion))],
+            )
+            self.memory_writes += 1
+
+        if utterence_insight != "None":
+            self.basic_memory.upsert(
+                documents=[utterence_insight],
+                ids=[f"{uuid.uuid4()}"],
+                metadatas=[self.memory_metadata()],
+            )
+            self.memory_writes += 1
+
+        if self.consolidation_due():
+            self.consolidate_memory()
+
+    def consolidation_due(self) -> bool:
+        """
+        Decide whether enough memories were written since the last consolidation.
+
+        Returns:
+            bool: True if a consolidation pass should run.
+        """
+        return (
+            self.memory_consolidator is not None
+            and self.memory_writes >= self.consolidate_every
         )
-        return "\n".join(b_k["documents"][0]) + "\n" + str(d_k["metadatas"][0])
+
+    def consolidate_memory(self):
+        """
+        Merge near-duplicate memories of this session and cap their number.
+        """
+        self.memory_writes = 0
+        for collection in (self.basic_memory, self.cd_memory):
+            self.memory_consolidator.consolidate(collection, self.session_id)
+
+    def snapshot(self, include_memory: bool = False) -> dict:
+        """
+        Capture the conversation state of the session.
+
+        Args:
+            include_memory (bool): Also export the session's memories with their
+                embeddings, for a session moving to a process that does not
+                share the memory backend.
+
+        Returns:
+            dict: A JSON-serializable snapshot that ``restore`` accepts.
+        """
+        state = {
+            "version": SNAPSHOT_VERSION,
+            "session_id": self.session_id,
+            "chat_history": list(self.chat_history),
+            "context": {
+                "summary": self.context.summary,
+                "pending": list(self.context.pending),
+            },
+            "cbt_usage_log": dict(self.cbt_usage_log),
+            "memory_writes": self.memory_writes,
+        }
+        if include_memory:
+            state["memory"] = dict()
+            for name, collection in (
+                ("basic_memory", self.basic_memory),
+                ("cd_memory", self.cd_memory),
+            ):
+                entries = collection.get(
+                    where=self.memory_filter,
+                    include=["documents", "metadatas", "embeddings"],
+                )
+                state["memory"][name] = {
+                    "ids": list(entries["ids"]),
+                    "documents": list(entries["documents"]),
+                    "metadatas": list(entries["metadatas"]),
+                    "embeddings": [
+                        [float(value) for value in embedding]
+                        for embedding in entries["embeddings"]
+                    ],
+                }
+        return state
+
+    def restore(self, state: dict):
+        """
+        Continue a session from a snapshot.
+
+        Args:
+            state (dict): A snapshot taken by ``snapshot``.
+        """
+        if state.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported session snapshot version: {state.get('version')}")
+        # The context holds a reference to chat_history, so it is refilled in place.
+        self.chat_history[:] = state["chat_history"]
+        self.context.summary = state["context"]["summary"]
+        self.context.pending = list(state["context"]["pending"])
+        self.cbt_usage_log = dict(state["cbt_usage_log"])
+        self.memory_writes = state.get("memory_writes", 0)
+        # Memories of another session are copied under ids derived from this
+        # one; upserting the original ids would move them out of their session
+        # when both share a backend.
+        copied = state.get("session_id") != self.session_id
+        for name, entries in state.get("memory", dict()).items():
+            if not entries["ids"]:
+                continue
+            ids = entries["ids"]
+            if copied:
+                ids = [
+                    f"{uuid.uuid5(uuid.NAMESPACE_URL, f'{self.session_id}/{id}')}" for id in ids
+                ]
+            getattr(self, name).upsert(
+                ids=ids,
+                documents=entries["documents"],
+                metadatas=[
+                    {**metadata, **self.memory_filter} for metadata in entries["metadatas"]
+                ],
+                embeddings=entries["embeddings"],
+            )
 
     def process_dialogue(self, client_utterance: str):
         """
@@ -215,42 +604,36 @@ class CoCoAgent:
         latest_dialogue = "".join([json.dumps(item) for item in self.chat_history[-4:]])
         # logger.info("Latest dialogue: %s", latest_dialogue)
 
-        cognitive_distortion = self.detect_cognitive_distortion(client_utterance)
-        logger.info("Detected cognitive distortion: %s", cognitive_distortion)
-
-        utterence_insight = self.extract_insight(client_utterance)
-        logger.info("Extracted insight: %s", utterence_insight)
-
-        if cognitive_distortion.distortion_type != "None":
-            self.cd_memory.upsert(
-                documents=[cognitive_distortion.utterance],
-                ids=[f"{uuid.uuid4()}"],
-                metadatas=[dict(cognitive_distortion)],
-            )
+        neutral = self.neutral_analysis(client_utterance)
+        if neutral is not None:
+            cognitive_distortion, utterence_insight = neutral
+        else:
+            cognitive_distortion = self.detect_cognitive_distortion(client_utterance)
+            utterence_insight = self.extract_insight(client_utterance)
+        logger.debug("Detected cognitive distortion: %s", cognitive_distortion)
+        logger.debug("Extracted insight: %s", utterence_insight)
 
-        if utterence_insight != "None":
-            self.basic_memory.upsert(
-                documents=[utterence_insight], ids=[f"{uuid.uuid4()}"]
-            )
+        self.store_memory(cognitive_distortion, utterence_insight)
 
-        if self.cd_memory.count() < 1:
+        if self.memory_count(self.cd_memory) < 1:
             final_prompt = CBTPrompt.final_prompt(latest_dialogue)
         else:
             cd_star = cognitive_distortion.distortion_type
             relevant_memory = self.retrieve_memory(cd_star, latest_dialogue)
-            logger.info("Retrieved memory: %s", relevant_memory)
+            logger.debug("Retrieved memory: %s", relevant_memory)
 
             cbt_technique = self.select_cbt_technique(cd_star)
-            logger.info("Selected CBT technique: %s", cbt_technique)
+            logger.debug("Selected CBT technique: %s", cbt_technique)
 
             cbt_stage_example = self.cbt_stage_and_example(
-                technique=cbt_technique, latest_dialogue=self.chat_history
+                technique=cbt_technique, latest_dialogue=self.context.render()
             )
-            logger.info("Selected CBT stage and example: %s", cbt_stage_example)
+            logger.debug("Selected CBT stage and example: %s", cbt_stage_example)
             final_prompt = CBTPrompt.final_prompt(
                 latest_dialogue=latest_dialogue,
                 technique=cbt_technique,
                 stage=cbt_stage_example.stage_name,
+                distortion_type=cd_star,
             )
             self.cbt_usage_log[cbt_technique] = cbt_stage_example.stage_name
 
@@ -261,4 +644,7 @@ class CoCoAgent:
             yield chunk
 
         self.chat_history.append({"role": "assistant", "content": ai_response})
-        logger.info("Last chat_history: %s", self.chat_history[-1])
+        logger.debug("Last chat_history: %s", self.chat_history[-1])
+
+        if self.context.trim():
+            self.update_summary()
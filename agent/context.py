@@ -0,0 +1,158 @@
+import json
+import logging
+
+from agent.tracing import process_metrics
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheaply estimate the number of tokens in a text (about 4 characters per token).
+
+    Args:
+        text (str): The text to measure.
+
+    Returns:
+        int: The estimated token count.
+    """
+    return len(text) // 4 + 1
+
+
+class ConversationContext:
+    """A token-budgeted window of recent messages plus a rolling summary.
+
+    The window is the agent's own chat_history list: when it grows past
+    ``max_tokens`` the oldest messages are moved out of it into a pending
+    list, and an LLM call later folds them into ``summary``. Until that call
+    completes the pending messages are still rendered, so nothing is lost
+    unless summaries keep failing: pending messages beyond
+    ``max_pending_tokens`` are then dropped, oldest first, so the prompts
+    stay bounded.
+    The rendered context is cached until the conversation changes, so every
+    prompt builder of a turn reuses the same string.
+    """
+
+    def __init__(
+        self,
+        history: list,
+        max_tokens: int = 2000,
+        min_messages: int = 4,
+        max_pending_tokens: int = None,
+    ):
+        """
+        Initialize the context.
+
+        Args:
+            history (list): The message list of the conversation, trimmed in place.
+            max_tokens (int): Token budget of the recent window.
+            min_messages (int): Number of latest messages that are never summarized.
+            max_pending_tokens (int): Token budget of the messages waiting to be
+                summarized, ``max_tokens`` by default.
+        """
+        self.history = history
+        self.max_tokens = max_tokens
+        self.min_messages = min_messages
+        self.max_pending_tokens = max_pending_tokens or max_tokens
+        self.summary = ""
+        self.pending = list()
+        self.dropped = 0
+        self._dropped_at_input = 0
+        self._rendered = None
+        self._rendered_key = None
+
+    def _key(self):
+        last = id(self.history[-1]) if self.history else None
+        return len(self.history), last, len(self.pending), self.summary
+
+    def window_tokens(self) -> int:
+        """
+        Estimate the token count of the recent window.
+
+        Returns:
+            int: The estimated token count.
+        """
+        return sum(estimate_tokens(message["content"] or "") for message in self.history)
+
+    def trim(self) -> bool:
+        """
+        Move the oldest messages out of the window until it fits the budget.
+
+        Returns:
+            bool: True if some messages are waiting to be summarized.
+        """
+        tokens = self.window_tokens()
+        while tokens > self.max_tokens and len(self.history) > self.min_messages:
+            message = self.history.pop(0)
+            tokens -= estimate_tokens(message["content"] or "")
+            self.pending.append(message)
+
+        pending_tokens = sum(estimate_tokens(message["content"] or "") for message in self.pending)
+        dropped = 0
+        while pending_tokens > self.max_pending_tokens and len(self.pending) > 1:
+            message = self.pending.pop(0)
+            pending_tokens -= estimate_tokens(message["content"] or "")
+            dropped += 1
+        if dropped:
+            self.dropped += dropped
+            process_metrics.increment("cocoa_context_dropped_messages_total", dropped)
+            logger.warning("Dropped %d unsummarized messages from the context", dropped)
+        return bool(self.pending)
+
+    def summary_input(self):
+        """
+        Return what the next summary update should fold in.
+
+        Returns:
+            tuple[str, str, int]: The current summary, the pending dialogue and the
+                number of pending messages it covers.
+        """
+        dialogue = "".join(json.dumps(message) for message in self.pending)
+        self._dropped_at_input = self.dropped
+        return self.summary, dialogue, len(self.pending)
+
+    def apply_summary(self, summary: str, folded: int):
+        """
+        Replace the summary once the first ``folded`` pending messages are folded in.
+
+        Args:
+            summary (str): The updated summary.
+            folded (int): How many pending messages the summary covers.
+        """
+        self.summary = summary.strip()
+        # Messages dropped while the summary was written were among the folded ones.
+        del self.pending[: max(folded - (self.dropped - self._dropped_at_input), 0)]
+
+    def messages(self) -> list:
+        """
+        Build the chat messages for the conversation context.
+
+        Returns:
+            list[dict]: The summary (as a system message) followed by the recent window.
+        """
+        prefix = []
+        if self.summary:
+            prefix.append(
+                {
+                    "role": "system",
+                    "content": f"Summary of the earlier conversation: {self.summary}",
+                }
+            )
+        return [*prefix, *self.pending, *self.history]
+
+    def render(self) -> str:
+        """
+        Render the conversation context as text for prompt builders.
+
+        Returns:
+            str: The summary followed by the recent messages as JSON lines.
+        """
+        key = self._key()
+        if key != self._rendered_key:
+            parts = []
+            if self.summary:
+                parts.append(f"Summary of the earlier conversation: {self.summary}\n")
+            parts.extend(json.dumps(message) for message in [*self.pending, *self.history])
+            self._rendered = "".join(parts)
+            self._rendered_key = key
+        return self._rendered
@@ -0,0 +1,130 @@
+import re
+import threading
+
+
+class NeutralUtteranceGate:
+    """A cheap local gate that spots utterances with no cognitive distortion.
+
+    Greetings and one-word acknowledgements almost always come back from
+    distortion detection and insight extraction as "None". The gate scores how
+    confident it is that an utterance is neutral from lexical rules: any cue
+    of the distortion types listed in CBTPrompt.cognitive_distortion_detection
+    (or of a negative feeling) forces the score to 0, while short utterances
+    made only of small-talk words score high. Utterances scoring at least
+    ``threshold`` skip the two LLM calls.
+    """
+
+    # fmt: off
+    neutral_phrases = {
+        "hi", "hello", "hey", "hi there", "hello there", "good morning",
+        "good afternoon", "good evening", "ok", "okay", "k", "sure", "yes",
+        "yeah", "yep", "no", "nope", "thanks", "thank you", "thank you so much",
+        "thanks a lot", "bye", "goodbye", "see you", "see you later",
+        "i'm fine", "im fine", "i am fine", "fine", "good", "i'm good",
+        "i am good", "alright", "all right", "got it", "i see", "makes sense",
+        "hmm", "hm", "right", "cool", "nice", "great", "sounds good",
+    }
+    neutral_words = {
+        "hi", "hello", "hey", "there", "good", "morning", "afternoon", "evening",
+        "ok", "okay", "sure", "yes", "yeah", "yep", "no", "nope", "thanks",
+        "thank", "you", "so", "much", "a", "lot", "bye", "goodbye", "see",
+        "later", "i'm", "im", "i", "am", "fine", "alright", "all", "right",
+        "got", "it", "makes", "sense", "hmm", "hm", "cool", "nice", "great",
+        "sounds", "well", "too", "and", "how", "are", "doing", "what", "about",
+        "again", "welcome", "please", "understood", "that's", "thats",
+    }
+    distortion_cues = {
+        "All-or-Nothing Thinking": ["always", "never", "completely", "totally", "nothing", "everything", "perfect"],
+        "Overgeneralizing": ["every time", "everyone", "nobody", "no one", "all the time"],
+        "Labeling": ["failure", "loser", "idiot", "stupid", "worthless", "useless", "pathetic"],
+        "Fortune Telling": ["will never", "going to fail", "won't work", "never going to"],
+        "Mind Reading": ["they think", "thinks i", "think i'm", "hates me", "judging me"],
+        "Emotional Reasoning": ["i feel like", "feels like"],
+        "Should Statements": ["should", "must", "have to", "ought", "supposed to"],
+        "Personalizing": ["my fault", "because of me", "blame myself"],
+        "Disqualifying the Positive": ["doesn't count", "just luck", "anyone could"],
+        "Catastrophizing": ["disaster", "worst", "ruined", "terrible", "end of the world", "awful"],
+        "Comparing and Despairing": ["better than me", "everyone else", "compared to"],
+        "Blaming": ["their fault", "because of them", "blame"],
+        "Negative Feeling or Emotion": [
+            "sad", "anxious", "anxiety", "depressed", "angry", "lonely", "scared",
+            "afraid", "hurt", "tired", "stressed", "upset", "worried", "hate",
+            "cry", "crying", "hopeless", "panic", "not", "n't", "bad", "hard",
+        ],
+    }
+    # fmt: on
+
+    def __init__(self, threshold: float = 0.8):
+        """
+        Initialize the gate.
+
+        Args:
+            threshold (float): Minimum neutral confidence (0 to 1) to skip the LLM calls.
+        """
+        self.threshold = threshold
+        self.counters = {"skipped": 0, "forwarded": 0}
+        self._lock = threading.Lock()
+        cues = [cue for group in self.distortion_cues.values() for cue in group]
+        self._cue_pattern = re.compile(
+            "|".join(
+                re.escape(cue) if cue == "n't" else rf"\b{re.escape(cue)}\b"
+                for cue in sorted(cues, key=len, reverse=True)
+            )
+        )
+
+    @staticmethod
+    def _normalize(utterance: str) -> str:
+        text = utterance.lower().replace("’", "'")
+        return re.sub(r"[^a-z' ]+", " ", text).strip()
+
+    def score(self, utterance: str) -> float:
+        """
+        Score how confident the gate is that an utterance is neutral.
+
+        Args:
+            utterance (str): The client utterance.
+
+        Returns:
+            float: Confidence between 0 and 1.
+        """
+        text = self._normalize(utterance)
+        words = text.split()
+        if not words:
+            return 1.0
+        if self._cue_pattern.search(text):
+            return 0.0
+        if " ".join(words) in self.neutral_phrases:
+            return 1.0
+        neutral_share = sum(word in self.neutral_words for word in words) / len(words)
+        # Longer utterances carry more content the lexicon cannot judge.
+        length_factor = min(1.0, 6 / len(words))
+        return neutral_share * length_factor
+
+    def is_neutral(self, utterance: str) -> bool:
+        """
+        Decide whether the LLM distortion detection and insight extraction can be skipped.
+
+        Args:
+            utterance (str): The client utterance.
+
+        Returns:
+            bool: True if the utterance is confidently neutral.
+        """
+        neutral = self.score(utterance) >= self.threshold
+        with self._lock:
+            self.counters["skipped" if neutral else "forwarded"] += 1
+        return neutral
+
+    def stats(self) -> dict:
+        """
+        Report how many utterances were skipped and forwarded.
+
+        Returns:
+            dict: Counters suitable for JSON serialization.
+        """
+        with self._lock:
+            stats = dict(self.counters)
+        total = stats["skipped"] + stats["forwarded"]
+        stats["skip_ratio"] = stats["skipped"] / total if total else 0.0
+        stats["threshold"] = self.threshold
+        return stats
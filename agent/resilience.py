@@ -0,0 +1,321 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+
+import httpx
+import openai
+
+from agent.tracing import process_metrics
+from prompts.prompts import CBTPrompt
+
+logger = logging.getLogger(__name__)
+
+# Overall time budget of each pipeline step, retries included, in seconds.
+STEP_DEADLINES = {
+    "detection": 15,
+    "insight": 15,
+    "turn_analysis": 20,
+    "technique_selection": 15,
+    "stage_selection": 15,
+    "summary": 30,
+    "response": 120,
+}
+# The short structured calls on the critical path of a turn.
+HEDGED_STEPS = ("detection", "insight", "stage_selection")
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,
+    asyncio.TimeoutError,
+)
+STREAM_ERRORS = (*RETRYABLE_ERRORS, httpx.TransportError)
+
+
+class RateLimiter:
+    """An asyncio token bucket that allows ``rate`` acquisitions per second."""
+
+    def __init__(self, rate: float, burst: int = 1, clock=time.monotonic):
+        """
+        Initialize the limiter.
+
+        Args:
+            rate (float): Acquisitions allowed per second.
+            burst (int): Acquisitions allowed at once after an idle period.
+            clock (Callable[[], float]): Monotonic clock, overridable for testing.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """
+        Wait until the bucket has a token and take it.
+        """
+        async with self._lock:
+            while True:
+                now = self.clock()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def retry_after(error) -> float:
+    """
+    Read the delay a 429/503 response asks for.
+
+    Args:
+        error (Exception): The failed call.
+
+    Returns:
+        float: Seconds to wait, or 0 if the response does not say.
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return 0.0
+    try:
+        return float(response.headers.get("retry-after", 0))
+    except ValueError:
+        return 0.0
+
+
+class ResilientCaller:
+    """Deadlines, retries, hedging and rate limiting around OpenAI calls.
+
+    One caller is shared by every session of the process, so its semaphore
+    and token bucket bound the calls of all sessions together. Each call
+    belongs to a pipeline step with an overall deadline. Rate limits (429),
+    server errors (5xx), connection errors and attempt timeouts are retried
+    with full-jitter exponential backoff, honouring Retry-After, until the
+    deadline. Calls of the steps in ``hedged_steps`` send a duplicate request
+    when the first one has not answered after ``hedge_delay`` seconds, and
+    use whichever answers first. Streams that stall or break are resumed
+    from the text received so far.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 64,
+        requests_per_second: float = None,
+        deadlines: dict = None,
+        max_attempts: int = 4,
+        backoff_base: float = 0.25,
+        backoff_cap: float = 8.0,
+        hedge_delay: float = None,
+        hedged_steps=HEDGED_STEPS,
+        first_chunk_timeout: float = 20.0,
+        idle_timeout: float = 10.0,
+        max_resumes: int = 2,
+    ):
+        """
+        Initialize the caller.
+
+        Args:
+            max_concurrency (int): Maximum number of OpenAI calls in flight.
+            requests_per_second (float): Optional token bucket rate of new calls.
+            deadlines (dict[str, float]): Deadlines per step, merged over STEP_DEADLINES.
+            max_attempts (int): Maximum attempts of a call.
+            backoff_base (float): Backoff of the first retry, in seconds.
+            backoff_cap (float): Maximum backoff, in seconds.
+            hedge_delay (float): Seconds before a hedged duplicate is sent, None disables hedging.
+            hedged_steps (Iterable[str]): The steps whose calls may be hedged.
+            first_chunk_timeout (float): Seconds a stream may take to send its first chunk.
+            idle_timeout (float): Seconds a stream may stay silent between chunks.
+            max_resumes (int): How many times a broken stream is resumed.
+        """
+        self.deadlines = {**STEP_DEADLINES, **(deadlines or {})}
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge_delay = hedge_delay
+        self.hedged_steps = set(hedged_steps)
+        self.first_chunk_timeout = first_chunk_timeout
+        self.idle_timeout = idle_timeout
+        self.max_resumes = max_resumes
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.rate_limiter = (
+            RateLimiter(requests_per_second, burst=max(1, int(requests_per_second)))
+            if requests_per_second
+            else None
+        )
+
+    async def _admit(self):
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire()
+
+    def _backoff(self, attempt: int, error) -> float:
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2**attempt))
+        return max(delay, retry_after(error))
+
+    async def _attempt(self, request, timeout: float):
+        await self._admit()
+        async with self.semaphore:
+            return await asyncio.wait_for(request(), timeout)
+
+    async def _hedged(self, step: str, request, timeout: float):
+        first = asyncio.ensure_future(self._attempt(request, timeout))
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay)
+            if not done:
+                process_metrics.increment("cocoa_llm_hedges_total", step=step)
+                tasks.add(asyncio.ensure_future(self._attempt(request, timeout)))
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            process_metrics.increment("cocoa_llm_hedge_wins_total", step=step)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # The losing request is cancelled, which closes its connection.
+            for task in tasks:
+                task.cancel()
+
+    def deadline(self, step: str) -> float:
+        """
+        Compute when the overall time budget of a step runs out.
+
+        Args:
+            step (str): The pipeline step.
+
+        Returns:
+            float: The deadline on the time.monotonic clock.
+        """
+        return time.monotonic() + self.deadlines.get(step, 60)
+
+    async def call(self, step: str, request, deadline: float = None):
+        """
+        Make an OpenAI call with the step's deadline, retries and hedging.
+
+        Args:
+            step (str): The pipeline step, which selects the deadline and hedging.
+            request (Callable[[], Awaitable]): Makes one attempt of the call.
+            deadline (float): Optional deadline of a step that spans several
+                calls, defaults to the step's budget from now.
+
+        Returns:
+            Any: The result of the first successful attempt.
+        """
+        if deadline is None:
+            deadline = self.deadline(step)
+        hedge = self.hedge_delay is not None and step in self.hedged_steps
+        for attempt in range(self.max_attempts):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                process_metrics.increment(
+                    "cocoa_llm_failures_total", step=step, reason="DeadlineExceeded"
+                )
+                raise asyncio.TimeoutError(f"{step} deadline exceeded")
+            try:
+                if hedge:
+                    return await self._hedged(step, request, remaining)
+                return await self._attempt(request, remaining)
+            except RETRYABLE_ERRORS as e:
+                reason = type(e).__name__
+                delay = self._backoff(attempt, e)
+                if attempt + 1 >= self.max_attempts or time.monotonic() + delay >= deadline:
+                    process_metrics.increment("cocoa_llm_failures_total", step=step, reason=reason)
+                    raise
+                process_metrics.increment("cocoa_llm_retries_total", step=step, reason=reason)
+                logger.warning("Retrying %s in %.2fs after %s", step, delay, reason)
+                await asyncio.sleep(delay)
+
+    async def stream(self, step: str, open_stream, messages: list):
+        """
+        Stream a completion, resuming it if it stalls or breaks.
+
+        A stream that fails before its first content chunk is retried like a
+        call. One that fails later is requested again with the partial reply
+        as an assistant message and an instruction to continue it. The step's
+        deadline covers every resume. A concurrency slot is only held while a
+        stream is being opened, so slow readers do not hold up other calls.
+
+        Args:
+            step (str): The pipeline step, which selects the deadline.
+            open_stream (Callable[[list[dict]], Awaitable[AsyncStream]]): Opens a
+                stream for the given messages.
+            messages (list[dict]): The chat messages.
+
+        Yields:
+            ChatCompletionChunk: The chunks of every attempt.
+        """
+        deadline = self.deadline(step)
+        received = ""
+        resumes = 0
+        while True:
+            request_messages = messages
+            if received:
+                request_messages = CBTPrompt.continue_reply(messages, received)
+            try:
+                stream = await self.call(
+                    step, lambda: open_stream(request_messages), deadline=deadline
+                )
+                async with stream:
+                    iterator = stream.__aiter__()
+                    timeout = self.first_chunk_timeout
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(iterator.__anext__(), timeout)
+                        except StopAsyncIteration:
+                            return
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            received += chunk.choices[0].delta.content
+                            timeout = self.idle_timeout
+                        yield chunk
+            except STREAM_ERRORS as e:
+                reason = type(e).__name__
+                if resumes >= self.max_resumes or time.monotonic() >= deadline:
+                    process_metrics.increment(
+                        "cocoa_llm_failures_total", step=step, reason=reason
+                    )
+                    raise
+                resumes += 1
+                process_metrics.increment(
+                    "cocoa_llm_stream_resumes_total", step=step, reason=reason
+                )
+                logger.warning("Resuming %s stream after %s", step, reason)
+
+
+_default_caller = None
+_default_lock = threading.Lock()
+
+
+def get_resilient_caller() -> ResilientCaller:
+    """
+    Return the process-wide caller, configured by the environment.
+
+    COCOA_LLM_MAX_CONCURRENCY bounds the calls in flight (default 64),
+    COCOA_LLM_RATE the new calls per second (default unlimited) and
+    COCOA_HEDGE_DELAY enables hedging of the short structured calls.
+
+    Returns:
+        ResilientCaller: The shared caller.
+    """
+    global _default_caller
+    with _default_lock:
+        if _default_caller is None:
+            rate = os.getenv("COCOA_LLM_RATE")
+            hedge_delay = os.getenv("COCOA_HEDGE_DELAY")
+            _default_caller = ResilientCaller(
+                max_concurrency=int(os.getenv("COCOA_LLM_MAX_CONCURRENCY", "64")),
+                requests_per_second=float(rate) if rate else None,
+                hedge_delay=float(hedge_delay) if hedge_delay else None,
+            )
+        return _default_caller
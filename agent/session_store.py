@@ -0,0 +1,224 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+
+def encode_snapshot(state: dict) -> bytes:
+    """
+    Serialize a session snapshot as compressed JSON.
+
+    Args:
+        state (dict): The snapshot, as returned by CoCoAgent.snapshot.
+
+    Returns:
+        bytes: The encoded snapshot.
+    """
+    payload = json.dumps(state, ensure_ascii=False, separators=(",", ":"))
+    return zlib.compress(payload.encode("utf-8"))
+
+
+def decode_snapshot(data: bytes) -> dict:
+    """
+    Read a snapshot written by encode_snapshot.
+
+    Args:
+        data (bytes): The encoded snapshot.
+
+    Returns:
+        dict: The snapshot.
+    """
+    state = json.loads(zlib.decompress(data).decode("utf-8"))
+    if state.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported session snapshot version: {state.get('version')}")
+    return state
+
+
+class SessionStore(ABC):
+    """Where idle sessions are paged out to.
+
+    A store keeps one encoded snapshot per session id. Snapshots that cannot
+    be read back (corrupt or from another version) are treated as missing,
+    so the session simply starts over.
+    """
+
+    @abstractmethod
+    def read(self, session_id: str):
+        """
+        Read the encoded snapshot of a session.
+
+        Args:
+            session_id (str): The session identifier.
+
+        Returns:
+            bytes: The snapshot as written by ``write``, or None if there is none.
+        """
+
+    @abstractmethod
+    def write(self, session_id: str, data: bytes):
+        """
+        Store the encoded snapshot of a session, replacing the previous one.
+        A concurrent ``read`` sees either the old or the new snapshot.
+
+        Args:
+            session_id (str): The session identifier.
+            data (bytes): The encoded snapshot.
+        """
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        """
+        Forget the snapshot of a session; a missing snapshot is not an error.
+
+        Args:
+            session_id (str): The session identifier.
+        """
+
+    def load(self, session_id: str):
+        """
+        Load the snapshot of a session.
+
+        Args:
+            session_id (str): The session identifier.
+
+        Returns:
+            dict: The snapshot, or None if the session was never paged out.
+        """
+        data = self.read(session_id)
+        if data is None:
+            return None
+        try:
+            return decode_snapshot(data)
+        except (ValueError, zlib.error) as e:
+            logger.warning("Ignoring snapshot of session %s: %s", session_id, e)
+            return None
+
+    def save(self, session_id: str, state: dict) -> int:
+        """
+        Save the snapshot of a session, replacing the previous one.
+
+        Args:
+            session_id (str): The session identifier.
+            state (dict): The snapshot.
+
+        Returns:
+            int: Size of the encoded snapshot in bytes.
+        """
+        data = encode_snapshot(state)
+        self.write(session_id, data)
+        return len(data)
+
+
+class FileSessionStore(SessionStore):
+    """Snapshots kept as one file per session in a directory.
+
+    File names are hashes of the session ids, which come from clients, and
+    files are replaced atomically.
+    """
+
+    def __init__(self, directory: str):
+        """
+        Initialize the store.
+
+        Args:
+            directory (str): The directory of the snapshots, created if needed.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id: str) -> str:
+        name = hashlib.sha256(session_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{name}.json.z")
+
+    def read(self, session_id: str):
+        try:
+            with open(self._path(session_id), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, session_id: str, data: bytes):
+        path = self._path(session_id)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def delete(self, session_id: str):
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+
+
+class SQLiteSessionStore(SessionStore):
+    """Snapshots kept in a SQLite database, shareable by several workers."""
+
+    def __init__(self, path: str):
+        """
+        Initialize the store.
+
+        Args:
+            path (str): Path of the SQLite database file.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA busy_timeout=30000")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, updated_at REAL NOT NULL, state BLOB NOT NULL)"
+        )
+        self._db.commit()
+
+    def read(self, session_id: str):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT state FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def write(self, session_id: str, data: bytes):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, updated_at, state) "
+                "VALUES (?, ?, ?)",
+                (session_id, time.time(), data),
+            )
+            self._db.commit()
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._db.commit()
+
+
+def create_session_store():
+    """
+    Create the session store configured by the environment.
+
+    COCOA_SESSION_STORE selects "off" (default, idle sessions are dropped),
+    "file" (one file per session in the COCOA_SESSION_STORE_PATH directory)
+    or "sqlite" (the COCOA_SESSION_STORE_PATH database).
+
+    Returns:
+        SessionStore: The store, or None if sessions are not paged out.
+    """
+    kind = os.getenv("COCOA_SESSION_STORE", "off")
+    if kind == "off":
+        return None
+    if kind == "file":
+        return FileSessionStore(os.getenv("COCOA_SESSION_STORE_PATH", "session_store"))
+    if kind == "sqlite":
+        return SQLiteSessionStore(os.getenv("COCOA_SESSION_STORE_PATH", "sessions.sqlite3"))
+    raise ValueError(f"Unknown session store: {kind}")
@@ -0,0 +1,394 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from agent.tracing import process_metrics
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_agent_size(agent) -> int:
+    """
+    Roughly estimate how many bytes of conversation state an agent holds.
+
+    Args:
+        agent (CoCoAgent): The agent to measure.
+
+    Returns:
+        int: Approximate size in bytes of the conversation context and CBT usage log.
+    """
+    messages = [*agent.context.pending, *agent.chat_history]
+    size = sum(len(message.get("content") or "") for message in messages)
+    size += len(agent.context.summary)
+    size += sum(len(k) + len(str(v)) for k, v in agent.cbt_usage_log.items())
+    return size
+
+
+class _SessionEntry:
+    def __init__(self, agent, now: float):
+        self.agent = agent
+        self.last_access = now
+        self.active = 0
+        self.lock = asyncio.Lock()
+
+
+class SessionRegistry:
+    """A registry of per-session agents with lazy creation and LRU/TTL eviction.
+
+    Sessions are created on first use by calling ``factory(session_id)`` and are
+    evicted when idle for longer than ``ttl_seconds``, when there are more than
+    ``max_sessions`` of them, or when their estimated total size exceeds
+    ``max_bytes``. Sessions with a turn in flight are never evicted.
+
+    With a ``store``, dropped sessions are paged out as snapshots and paged
+    back in when they are used again, so only the active sessions stay in
+    memory. ``acquire`` builds and pages in agents in a worker thread, and
+    page-outs run in the background once the agent is closed, so only dict
+    bookkeeping happens on the event loop.
+    """
+
+    def __init__(
+        self,
+        factory,
+        max_sessions: int = 1000,
+        ttl_seconds: float = 1800,
+        max_bytes: int = None,
+        size_of=estimate_agent_size,
+        on_evict=None,
+        store=None,
+        clock=time.monotonic,
+    ):
+        """
+        Initialize the registry.
+
+        Args:
+            factory (Callable[[str], CoCoAgent]): Creates the agent for a new session.
+            max_sessions (int): Maximum number of live sessions.
+            ttl_seconds (float): Idle time after which a session is evicted.
+            max_bytes (int): Optional budget for the estimated size of all sessions.
+            size_of (Callable[[CoCoAgent], int]): Estimates the size of one session.
+            on_evict (Callable[[str, CoCoAgent, str], None]): Called with the session id,
+                the agent and the eviction reason whenever a session is dropped.
+            store (SessionStore): Optional store that dropped sessions are paged out to.
+            clock (Callable[[], float]): Monotonic clock, overridable for testing.
+        """
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+        self.on_evict = on_evict
+        self.store = store
+        self.clock = clock
+
+        self._sessions = OrderedDict()
+        self._loading = dict()
+        self._page_outs = dict()
+        self._mutex = threading.RLock()
+        self.counters = {
+            "created": 0,
+            "evicted_ttl": 0,
+            "evicted_lru": 0,
+            "evicted_memory": 0,
+            "closed": 0,
+            "paged_out": 0,
+            "paged_in": 0,
+            "page_failures": 0,
+        }
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+
+    def _touch(self, session_id: str) -> _SessionEntry:
+        now = self.clock()
+        with self._mutex:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = _SessionEntry(self._load(session_id), now)
+                self._sessions[session_id] = entry
+                self.counters["created"] += 1
+            else:
+                entry.last_access = now
+                self._sessions.move_to_end(session_id)
+            entry.active += 1
+            try:
+                self._evict(now)
+            finally:
+                entry.active -= 1
+        return entry
+
+    def _load(self, session_id: str):
+        agent = self.factory(session_id)
+        if self.store is not None:
+            self._page_in(session_id, agent)
+        return agent
+
+    def get(self, session_id: str):
+        """
+        Return the agent for a session, creating it if needed.
+
+        This blocks while a new agent is built and paged in; coroutines use
+        ``acquire`` instead.
+
+        Args:
+            session_id (str): The session identifier.
+
+        Returns:
+            CoCoAgent: The agent that owns the session state.
+        """
+        return self._touch(session_id).agent
+
+    @asynccontextmanager
+    async def acquire(self, session_id: str):
+        """
+        Hold a session for the duration of a turn.
+
+        Turns for the same session are serialized, and the session cannot be
+        evicted while it is held.
+
+        Args:
+            session_id (str): The session identifier.
+
+        Yields:
+            CoCoAgent: The agent that owns the session state.
+        """
+        entry = await self._enter(session_id)
+        try:
+            async with entry.lock:
+                yield entry.agent
+        finally:
+            with self._mutex:
+                entry.active -= 1
+                entry.last_access = self.clock()
+
+    async def _enter(self, session_id: str) -> _SessionEntry:
+        # Returns the live entry with ``active`` already raised. A missing
+        # session is built by exactly one caller; the others wait for it.
+        while True:
+            with self._mutex:
+                entry = self._sessions.get(session_id)
+                if entry is not None:
+                    now = self.clock()
+                    entry.last_access = now
+                    self._sessions.move_to_end(session_id)
+                    entry.active += 1
+                    self._evict(now)
+                    return entry
+                loading = self._loading.get(session_id)
+                owner = loading is None
+                if owner:
+                    loading = self._loading[session_id] = (
+                        asyncio.get_running_loop().create_future()
+                    )
+            if owner:
+                break
+            await asyncio.shield(loading)
+
+        try:
+            # A page-out of the same session must land before it is read back.
+            page_out = self._page_outs.get(session_id)
+            if page_out is not None:
+                await asyncio.wait({page_out})
+            agent = await asyncio.to_thread(self._load, session_id)
+            with self._mutex:
+                now = self.clock()
+                entry = _SessionEntry(agent, now)
+                self._sessions[session_id] = entry
+                self.counters["created"] += 1
+                entry.active += 1
+                self._evict(now)
+            return entry
+        finally:
+            with self._mutex:
+                del self._loading[session_id]
+            loading.set_result(None)
+
+    async def flush(self):
+        """
+        Wait for the page-outs in progress, e.g. before shutting down.
+        """
+        while self._page_outs:
+            await asyncio.wait(set(self._page_outs.values()))
+
+    def close(self, session_id: str, forget: bool = False) -> bool:
+        """
+        Drop a session explicitly.
+
+        Args:
+            session_id (str): The session identifier.
+            forget (bool): Also delete the paged out snapshot, ending the session
+                for good.
+
+        Returns:
+            bool: True if the session existed.
+        """
+        with self._mutex:
+            entry = self._sessions.pop(session_id, None)
+        if forget and self.store is not None:
+            self.store.delete(session_id)
+        if entry is None:
+            return False
+        self._drop(session_id, entry, "closed", page_out=not forget)
+        return True
+
+    def close_all(self) -> int:
+        """
+        Drop every session, e.g. on shutdown.
+
+        Returns:
+            int: The number of closed sessions.
+        """
+        with self._mutex:
+            session_ids = list(self._sessions)
+        return sum(self.close(session_id) for session_id in session_ids)
+
+    def evict_expired(self) -> int:
+        """
+        Evict every idle session whose TTL has passed.
+
+        Returns:
+            int: The number of evicted sessions.
+        """
+        with self._mutex:
+            before = self.counters["evicted_ttl"]
+            self._evict(self.clock())
+            return self.counters["evicted_ttl"] - before
+
+    def _evict(self, now: float):
+        for session_id, entry in list(self._sessions.items()):
+            if entry.active == 0 and now - entry.last_access > self.ttl_seconds:
+                self._remove(session_id, "ttl")
+
+        while len(self._sessions) > self.max_sessions:
+            if self._remove_oldest_idle("lru") is None:
+                break
+
+        if self.max_bytes is not None:
+            total = self.total_bytes()
+            while total > self.max_bytes:
+                removed = self._remove_oldest_idle("memory")
+                if removed is None:
+                    break
+                total -= self.size_of(removed.agent)
+
+    def _remove_oldest_idle(self, reason: str):
+        for session_id, entry in self._sessions.items():
+            if entry.active == 0:
+                self._remove(session_id, reason)
+                return entry
+        return None
+
+    def _remove(self, session_id: str, reason: str):
+        entry = self._sessions.pop(session_id)
+        self._drop(session_id, entry, reason)
+
+    def _page_in(self, session_id: str, agent):
+        started = time.perf_counter()
+        try:
+            state = self.store.load(session_id)
+            if state is None:
+                return
+            agent.restore(state)
+        except Exception:
+            with self._mutex:
+                self.counters["page_failures"] += 1
+            logger.exception("Could not page in session %s", session_id)
+            return
+        with self._mutex:
+            self.counters["paged_in"] += 1
+        process_metrics.observe(
+            "cocoa_session_page_seconds", time.perf_counter() - started, direction="in"
+        )
+
+    def _page_out(self, session_id: str, agent):
+        started = time.perf_counter()
+        try:
+            size = self.store.save(session_id, agent.snapshot())
+        except Exception:
+            with self._mutex:
+                self.counters["page_failures"] += 1
+            logger.exception("Could not page out session %s", session_id)
+            return
+        with self._mutex:
+            self.counters["paged_out"] += 1
+        process_metrics.observe(
+            "cocoa_session_page_seconds", time.perf_counter() - started, direction="out"
+        )
+        process_metrics.increment("cocoa_session_snapshot_bytes_total", size)
+
+    async def _page_out_later(self, session_id: str, agent, previous):
+        if previous is not None:
+            await asyncio.wait({previous})
+        # Closing first lets in-flight summary, consolidation and memory
+        # writes land in the state that is saved.
+        aclose = getattr(agent, "aclose", None)
+        if aclose is not None:
+            try:
+                await aclose()
+            except Exception:
+                logger.exception("Closing session %s before page-out failed", session_id)
+        await asyncio.to_thread(self._page_out, session_id, agent)
+
+    def _schedule_page_out(self, session_id: str, agent):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Without an event loop (synchronous callers) the page-out is inline.
+            self._page_out(session_id, agent)
+            return
+        task = loop.create_task(
+            self._page_out_later(session_id, agent, self._page_outs.get(session_id))
+        )
+        self._page_outs[session_id] = task
+
+        def done(task, session_id=session_id):
+            if self._page_outs.get(session_id) is task:
+                del self._page_outs[session_id]
+
+        task.add_done_callback(done)
+
+    def _drop(
+        self, session_id: str, entry: _SessionEntry, reason: str, page_out: bool = True
+    ):
+        counter = "closed" if reason == "closed" else f"evicted_{reason}"
+        self.counters[counter] += 1
+        logger.info("Session %s dropped (%s)", session_id, reason)
+        if page_out and self.store is not None:
+            self._schedule_page_out(session_id, entry.agent)
+        if self.on_evict is not None:
+            try:
+                self.on_evict(session_id, entry.agent, reason)
+            except Exception:
+                logger.exception("on_evict failed for session %s", session_id)
+
+    def total_bytes(self) -> int:
+        """
+        Estimate the total size of all live sessions.
+
+        Returns:
+            int: Approximate size in bytes.
+        """
+        return sum(self.size_of(entry.agent) for entry in self._sessions.values())
+
+    def stats(self) -> dict:
+        """
+        Report live session and eviction counters.
+
+        Returns:
+            dict: Counters suitable for JSON serialization.
+        """
+        with self._mutex:
+            return {
+                "live_sessions": len(self._sessions),
+                "active_sessions": sum(
+                    1 for entry in self._sessions.values() if entry.active
+                ),
+                "estimated_bytes": self.total_bytes(),
+                **self.counters,
+            }
@@ -0,0 +1,85 @@
+import asyncio
+
+
+class SpeculativeStream:
+    """Reads a reply stream in the background while the turn is still being planned.
+
+    The chunks are queued as they arrive. ``until(task)`` hands them out
+    while ``task`` (the planning) is running; afterwards the turn either
+    keeps the stream with ``rest()`` or drops it with ``cancel()``, which
+    closes the upstream request.
+    """
+
+    def __init__(self, chunks):
+        """
+        Start reading a stream.
+
+        Args:
+            chunks (AsyncIterator[str]): The reply stream.
+        """
+        self.text = ""
+        # The upstream stream ended without error; some of its chunks may
+        # still be waiting to be handed out.
+        self.complete = False
+        self.finished = False
+        self.error = None
+        self._queue = asyncio.Queue()
+        self._task = asyncio.ensure_future(self._produce(chunks))
+
+    async def _produce(self, chunks):
+        try:
+            async for chunk in chunks:
+                self._queue.put_nowait(chunk)
+        except Exception as e:
+            self._queue.put_nowait(e)
+            return
+        self.complete = True
+        self._queue.put_nowait(None)
+
+    def _take(self, item) -> bool:
+        if item is None or isinstance(item, Exception):
+            self.finished = True
+            self.error = item
+            return False
+        self.text += item
+        return True
+
+    async def until(self, task: asyncio.Future):
+        """
+        Hand out chunks until ``task`` is done or the stream ends.
+
+        Args:
+            task (asyncio.Future): The task that ends the speculative phase.
+
+        Yields:
+            str: The chunks received so far.
+        """
+        while not task.done() and not self.finished:
+            get = asyncio.ensure_future(self._queue.get())
+            done, _ = await asyncio.wait({get, task}, return_when=asyncio.FIRST_COMPLETED)
+            if get not in done:
+                get.cancel()
+                return
+            item = get.result()
+            if self._take(item):
+                yield item
+
+    async def rest(self):
+        """
+        Hand out the remaining chunks.
+
+        Yields:
+            str: The chunks.
+        """
+        while not self.finished:
+            item = await self._queue.get()
+            if self._take(item):
+                yield item
+        if self.error is not None:
+            raise self.error
+
+    def cancel(self):
+        """
+        Stop reading the stream.
+        """
+        self._task.cancel()
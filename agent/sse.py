@@ -0,0 +1,159 @@
+import asyncio
+import json
+import logging
+import time
+
+from agent.tracing import process_metrics
+
+logger = logging.getLogger(__name__)
+
+_IDLE = object()
+_DISCONNECTED = object()
+
+
+class SSEWriter:
+    """Frames a reply stream as typed server-sent events.
+
+    Reply deltas are coalesced into ``token`` events of up to ``max_buffer``
+    characters, flushed at the latest ``max_delay`` seconds after the first
+    buffered delta. Multi-line text is framed as one ``data:`` line per line.
+    After the reply come a ``metadata`` event (distortion, technique and
+    stage of the turn) and a ``done`` event, or a single ``error`` event if
+    the reply failed. Idle periods send keep-alive comments, and the reply
+    stream is cancelled as soon as the client disconnects, which closes the
+    upstream OpenAI stream.
+    """
+
+    def __init__(
+        self,
+        max_buffer: int = 64,
+        max_delay: float = 0.05,
+        keepalive_interval: float = 15.0,
+        disconnect_poll_interval: float = 1.0,
+    ):
+        """
+        Initialize the writer.
+
+        Args:
+            max_buffer (int): Characters that trigger a flush of the buffered deltas.
+            max_delay (float): Seconds a delta may wait in the buffer.
+            keepalive_interval (float): Seconds of silence before a keep-alive comment.
+            disconnect_poll_interval (float): Seconds between client disconnect checks.
+        """
+        self.max_buffer = max_buffer
+        self.max_delay = max_delay
+        self.keepalive_interval = keepalive_interval
+        self.disconnect_poll_interval = disconnect_poll_interval
+
+    @staticmethod
+    def event(event: str, data: str) -> str:
+        """
+        Frame one event.
+
+        Args:
+            event (str): The event type.
+            data (str): The payload, which may span several lines.
+
+        Returns:
+            str: The event, ending with a blank line.
+        """
+        lines = data.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+        return f"event: {event}\n" + "".join(f"data: {line}\n" for line in lines) + "\n"
+
+    @classmethod
+    def json_event(cls, event: str, payload: dict) -> str:
+        return cls.event(event, json.dumps(payload, ensure_ascii=False))
+
+    async def _produce(self, chunks, queue: asyncio.Queue):
+        try:
+            async for chunk in chunks:
+                queue.put_nowait(chunk)
+        except Exception as e:
+            queue.put_nowait(e)
+            return
+        queue.put_nowait(None)
+
+    async def _watch(self, is_disconnected, queue: asyncio.Queue):
+        while True:
+            await asyncio.sleep(self.disconnect_poll_interval)
+            if await is_disconnected():
+                queue.put_nowait(_DISCONNECTED)
+                return
+
+    async def stream(self, chunks, is_disconnected=None, metadata=None):
+        """
+        Turn a reply stream into SSE frames.
+
+        Args:
+            chunks (AsyncIterator[str]): The reply deltas.
+            is_disconnected (Callable[[], Awaitable[bool]]): Optional check of the
+                client connection, such as ``Request.is_disconnected``.
+            metadata (Callable[[], dict]): Optional payload of the metadata event,
+                called once the reply is complete.
+
+        Yields:
+            str: The SSE frames.
+        """
+        queue = asyncio.Queue()
+        producer = asyncio.ensure_future(self._produce(chunks, queue))
+        watcher = None
+        if is_disconnected is not None:
+            watcher = asyncio.ensure_future(self._watch(is_disconnected, queue))
+        buffer, buffered, flush_at = [], 0, None
+        last_sent = time.monotonic()
+        deltas = frames = 0
+        try:
+            while True:
+                now = time.monotonic()
+                timeout = (
+                    flush_at - now
+                    if flush_at is not None
+                    else last_sent + self.keepalive_interval - now
+                )
+                try:
+                    item = await asyncio.wait_for(queue.get(), max(timeout, 0))
+                except asyncio.TimeoutError:
+                    item = _IDLE
+                if item is _DISCONNECTED:
+                    break
+
+                if isinstance(item, str):
+                    deltas += 1
+                    buffer.append(item)
+                    buffered += len(item)
+                    if flush_at is None:
+                        flush_at = time.monotonic() + self.max_delay
+                    if buffered < self.max_buffer:
+                        continue
+                if buffer:
+                    yield self.event("token", "".join(buffer))
+                    frames += 1
+                    buffer, buffered, flush_at = [], 0, None
+                    last_sent = time.monotonic()
+                elif item is _IDLE:
+                    yield ": keep-alive\n\n"
+                    last_sent = time.monotonic()
+
+                if item is None:
+                    if metadata is not None:
+                        yield self.json_event("metadata", metadata())
+                    yield self.json_event("done", {})
+                    break
+                if isinstance(item, Exception):
+                    logger.error("Error processing dialogue: %s", item, exc_info=item)
+                    yield self.json_event(
+                        "error", {"message": "The reply could not be generated."}
+                    )
+                    break
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            if not producer.done():
+                # The client went away mid-reply: cancelling the turn closes
+                # the upstream stream, which is awaited so the session is
+                # released only once the turn has unwound.
+                process_metrics.increment("cocoa_sse_disconnects_total")
+                producer.cancel()
+                await asyncio.wait({producer})
+            process_metrics.increment("cocoa_sse_deltas_total", deltas)
+            process_metrics.increment("cocoa_sse_frames_total", frames)
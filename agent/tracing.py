@@ -0,0 +1,274 @@
+import contextvars
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def current_span():
+    """
+    Return the span open in the current task, if any.
+
+    Returns:
+        Span: The span, or None.
+    """
+    return _current_span.get()
+
+
+class MetricsRegistry:
+    """Process-wide histograms, counters and gauges in the Prometheus text format."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Initialize the registry.
+
+        Args:
+            buckets (tuple[float]): Upper bounds of the histogram buckets, in seconds.
+        """
+        self.buckets = buckets
+        self.histograms = dict()
+        self.counters = dict()
+        self.gauges = dict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name: str, value: float, **labels):
+        """
+        Add an observation to a histogram.
+
+        Args:
+            name (str): The metric name.
+            value (float): The observed value.
+            **labels: The labels of the series.
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    "buckets": [0] * len(self.buckets),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram["buckets"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def increment(self, name: str, amount: float = 1, **labels):
+        """
+        Increase a counter.
+
+        Args:
+            name (str): The metric name.
+            amount (float): How much to add.
+            **labels: The labels of the series.
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels):
+        """
+        Set a gauge.
+
+        Args:
+            name (str): The metric name.
+            value (float): The current value.
+            **labels: The labels of the series.
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self.gauges[key] = value
+
+    @staticmethod
+    def _labels(labels, **extra) -> str:
+        pairs = [*labels, *extra.items()]
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The exposition.
+        """
+        with self._lock:
+            histograms = {
+                key: {**value, "buckets": list(value["buckets"])}
+                for key, value in self.histograms.items()
+            }
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+        lines, typed = [], set()
+        for (name, labels), histogram in sorted(histograms.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            for bound, count in zip(self.buckets, histogram["buckets"]):
+                lines.append(f"{name}_bucket{self._labels(labels, le=bound)} {count}")
+            lines.append(
+                f"{name}_bucket{self._labels(labels, le='+Inf')} {histogram['count']}"
+            )
+            lines.append(f"{name}_sum{self._labels(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{self._labels(labels)} {histogram['count']}")
+        for (name, labels), value in sorted(counters.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), value in sorted(gauges.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} gauge")
+                typed.add(name)
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+process_metrics = MetricsRegistry()
+
+
+class Span:
+    """One timed stage of a turn, with the tokens and cache hits of its LLM calls."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.perf_counter()
+        self.duration = None
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.cache_hits = 0
+        self.error = None
+
+    def add_usage(self, usage):
+        """
+        Add the usage of an LLM call made inside the span.
+
+        Args:
+            usage (CompletionUsage): The ``usage`` of the completion, may be None.
+        """
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.prompt_tokens += usage.prompt_tokens or 0
+        self.cached_tokens += (getattr(details, "cached_tokens", None) or 0) if details else 0
+        self.completion_tokens += usage.completion_tokens or 0
+
+    def as_dict(self) -> dict:
+        span = {"name": self.name, "duration": self.duration}
+        for field in ("prompt_tokens", "cached_tokens", "completion_tokens", "cache_hits"):
+            if getattr(self, field):
+                span[field] = getattr(self, field)
+        if self.error:
+            span["error"] = self.error
+        return span
+
+
+class TurnTrace:
+    """The spans of one turn.
+
+    Spans are opened with ``span(name)``; LLM calls made while a span is
+    open (in the same asyncio task) attach their usage to it. Finished spans
+    feed the histograms and counters of ``metrics``. Only ``sample_rate`` of
+    the turns are logged, as one compact line instead of full payloads.
+    """
+
+    def __init__(
+        self, session_id: str, metrics: MetricsRegistry = None, sample_rate: float = 0.01
+    ):
+        """
+        Initialize the trace.
+
+        Args:
+            session_id (str): The session of the turn.
+            metrics (MetricsRegistry): Where finished spans are aggregated,
+                defaults to the process-wide registry.
+            sample_rate (float): Share of turns that are logged.
+        """
+        self.session_id = session_id
+        self.metrics = metrics or process_metrics
+        self.sampled = random.random() < sample_rate
+        self.start = time.perf_counter()
+        self.spans = list()
+        self.marks = dict()
+
+    @contextmanager
+    def span(self, name: str):
+        """
+        Time a stage of the turn.
+
+        Args:
+            name (str): The stage name, such as "detection" or "retrieval".
+
+        Yields:
+            Span: The open span.
+        """
+        span = Span(name)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                # A streaming generator may be closed from another task.
+                pass
+            span.duration = time.perf_counter() - span.start
+            self.spans.append(span)
+            self._observe(span)
+
+    def _observe(self, span: Span):
+        metrics = self.metrics
+        metrics.observe("cocoa_span_duration_seconds", span.duration, span=span.name)
+        for kind in ("prompt", "cached", "completion"):
+            tokens = getattr(span, f"{kind}_tokens")
+            if tokens:
+                metrics.increment("cocoa_span_tokens_total", tokens, span=span.name, kind=kind)
+        if span.cache_hits:
+            metrics.increment("cocoa_span_cache_hits_total", span.cache_hits, span=span.name)
+        if span.error:
+            metrics.increment("cocoa_span_errors_total", span=span.name, error=span.error)
+
+    def mark(self, name: str) -> float:
+        """
+        Record how long after the start of the turn something happened.
+
+        Args:
+            name (str): The mark name, such as "ttft" or "total".
+
+        Returns:
+            float: Seconds since the start of the turn.
+        """
+        elapsed = time.perf_counter() - self.start
+        self.marks[name] = elapsed
+        self.metrics.observe(f"cocoa_turn_{name}_seconds", elapsed)
+        return elapsed
+
+    def log(self):
+        """
+        Log the turn as one line if it was sampled.
+        """
+        if self.sampled:
+            logger.info(
+                "Turn trace session=%s marks=%s spans=%s",
+                self.session_id,
+                {name: round(value, 4) for name, value in self.marks.items()},
+                [span.as_dict() for span in self.spans],
+            )
@@ -0,0 +1,99 @@
+import threading
+
+
+class UsageTracker:
+    """Accumulates token usage reported by OpenAI completions, per pipeline step.
+
+    Cached input tokens come from ``usage.prompt_tokens_details.cached_tokens``
+    and show how much of each prompt the provider served from its prompt cache.
+    A tracker can forward everything it records to a parent, so per-session
+    trackers also feed the process-wide totals.
+    """
+
+    fields = (
+        "calls",
+        "prompt_tokens",
+        "cached_tokens",
+        "completion_tokens",
+        "response_cache_hits",
+    )
+
+    def __init__(self, parent=None):
+        """
+        Initialize the tracker.
+
+        Args:
+            parent (UsageTracker): Optional tracker that receives every record as well.
+        """
+        self.parent = parent
+        self.steps = dict()
+        self._lock = threading.Lock()
+
+    def record(self, step: str, usage):
+        """
+        Record the usage of one completion.
+
+        Args:
+            step (str): The pipeline step that made the call.
+            usage (CompletionUsage): The ``usage`` of the completion, may be None.
+        """
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", None) or 0) if details else 0
+        with self._lock:
+            totals = self.steps.setdefault(step, dict.fromkeys(self.fields, 0))
+            totals["calls"] += 1
+            totals["prompt_tokens"] += usage.prompt_tokens or 0
+            totals["cached_tokens"] += cached
+            totals["completion_tokens"] += usage.completion_tokens or 0
+        if self.parent is not None:
+            self.parent.record(step, usage)
+
+    def record_cache_hit(self, step: str):
+        """
+        Record a call that was answered by the response cache instead of OpenAI.
+
+        Args:
+            step (str): The pipeline step that made the call.
+        """
+        with self._lock:
+            totals = self.steps.setdefault(step, dict.fromkeys(self.fields, 0))
+            totals["response_cache_hits"] += 1
+        if self.parent is not None:
+            self.parent.record_cache_hit(step)
+
+    def totals(self) -> dict:
+        """
+        Sum the usage of every step.
+
+        Returns:
+            dict: Calls, prompt, cached, uncached and completion tokens, response
+                cache hits and the share of prompt tokens that were cached.
+        """
+        with self._lock:
+            totals = dict.fromkeys(self.fields, 0)
+            for step in self.steps.values():
+                for field in self.fields:
+                    totals[field] += step[field]
+        totals["uncached_tokens"] = totals["prompt_tokens"] - totals["cached_tokens"]
+        totals["cached_ratio"] = (
+            totals["cached_tokens"] / totals["prompt_tokens"]
+            if totals["prompt_tokens"]
+            else 0.0
+        )
+        return totals
+
+    def report(self) -> dict:
+        """
+        Report the usage per step and in total.
+
+        Returns:
+            dict: ``{"steps": {...}, "total": {...}}``.
+        """
+        with self._lock:
+            steps = {step: dict(totals) for step, totals in self.steps.items()}
+        return {"steps": steps, "total": self.totals()}
+
+
+process_usage = UsageTracker()
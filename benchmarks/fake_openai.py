@@ -0,0 +1,164 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from starlette.responses import JSONResponse, StreamingResponse
+
+# Canned parsed outputs of the structured calls, keyed by response schema name.
+STRUCTURED_OUTPUTS = {
+    "CognitiveDistortion": {
+        "distortion_type": "Catastrophizing",
+        "utterance": "Everything is going to fall apart.",
+        "score": 4,
+    },
+    "StageExample": {"stage_name": "Understanding and Conceptualization"},
+    "TurnAnalysis": {
+        "cognitive_distortion": {
+            "distortion_type": "Catastrophizing",
+            "utterance": "Everything is going to fall apart.",
+            "score": 4,
+        },
+        "insight": "The client worries that a small setback will ruin their career.",
+        "technique": "Decatastrophizing",
+        "stage_name": "Understanding and Conceptualization",
+    },
+}
+TEXT_OUTPUT = "Decatastrophizing"
+STREAM_TOKEN = "word "
+
+
+def create_app(
+    latency: float = 0.3,
+    jitter: float = 0.0,
+    chunk_interval: float = 0.02,
+    chunks: int = 50,
+    prompt_tokens: int = 800,
+    cached_tokens: int = 512,
+) -> FastAPI:
+    """
+    Create a stand-in for the OpenAI chat completions API.
+
+    Args:
+        latency (float): Seconds before a completion (or its first chunk) is sent.
+        jitter (float): Maximum random seconds added to the latency.
+        chunk_interval (float): Seconds between streamed chunks.
+        chunks (int): Number of content chunks of a streamed reply.
+        prompt_tokens (int): Prompt tokens reported in the usage.
+        cached_tokens (int): Cached prompt tokens reported in the usage.
+
+    Returns:
+        FastAPI: The application.
+    """
+    app = FastAPI()
+    counters = {"completions": 0, "structured": 0, "streams": 0}
+
+    def usage(completion_tokens: int) -> dict:
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+
+    def chunk(id: str, model: str, choices: list, usage: dict = None) -> str:
+        payload = {
+            "id": id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": choices,
+        }
+        if usage is not None:
+            payload["usage"] = usage
+        return f"data: {json.dumps(payload)}\n\n"
+
+    @app.get("/stats")
+    async def stats():
+        return counters
+
+    @app.get("/v1/models")
+    async def models():
+        # Hit by the server's prewarm of its HTTP connection pool.
+        return {"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model"}]}
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "gpt-4o-mini")
+        id = f"chatcmpl-{uuid.uuid4().hex}"
+        await asyncio.sleep(latency + random.uniform(0, jitter))
+
+        if body.get("stream"):
+            counters["streams"] += 1
+            include_usage = body.get("stream_options", {}).get("include_usage")
+
+            async def stream():
+                for index in range(chunks):
+                    if index:
+                        await asyncio.sleep(chunk_interval)
+                    delta = {"content": STREAM_TOKEN}
+                    if index == 0:
+                        delta["role"] = "assistant"
+                    yield chunk(
+                        id, model, [{"index": 0, "delta": delta, "finish_reason": None}]
+                    )
+                yield chunk(id, model, [{"index": 0, "delta": {}, "finish_reason": "stop"}])
+                if include_usage:
+                    yield chunk(id, model, [], usage(chunks))
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(stream(), media_type="text/event-stream")
+
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            counters["structured"] += 1
+            name = response_format["json_schema"]["name"]
+            content = json.dumps(STRUCTURED_OUTPUTS.get(name, {}))
+        else:
+            counters["completions"] += 1
+            content = TEXT_OUTPUT
+        return JSONResponse(
+            {
+                "id": id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": usage(len(content) // 4 + 1),
+            }
+        )
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Stand-in OpenAI server")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--chunk-interval", type=float, default=0.02)
+    parser.add_argument("--chunks", type=int, default=50)
+    args = parser.parse_args()
+    uvicorn.run(
+        create_app(
+            latency=args.latency,
+            jitter=args.jitter,
+            chunk_interval=args.chunk_interval,
+            chunks=args.chunks,
+        ),
+        host="127.0.0.1",
+        port=args.port,
+        log_level="warning",
+    )
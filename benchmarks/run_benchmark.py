@@ -0,0 +1,341 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+UTTERANCES = [
+    "I failed my exam, so I will never get a good job.",
+    "Everyone at work thinks I'm useless.",
+    "Hi.",
+    "My friend didn't text back, she must hate me.",
+    "I should be able to handle all of this on my own.",
+    "Thanks, that makes sense.",
+]
+
+# Metrics where a higher value is a regression; the others regress when lower.
+LOWER_IS_BETTER = ("ttft", "latency")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def summarize(values: list) -> dict:
+    """
+    Summarize a sample with its mean and percentiles.
+
+    Args:
+        values (list[float]): The sample.
+
+    Returns:
+        dict: count, mean, p50, p90, p99 and max.
+    """
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def percentile(p):
+        return values[min(len(values) - 1, int(p * len(values)))]
+
+    return {
+        "count": len(values),
+        "mean": statistics.fmean(values),
+        "p50": percentile(0.5),
+        "p90": percentile(0.9),
+        "p99": percentile(0.99),
+        "max": values[-1],
+    }
+
+
+async def wait_ready(url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"{url} did not become ready")
+
+
+async def run_turn(client: httpx.AsyncClient, session_id: str, utterance: str) -> dict:
+    """
+    Send one turn to /chat and time its stream.
+
+    Returns:
+        dict: ttft, latency, and the number of token events and of reply
+            characters of the turn.
+
+    Raises:
+        RuntimeError: If the server sent an ``error`` event or the stream
+            ended without a ``done`` event.
+    """
+    body = {
+        "session_id": session_id,
+        "messages": [{"role": "user", "content": [{"type": "text", "text": utterance}]}],
+    }
+    start = time.perf_counter()
+    ttft, chunks, chars, event, data, done = None, 0, 0, None, [], False
+    async with client.stream("POST", "/chat", json=body) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+                continue
+            if line.startswith("data:"):
+                data.append(line[len("data:"):].removeprefix(" "))
+                continue
+            if line:
+                continue
+            # A blank line ends the event.
+            if event == "token":
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                chunks += 1
+                # Token events coalesce several deltas, so the reply is
+                # measured by its text rather than by the number of events.
+                chars += len("\n".join(data))
+            elif event == "error":
+                raise RuntimeError("error event: " + "\n".join(data))
+            elif event == "done":
+                done = True
+            event, data = None, []
+    if not done:
+        raise RuntimeError("the stream ended without a done event")
+    latency = time.perf_counter() - start
+    return {"ttft": ttft or latency, "latency": latency, "chunks": chunks, "chars": chars}
+
+
+async def run_load(base_url: str, sessions: int, turns: int) -> dict:
+    """
+    Run ``sessions`` concurrent conversations of ``turns`` turns each.
+
+    Returns:
+        dict: The per-turn samples, the error count and the wall time.
+    """
+    samples, errors = [], []
+    limits = httpx.Limits(max_connections=sessions, max_keepalive_connections=sessions)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+
+        async def conversation(index: int):
+            session_id = f"bench-{uuid.uuid4()}"
+            for turn in range(turns):
+                utterance = UTTERANCES[(index + turn) % len(UTTERANCES)]
+                try:
+                    samples.append(await run_turn(client, session_id, utterance))
+                except Exception as e:
+                    errors.append(str(e))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(conversation(index) for index in range(sessions)))
+        wall = time.perf_counter() - start
+    return {"samples": samples, "errors": errors, "wall": wall}
+
+
+def build_report(config: dict, load: dict, server_usage: dict, startup: dict) -> dict:
+    """
+    Build the benchmark report.
+
+    ``results`` holds the number of completed and failed turns, summaries of
+    ttft, latency and chars_per_second, and the turn throughput. Failed turns
+    are only counted in ``errors``. chars_per_second is the streaming rate
+    after the first token, in reply characters: the server coalesces deltas
+    into token events, so neither events nor upstream tokens can be counted
+    on the client. Reports written before it was introduced had a
+    tokens_per_second metric, which counted events, and are not compared on it.
+
+    Returns:
+        dict: The report.
+    """
+    samples = load["samples"]
+    chars_per_second = [
+        sample["chars"] / (sample["latency"] - sample["ttft"])
+        for sample in samples
+        if sample["latency"] > sample["ttft"]
+    ]
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "config": config,
+        "results": {
+            "turns": len(samples),
+            "errors": len(load["errors"]),
+            "ttft": summarize([sample["ttft"] for sample in samples]),
+            "latency": summarize([sample["latency"] for sample in samples]),
+            "chars_per_second": summarize(chars_per_second),
+            "throughput_turns_per_second": len(samples) / load["wall"],
+        },
+        "server_usage": server_usage,
+        "server_startup": startup,
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Compare a report against a baseline report.
+
+    Args:
+        report (dict): The new report.
+        baseline (dict): The baseline report.
+        tolerance (float): Allowed relative change before a metric regresses.
+
+    Returns:
+        list[str]: One line per regressed metric.
+    """
+    regressions = []
+    new, old = report["results"], baseline["results"]
+    checks = [
+        (f"{metric}.{stat}", new[metric].get(stat), old.get(metric, {}).get(stat), metric)
+        for metric in ("ttft", "latency", "chars_per_second")
+        for stat in ("p50", "p90")
+    ]
+    checks.append(
+        (
+            "throughput_turns_per_second",
+            new["throughput_turns_per_second"],
+            old["throughput_turns_per_second"],
+            "throughput",
+        )
+    )
+    for name, value, reference, metric in checks:
+        if not value or not reference:
+            continue
+        change = (value - reference) / reference
+        if metric not in LOWER_IS_BETTER:
+            change = -change
+        status = "REGRESSION" if change > tolerance else "ok"
+        direction = "worse" if change > 0 else "better"
+        print(
+            f"{name:32} {reference:10.4f} -> {value:10.4f} "
+            f"{abs(change):6.1%} {direction:6} {status}"
+        )
+        if change > tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def start_process(args: list, env: dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, *args],
+        cwd=ROOT,
+        env={**os.environ, **env},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark /chat of server.py against a stand-in OpenAI server"
+    )
+    parser.add_argument("--sessions", type=int, default=16, help="concurrent sessions")
+    parser.add_argument("--turns", type=int, default=4, help="turns per session")
+    parser.add_argument("--latency", type=float, default=0.3, help="fake OpenAI latency")
+    parser.add_argument("--jitter", type=float, default=0.0, help="fake latency jitter")
+    parser.add_argument("--chunk-interval", type=float, default=0.02)
+    parser.add_argument("--chunks", type=int, default=50, help="chunks per streamed reply")
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="extra environment of server.py, such as COCOA_FUSED_ANALYSIS=1",
+    )
+    parser.add_argument("-o", "--output", default="benchmark_report.json")
+    parser.add_argument("--compare", help="baseline report to compare against")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.1, help="allowed relative regression"
+    )
+    return parser.parse_args()
+
+
+async def main(args) -> int:
+    fake_port, server_port = free_port(), free_port()
+    # Every turn should reach the fake server, so the response cache is off.
+    server_env = {
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{fake_port}/v1",
+        "COCOA_RESPONSE_CACHE": "0",
+        **dict(item.split("=", 1) for item in args.env),
+    }
+    fake = start_process(
+        [
+            "-m",
+            "benchmarks.fake_openai",
+            "--port",
+            str(fake_port),
+            "--latency",
+            str(args.latency),
+            "--jitter",
+            str(args.jitter),
+            "--chunk-interval",
+            str(args.chunk_interval),
+            "--chunks",
+            str(args.chunks),
+        ],
+        env={},
+    )
+    server = start_process(
+        ["-m", "uvicorn", "server:app", "--port", str(server_port), "--log-level", "warning"],
+        env=server_env,
+    )
+    base_url = f"http://127.0.0.1:{server_port}"
+    try:
+        await wait_ready(f"http://127.0.0.1:{fake_port}/stats")
+        await wait_ready(f"{base_url}/ready")
+        load = await run_load(base_url, args.sessions, args.turns)
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            server_usage = (await client.get("/usage")).json()
+            startup = (await client.get("/ready")).json()["timings"]
+    finally:
+        for process in (server, fake):
+            process.terminate()
+            process.wait(timeout=30)
+
+    config = {
+        key: getattr(args, key)
+        for key in ("sessions", "turns", "latency", "jitter", "chunk_interval", "chunks")
+    }
+    config["env"] = args.env
+    report = build_report(config, load, server_usage, startup)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report["results"], indent=2))
+    if load["errors"]:
+        print(f"{len(load['errors'])} turns failed, first error: {load['errors'][0]}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["config"] != report["config"]:
+            print("Warning: the baseline was run with a different configuration")
+        if compare(report, baseline, args.tolerance):
+            return 1
+    return 1 if load["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -1,3 +1,6 @@
+import argparse
+import asyncio
+import json
 import os
 
 from dotenv import load_dotenv
@@ -7,6 +10,81 @@ from agent.cocoa import CoCoAgent
 # Load environment variables from .env file
 load_dotenv()
 
-agent = CoCoAgent(os.getenv("OPENAI_API_KEY"))
 
-agent.run()
+def chat(api_key: str):
+    """
+    Chat with CoCoAgent in the terminal until the client types "exit".
+
+    Args:
+        api_key (str): The OpenAI API key.
+    """
+    agent = CoCoAgent(api_key)
+    while True:
+        try:
+            client_utterance = input("You: ").strip()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if client_utterance.lower() in ("exit", "quit"):
+            break
+        if not client_utterance:
+            continue
+        print("CoCoA: ", end="", flush=True)
+        for chunk in agent.process_dialogue(client_utterance):
+            print(chunk, end="", flush=True)
+        print()
+
+
+def batch(api_key: str, args):
+    """
+    Replay a JSONL corpus of conversations and write the turns to a JSONL file.
+
+    Args:
+        api_key (str): The OpenAI API key.
+        args (argparse.Namespace): The parsed batch arguments.
+    """
+    from agent.batch import BatchRunner, default_agent_factory, load_corpus
+    from agent.usage import process_usage
+
+    runner = BatchRunner(
+        default_agent_factory(api_key, fused_analysis=args.fused_analysis),
+        output_path=args.output,
+        concurrency=args.concurrency,
+        turns_per_second=args.turns_per_second,
+    )
+    counters = asyncio.run(runner.run(load_corpus(args.corpus)))
+    print(json.dumps({**counters, "usage": process_usage.totals()}, indent=2))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="CoCoA counseling agent")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("chat", help="chat in the terminal (default)")
+
+    batch_parser = commands.add_parser(
+        "batch", help="replay a JSONL corpus of conversations"
+    )
+    batch_parser.add_argument(
+        "corpus", help='JSONL file with one {"id": ..., "turns": [...]} per line'
+    )
+    batch_parser.add_argument(
+        "-o", "--output", default="batch_results.jsonl", help="per-turn JSONL output"
+    )
+    batch_parser.add_argument(
+        "-c", "--concurrency", type=int, default=8, help="conversations run at once"
+    )
+    batch_parser.add_argument(
+        "-r", "--turns-per-second", type=float, help="limit on client turns per second"
+    )
+    batch_parser.add_argument(
+        "--fused-analysis", action="store_true", help="analyze each turn in one call"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    api_key = os.getenv("OPENAI_API_KEY")
+    if args.command == "batch":
+        batch(api_key, args)
+    else:
+        chat(api_key)
@@ -0,0 +1,431 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MEMORY_COLLECTIONS = ("basic_memory", "cd_memory")
+
+
+def default_embedding_function():
+    """
+    Return the process-wide local embedding service.
+
+    Returns:
+        EmbeddingService: The embedding function.
+    """
+    from memory.embeddings import get_embedding_service
+
+    return get_embedding_service()
+
+
+class MemoryBackend(ABC):
+    """Where CoCoAgent keeps basic_memory and cd_memory.
+
+    A backend hands out collections that support the subset of the Chroma
+    Collection API the agent uses: upsert, query, get, delete and count.
+    """
+
+    embedding_function = None
+
+    def embed(self, texts):
+        """
+        Embed texts with the embedding function of the collections, so one
+        set of query embeddings can be reused across collections.
+
+        Args:
+            texts (list[str]): The texts to embed.
+
+        Returns:
+            list: One embedding per text.
+        """
+        return self.embedding_function(list(texts))
+
+    @abstractmethod
+    def get_collection(self, name: str):
+        """
+        Return the collection with the given name, creating it if needed.
+
+        Args:
+            name (str): The collection name.
+
+        Returns:
+            Collection: The collection.
+        """
+
+    def warm(self, names=MEMORY_COLLECTIONS):
+        """
+        Load the embedding model, open the collections and load their indexes
+        so the first query is fast.
+
+        Args:
+            names (Iterable[str]): The collections to load.
+        """
+        if self.embedding_function is not None:
+            self.embed(["warm up"])
+        for name in names:
+            collection = self.get_collection(name)
+            # A query loads both the embedding model and the vector index.
+            if collection.count():
+                collection.query(query_texts=["warm up"], n_results=1)
+
+
+class ChromaMemoryBackend(MemoryBackend):
+    """Memory kept in Chroma.
+
+    Without arguments the store is the in-process ephemeral client, which is
+    lost on restart. With ``path`` it is persisted on disk, which is safe for
+    a single process only. With ``host`` it talks to a Chroma server, which
+    every uvicorn worker can share.
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        host: str = None,
+        port: int = 8000,
+        embedding_function=None,
+    ):
+        """
+        Initialize the backend.
+
+        Args:
+            path (str): Directory of a persistent Chroma store.
+            host (str): Host of a Chroma server.
+            port (int): Port of the Chroma server.
+            embedding_function (EmbeddingFunction): Optional embedding function of
+                the collections, defaults to the shared embedding service.
+        """
+        import chromadb
+
+        if host:
+            self.client = chromadb.HttpClient(host=host, port=port)
+        elif path:
+            self.client = chromadb.PersistentClient(path=path)
+        else:
+            self.client = chromadb.Client()
+        self.embedding_function = embedding_function or default_embedding_function()
+        self._collections = dict()
+        self._lock = threading.Lock()
+
+    def get_collection(self, name: str):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = self.client.get_or_create_collection(
+                    name=name, embedding_function=self.embedding_function
+                )
+            return self._collections[name]
+
+
+class SQLiteCollection:
+    """A Chroma-compatible collection stored in SQLite with a brute-force
+    cosine vector index.
+
+    Every write is its own transaction, so several processes can share the
+    database. Each process keeps the embedding matrix in memory and reloads it
+    whenever SQLite reports that another connection changed the database.
+    Filtered queries instead read only the matching rows through the
+    session_id index, so their cost is bounded by one session's memories.
+    Distances are cosine distances.
+    """
+
+    def __init__(self, backend, name: str):
+        """
+        Initialize the collection.
+
+        Args:
+            backend (SQLiteMemoryBackend): The backend that owns the database.
+            name (str): The collection name.
+        """
+        self.backend = backend
+        self.name = name
+        self._index_version = None
+        self._ids = []
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+
+    def _embed(self, texts):
+        vectors = self.backend.embed(texts)
+        return [np.asarray(vector, dtype=np.float32) for vector in vectors]
+
+    @staticmethod
+    def _where_clause(where: dict):
+        if not where:
+            return "", []
+        if "$and" in where:
+            clauses, params = zip(
+                *(SQLiteCollection._where_clause(part) for part in where["$and"])
+            )
+            return " AND ".join(c for c in clauses if c), [p for ps in params for p in ps]
+        clauses, params = [], []
+        for key, value in where.items():
+            if not re.fullmatch(r"\w+", key):
+                raise ValueError(f"Unsupported metadata key: {key}")
+            if isinstance(value, dict):
+                ((op, value),) = value.items()
+                if op not in ("$eq", "$ne"):
+                    raise ValueError(f"Unsupported where operator: {op}")
+                sql_op = "=" if op == "$eq" else "!="
+            else:
+                sql_op = "="
+            clauses.append(f"json_extract(metadata, '$.{key}') {sql_op} ?")
+            params.append(value)
+        return " AND ".join(clauses), params
+
+    def upsert(self, ids, documents=None, metadatas=None, embeddings=None):
+        if embeddings is None:
+            embeddings = self._embed(documents)
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [None] * len(ids)
+        rows = [
+            (
+                self.name,
+                id,
+                document,
+                json.dumps(metadata) if metadata else None,
+                np.asarray(embedding, dtype=np.float32).tobytes(),
+            )
+            for id, document, metadata, embedding in zip(
+                ids, documents, metadatas, embeddings
+            )
+        ]
+        self.backend.execute_many(
+            "INSERT OR REPLACE INTO memories "
+            "(collection, id, document, metadata, embedding) VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+
+    def count(self) -> int:
+        (count,) = self.backend.query_one(
+            "SELECT COUNT(*) FROM memories WHERE collection = ?", (self.name,)
+        )
+        return count
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=None):
+        if include is None:
+            include = ["documents", "metadatas"]
+        sql = "SELECT id, document, metadata, embedding FROM memories WHERE collection = ?"
+        params = [self.name]
+        if ids is not None:
+            sql += f" AND id IN ({', '.join('?' * len(ids))})"
+            params += list(ids)
+        clause, where_params = self._where_clause(where)
+        if clause:
+            sql += f" AND {clause}"
+            params += where_params
+        sql += " ORDER BY rowid"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+            if offset:
+                sql += " OFFSET ?"
+                params.append(offset)
+        rows = self.backend.query_all(sql, params)
+        result = {"ids": [row[0] for row in rows]}
+        if "documents" in include:
+            result["documents"] = [row[1] for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [json.loads(row[2]) if row[2] else None for row in rows]
+        if "embeddings" in include:
+            result["embeddings"] = [np.frombuffer(row[3], dtype=np.float32) for row in rows]
+        return result
+
+    def peek(self, limit: int = 10):
+        return self.get(limit=limit)
+
+    def delete(self, ids=None, where=None):
+        sql = "DELETE FROM memories WHERE collection = ?"
+        params = [self.name]
+        if ids is not None:
+            sql += f" AND id IN ({', '.join('?' * len(ids))})"
+            params += list(ids)
+        clause, where_params = self._where_clause(where)
+        if clause:
+            sql += f" AND {clause}"
+            params += where_params
+        self.backend.execute_many(sql, [params])
+
+    def _load_index(self):
+        version = self.backend.version()
+        if version == self._index_version:
+            return
+        rows = self.backend.query_all(
+            "SELECT id, embedding FROM memories WHERE collection = ? ORDER BY rowid",
+            (self.name,),
+        )
+        self._ids = [row[0] for row in rows]
+        if rows:
+            matrix = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            self._matrix = matrix / np.maximum(norms, 1e-12)
+        else:
+            self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._index_version = version
+
+    def query(
+        self,
+        query_texts=None,
+        query_embeddings=None,
+        n_results: int = 10,
+        where=None,
+        include=None,
+    ):
+        if include is None:
+            include = ["documents", "metadatas", "distances"]
+        if query_embeddings is None:
+            query_embeddings = self._embed(query_texts)
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        queries = queries / np.maximum(
+            np.linalg.norm(queries, axis=1, keepdims=True), 1e-12
+        )
+
+        if where:
+            rows = self.get(where=where, include=["embeddings"])
+            ids = rows["ids"]
+            if ids:
+                matrix = np.stack(rows["embeddings"])
+                matrix = matrix / np.maximum(
+                    np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12
+                )
+            else:
+                matrix = np.zeros((0, 0), dtype=np.float32)
+        else:
+            with self.backend.lock:
+                self._load_index()
+                ids, matrix = self._ids, self._matrix
+
+        result = {key: [] for key in ["ids", *include]}
+        for query in queries:
+            if len(ids):
+                similarities = matrix @ query
+                top = np.argsort(-similarities)[:n_results]
+            else:
+                similarities, top = np.zeros(0), []
+            top_ids = [ids[i] for i in top]
+            found = self.get(ids=top_ids, include=include) if top_ids else None
+            by_id = {}
+            if found:
+                for position, id in enumerate(found["ids"]):
+                    by_id[id] = position
+            result["ids"].append(top_ids)
+            for key in include:
+                if key == "distances":
+                    result[key].append([float(1 - similarities[i]) for i in top])
+                else:
+                    result[key].append([found[key][by_id[id]] for id in top_ids])
+        return result
+
+
+class SQLiteMemoryBackend(MemoryBackend):
+    """Memory kept in a SQLite database on disk.
+
+    The database runs in WAL mode with a busy timeout, so several uvicorn
+    workers can read and write it concurrently, and memories survive restarts.
+    """
+
+    def __init__(self, path: str, embedding_function=None):
+        """
+        Initialize the backend.
+
+        Args:
+            path (str): Path of the SQLite database file.
+            embedding_function (EmbeddingFunction): Optional embedding function of
+                the collections, defaults to the shared embedding service.
+        """
+        self.path = path
+        self.embedding_function = embedding_function or default_embedding_function()
+        self.lock = threading.RLock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA busy_timeout=30000")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS memories ("
+            "collection TEXT NOT NULL, id TEXT NOT NULL, document TEXT, "
+            "metadata TEXT, embedding BLOB NOT NULL, PRIMARY KEY (collection, id))"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS memories_session ON memories "
+            "(collection, json_extract(metadata, '$.session_id'))"
+        )
+        self._db.commit()
+        self._collections = dict()
+
+    def get_collection(self, name: str):
+        with self.lock:
+            if name not in self._collections:
+                self._collections[name] = SQLiteCollection(self, name)
+            return self._collections[name]
+
+    def version(self):
+        """
+        Return a value that changes whenever the database changes.
+
+        Returns:
+            tuple[int, int]: SQLite's data_version (bumped by other connections)
+                and the number of changes made through this connection.
+        """
+        (data_version,) = self._db.execute("PRAGMA data_version").fetchone()
+        return data_version, self._db.total_changes
+
+    def execute_many(self, sql: str, rows):
+        with self.lock:
+            with self._db:
+                self._db.executemany(sql, rows)
+
+    def query_one(self, sql: str, params=()):
+        with self.lock:
+            return self._db.execute(sql, params).fetchone()
+
+    def query_all(self, sql: str, params=()):
+        with self.lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def warm(self, names=MEMORY_COLLECTIONS):
+        for name in names:
+            collection = self.get_collection(name)
+            with self.lock:
+                collection._load_index()
+        # Load the embedding model as well.
+        self.embedding_function(["warm up"])
+
+
+def create_memory_backend(embedding_function=None) -> MemoryBackend:
+    """
+    Create the memory backend configured by the environment.
+
+    COCOA_MEMORY_BACKEND selects "ephemeral" (default), "chroma" (persistent,
+    single process), "chroma-http" (shared Chroma server at COCOA_CHROMA_HOST
+    and COCOA_CHROMA_PORT) or "sqlite" (persistent, multi-process).
+    COCOA_MEMORY_PATH sets the directory or file of the persistent stores.
+
+    Args:
+        embedding_function (EmbeddingFunction): Optional embedding function of the collections.
+
+    Returns:
+        MemoryBackend: The backend.
+    """
+    kind = os.getenv("COCOA_MEMORY_BACKEND", "ephemeral")
+    if kind == "ephemeral":
+        return ChromaMemoryBackend(embedding_function=embedding_function)
+    if kind == "chroma":
+        return ChromaMemoryBackend(
+            path=os.getenv("COCOA_MEMORY_PATH", "memory_store"),
+            embedding_function=embedding_function,
+        )
+    if kind == "chroma-http":
+        return ChromaMemoryBackend(
+            host=os.getenv("COCOA_CHROMA_HOST", "localhost"),
+            port=int(os.getenv("COCOA_CHROMA_PORT", "8000")),
+            embedding_function=embedding_function,
+        )
+    if kind == "sqlite":
+        return SQLiteMemoryBackend(
+            path=os.getenv("COCOA_MEMORY_PATH", "memory.sqlite3"),
+            embedding_function=embedding_function,
+        )
+    raise ValueError(f"Unknown memory backend: {kind}")
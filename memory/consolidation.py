@@ -0,0 +1,144 @@
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryConsolidator:
+    """Merges near-duplicate memories of a session and caps their number.
+
+    Long sessions store the same insight ("feels anxious about work") and
+    the same distortion over and over. A consolidation pass clusters a
+    session's memories greedily by cosine similarity of their embeddings.
+    Distortion records are only merged within the same distortion type. The
+    oldest memory of each cluster is kept and its metadata aggregates the
+    cluster: ``count`` is the number of merged records, ``score`` the highest
+    score and ``created_at`` the latest one. If more than
+    ``max_per_session`` memories remain, the least repeated and then the
+    oldest are dropped.
+    """
+
+    def __init__(self, similarity_threshold: float = 0.92, max_per_session: int = 200):
+        """
+        Initialize the consolidator.
+
+        Args:
+            similarity_threshold (float): Cosine similarity above which two memories
+                are near-duplicates.
+            max_per_session (int): Maximum number of memories a session keeps per collection.
+        """
+        self.similarity_threshold = similarity_threshold
+        self.max_per_session = max_per_session
+        self.counters = {"passes": 0, "merged": 0, "dropped": 0}
+        self._lock = threading.Lock()
+
+    def consolidate(self, collection, session_id: str) -> dict:
+        """
+        Consolidate the memories of one session in a collection.
+
+        Args:
+            collection (Collection): basic_memory or cd_memory.
+            session_id (str): The session whose memories are consolidated.
+
+        Returns:
+            dict: How many memories were merged and dropped.
+        """
+        found = collection.get(
+            where={"session_id": session_id},
+            include=["documents", "metadatas", "embeddings"],
+        )
+        ids = found["ids"]
+        result = {"merged": 0, "dropped": 0}
+        if len(ids) < 2:
+            return result
+        metadatas = [dict(metadata or {}) for metadata in found["metadatas"]]
+        order = sorted(
+            range(len(ids)), key=lambda i: metadatas[i].get("created_at", 0)
+        )
+        vectors = np.asarray(found["embeddings"], dtype=np.float32)
+        vectors = vectors / np.maximum(
+            np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12
+        )
+
+        kept, removed, changed = [], [], set()
+        for i in order:
+            metadata = metadatas[i]
+            duplicate_of = None
+            if kept:
+                similarities = vectors[kept] @ vectors[i]
+                for position in np.argsort(-similarities):
+                    if similarities[position] < self.similarity_threshold:
+                        break
+                    candidate = kept[position]
+                    if metadatas[candidate].get("distortion_type") == metadata.get(
+                        "distortion_type"
+                    ):
+                        duplicate_of = candidate
+                        break
+            if duplicate_of is None:
+                kept.append(i)
+                continue
+            self._merge(metadatas[duplicate_of], metadata)
+            changed.add(duplicate_of)
+            removed.append(i)
+        result["merged"] = len(removed)
+
+        if len(kept) > self.max_per_session:
+            ranked = sorted(
+                kept,
+                key=lambda i: (
+                    metadatas[i].get("count", 1),
+                    metadatas[i].get("created_at", 0),
+                ),
+            )
+            dropped = ranked[: len(kept) - self.max_per_session]
+            removed.extend(dropped)
+            changed.difference_update(dropped)
+            result["dropped"] = len(dropped)
+
+        if changed:
+            changed = sorted(changed)
+            collection.upsert(
+                ids=[ids[i] for i in changed],
+                documents=[found["documents"][i] for i in changed],
+                metadatas=[metadatas[i] for i in changed],
+                embeddings=[found["embeddings"][i] for i in changed],
+            )
+        if removed:
+            collection.delete(ids=[ids[i] for i in removed])
+
+        with self._lock:
+            self.counters["passes"] += 1
+            self.counters["merged"] += result["merged"]
+            self.counters["dropped"] += result["dropped"]
+        if removed:
+            logger.info(
+                "Consolidated %s memories of session %s: %s",
+                collection.name,
+                session_id,
+                result,
+            )
+        return result
+
+    @staticmethod
+    def _merge(kept: dict, duplicate: dict):
+        kept["count"] = kept.get("count", 1) + duplicate.get("count", 1)
+        if "score" in duplicate:
+            kept["score"] = max(kept.get("score", 0), duplicate["score"])
+        if "created_at" in duplicate:
+            kept["created_at"] = max(kept.get("created_at", 0), duplicate["created_at"])
+
+    def stats(self) -> dict:
+        """
+        Report how many memories were merged and dropped.
+
+        Returns:
+            dict: Counters suitable for JSON serialization.
+        """
+        with self._lock:
+            stats = dict(self.counters)
+        stats["similarity_threshold"] = self.similarity_threshold
+        stats["max_per_session"] = self.max_per_session
+        return stats
@@ -0,0 +1,232 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def load_embedding_model(model_name: str = None):
+    """
+    Load a local embedding model.
+
+    Args:
+        model_name (str): Optional sentence-transformers model, such as
+            "Yibin-Lei/ReContriever". Defaults to Chroma's ONNX MiniLM.
+
+    Returns:
+        EmbeddingFunction: A callable that embeds a list of texts.
+    """
+    from chromadb.utils import embedding_functions
+
+    if model_name:
+        return embedding_functions.SentenceTransformerEmbeddingFunction(
+            model_name=model_name
+        )
+    return embedding_functions.DefaultEmbeddingFunction()
+
+
+class EmbeddingService:
+    """A process-wide embedding function shared by every session.
+
+    The model is loaded once, on first use. Vectors are cached by the hash of
+    their text in an LRU, so the same insight is never embedded twice.
+    Cache misses from concurrent callers (the memory writers and retrievals
+    of all sessions, which run in worker threads) are gathered for up to
+    ``max_wait`` seconds and embedded together in batches of ``max_batch``.
+
+    The service follows Chroma's EmbeddingFunction protocol, so it can be
+    passed to collections as their ``embedding_function``.
+    """
+
+    def __init__(
+        self,
+        model_name: str = None,
+        max_batch: int = 64,
+        max_wait: float = 0.005,
+        cache_size: int = 50000,
+        loader=load_embedding_model,
+    ):
+        """
+        Initialize the service.
+
+        Args:
+            model_name (str): Optional local model, defaults to Chroma's default.
+            max_batch (int): Maximum number of texts per model call.
+            max_wait (float): How long a batch waits for concurrent requests to join.
+            cache_size (int): Maximum number of cached vectors.
+            loader (Callable[[str], EmbeddingFunction]): Loads the model, overridable
+                for testing.
+        """
+        self.model_name = model_name
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.cache_size = cache_size
+        self.loader = loader
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "batches": 0,
+            "texts_embedded": 0,
+            "embed_seconds": 0.0,
+        }
+
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending = []
+        self._batching = False
+
+    @property
+    def model(self):
+        """The embedding model, loaded on first use."""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    start = time.perf_counter()
+                    self._model = self.loader(self.model_name)
+                    logger.info(
+                        "Loaded embedding model %s in %.2fs",
+                        self.model_name or "default",
+                        time.perf_counter() - start,
+                    )
+        return self._model
+
+    @staticmethod
+    def _key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def __call__(self, input):
+        """
+        Embed texts, reusing cached vectors.
+
+        Args:
+            input (list[str]): The texts to embed.
+
+        Returns:
+            list[np.ndarray]: One vector per text.
+        """
+        texts = [input] if isinstance(input, str) else list(input)
+        keys = [self._key(text) for text in texts]
+        vectors = dict()
+        missing = dict()
+        with self._lock:
+            for key, text in zip(keys, texts):
+                vector = self._cache.get(key)
+                if vector is not None:
+                    self._cache.move_to_end(key)
+                    vectors[key] = vector
+                    self.counters["hits"] += 1
+                elif key not in missing:
+                    missing[key] = text
+                    self.counters["misses"] += 1
+        if missing:
+            vectors.update(self._embed_batched(missing))
+        return [vectors[key] for key in keys]
+
+    def _embed_batched(self, missing: dict) -> dict:
+        future = Future()
+        with self._lock:
+            self._pending.append((missing, future))
+            leader = not self._batching
+            self._batching = True
+        # The first caller runs the model for everyone who joins meanwhile.
+        if leader:
+            self._run_batches()
+        return future.result()
+
+    def _run_batches(self):
+        if self.max_wait:
+            time.sleep(self.max_wait)
+        while True:
+            with self._lock:
+                requests, self._pending = self._pending, []
+                if not requests:
+                    self._batching = False
+                    return
+            texts = dict()
+            for missing, _ in requests:
+                texts.update(missing)
+            try:
+                vectors = self._embed(texts)
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+            for missing, future in requests:
+                future.set_result({key: vectors[key] for key in missing})
+
+    def _embed(self, texts: dict) -> dict:
+        keys, values = list(texts), list(texts.values())
+        vectors = dict()
+        for start in range(0, len(values), self.max_batch):
+            batch_start = time.perf_counter()
+            batch = self.model(values[start : start + self.max_batch])
+            elapsed = time.perf_counter() - batch_start
+            with self._lock:
+                self.counters["batches"] += 1
+                self.counters["texts_embedded"] += len(batch)
+                self.counters["embed_seconds"] += elapsed
+                for key, vector in zip(keys[start:], batch):
+                    vector = np.asarray(vector, dtype=np.float32)
+                    vector.setflags(write=False)
+                    vectors[key] = vector
+                    self._cache[key] = vector
+                    self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return vectors
+
+    def stats(self) -> dict:
+        """
+        Report cache and batching counters.
+
+        Returns:
+            dict: Counters suitable for JSON serialization.
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            stats["cached_vectors"] = len(self._cache)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        stats["mean_batch_size"] = (
+            stats["texts_embedded"] / stats["batches"] if stats["batches"] else 0.0
+        )
+        stats["texts_per_second"] = (
+            stats["texts_embedded"] / stats["embed_seconds"]
+            if stats["embed_seconds"]
+            else 0.0
+        )
+        stats["model_name"] = self.model_name or "default"
+        return stats
+
+
+_services = dict()
+_services_lock = threading.Lock()
+
+
+def get_embedding_service(model_name: str = None) -> EmbeddingService:
+    """
+    Return the process-wide embedding service of a model.
+
+    Args:
+        model_name (str): Optional local model, defaults to COCOA_EMBEDDING_MODEL
+            and then to Chroma's default.
+
+    Returns:
+        EmbeddingService: The shared service.
+    """
+    model_name = model_name or os.getenv("COCOA_EMBEDDING_MODEL") or None
+    with _services_lock:
+        if model_name not in _services:
+            _services[model_name] = EmbeddingService(
+                model_name=model_name,
+                max_batch=int(os.getenv("COCOA_EMBEDDING_BATCH", "64")),
+            )
+        return _services[model_name]
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import defaultdict
+
+from agent.tracing import process_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryWriteBehind:
+    """A per-session write-behind queue for Chroma collections.
+
+    Upserts are buffered and written in batches (one upsert call per
+    collection) once the session has been idle for ``idle_delay`` seconds,
+    once ``max_batch`` documents are pending, or when flush() is called.
+    Flushes are serialized, so awaiting flush() before a query guarantees the
+    query sees every write enqueued before it. A batch that fails to write
+    is retried by the next flushes and dropped after ``max_attempts``
+    failures, so a broken backend cannot fail every later turn.
+    """
+
+    def __init__(self, idle_delay: float = 0.5, max_batch: int = 32, max_attempts: int = 3):
+        """
+        Initialize the queue.
+
+        Args:
+            idle_delay (float): Seconds without new writes after which pending writes are flushed.
+            max_batch (int): Number of pending documents that triggers an immediate flush.
+            max_attempts (int): Failed writes of a collection's batch before it is dropped.
+        """
+        self.idle_delay = idle_delay
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.batches_written = 0
+        self.documents_written = 0
+        self.failed_writes = 0
+        self.documents_dropped = 0
+
+        self._pending = defaultdict(list)
+        self._collections = dict()
+        self._attempts = dict()
+        self._lock = asyncio.Lock()
+        self._timer = None
+
+    def pending_count(self, collection=None) -> int:
+        """
+        Count the documents waiting to be written.
+
+        Args:
+            collection (Collection): Only count writes for this collection.
+
+        Returns:
+            int: The number of pending documents.
+        """
+        if collection is not None:
+            return len(self._pending.get(collection.name, []))
+        return sum(len(entries) for entries in self._pending.values())
+
+    def add(self, collection, document: str, metadata: dict = None, id: str = None):
+        """
+        Enqueue an upsert without blocking.
+
+        Args:
+            collection (Collection): The collection to write to.
+            document (str): The document to embed and store.
+            metadata (dict): Optional metadata of the document.
+            id (str): Optional id, defaults to a random uuid.
+        """
+        self._collections[collection.name] = collection
+        self._pending[collection.name].append(
+            (id or f"{uuid.uuid4()}", document, metadata)
+        )
+        if self._timer is not None:
+            self._timer.cancel()
+        delay = 0 if self.pending_count() >= self.max_batch else self.idle_delay
+        self._timer = asyncio.get_running_loop().create_task(self._flush_later(delay))
+
+    async def _flush_later(self, delay: float):
+        await asyncio.sleep(delay)
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Background memory flush failed")
+
+    async def flush(self):
+        """
+        Write every pending document, one batched upsert per collection.
+
+        Raises:
+            Exception: The first write error; the other collections are still
+                written, and the failed batch is kept for a retry or dropped.
+        """
+        async with self._lock:
+            pending, self._pending = self._pending, defaultdict(list)
+            names = list(pending)
+            error = None
+            for index, name in enumerate(names):
+                entries = pending[name]
+                try:
+                    await asyncio.to_thread(
+                        self._upsert, self._collections[name], entries
+                    )
+                except Exception as e:
+                    self._write_failed(name, entries, e)
+                    error = error or e
+                except BaseException:
+                    # Cancelled: put unwritten documents back for a later flush.
+                    for unwritten in names[index:]:
+                        self._pending[unwritten][:0] = pending[unwritten]
+                    raise
+                else:
+                    self._attempts.pop(name, None)
+            if error is not None:
+                raise error
+
+    def _write_failed(self, name: str, entries: list, error: Exception):
+        self.failed_writes += 1
+        process_metrics.increment("cocoa_memory_write_failures_total", collection=name)
+        attempts = self._attempts.get(name, 0) + 1
+        if attempts < self.max_attempts:
+            self._attempts[name] = attempts
+            self._pending[name][:0] = entries
+            return
+        self._attempts.pop(name, None)
+        self.documents_dropped += len(entries)
+        process_metrics.increment(
+            "cocoa_memory_writes_dropped_total", len(entries), collection=name
+        )
+        logger.error(
+            "Dropping %d memory writes to %s after %d failed attempts: %s",
+            len(entries),
+            name,
+            attempts,
+            error,
+        )
+
+    def _upsert(self, collection, entries):
+        start = time.perf_counter()
+        # Chroma rejects a metadatas list that mixes dicts and None.
+        with_metadata = [entry for entry in entries if entry[2]]
+        without_metadata = [entry for entry in entries if not entry[2]]
+        if with_metadata:
+            ids, documents, metadatas = zip(*with_metadata)
+            collection.upsert(
+                ids=list(ids), documents=list(documents), metadatas=list(metadatas)
+            )
+        if without_metadata:
+            ids, documents, _ = zip(*without_metadata)
+            collection.upsert(ids=list(ids), documents=list(documents))
+        self.batches_written += 1
+        self.documents_written += len(entries)
+        process_metrics.observe(
+            "cocoa_span_duration_seconds",
+            time.perf_counter() - start,
+            span="memory_upsert",
+        )
+
+    async def close(self):
+        """
+        Cancel the idle timer and flush whatever is still pending.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
@@ -1,10 +1,27 @@
+import difflib
+import os
+import re
+import threading
+from inspect import cleandoc
+
+CBT_DOC_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "docs", "cbt_doc.md"
+)
+
+
 class CBTPrompt:
     """A class to represent various prompts used in a Cognitive Behavioral Therapy (CBT) based psychotherapeutic system.
+
+    Every prompt is a static system message, compiled once at import, followed
+    by a short user message holding the per-turn values. Keeping the variable
+    content at the end lets the provider cache the shared prefix.
     Methods
     """
 
-    chunk_size = 1024
     cbt_doc = "None"
+    cbt_doc_index = dict()
+    _docs_loaded = False
+    _docs_lock = threading.Lock()
     cbt_stages = [
         "Identification of Problematic Thoughts/Behaviors",
         "Understanding and Conceptualization",
@@ -13,35 +30,13 @@ class CBTPrompt:
         "Reflection and Maintenance",
     ]
 
-    @classmethod
-    def load_docs(cls):
-        with open("docs/cbt_doc.md", "r") as file:
-            markdown_content = ""
-            while chunk := file.read(cls.chunk_size):
-                markdown_content += chunk
-        cls.cbt_doc = markdown_content
-
-    @classmethod
-    def final_prompt(
-        cls,
-        latest_dialogue: str,
-        technique: str = "None",
-        stage: str = "None",
-    ) -> str:
+    final_system = cleandoc(
         """
-        utterance example of the stage you should go on
-        - Restatement or Paraphrasing: A simple, more concise
-        rephrasing of the help-seeker’s statements that could help
-        them see their situation more clearly.
-        - Reflection of Feelings: Articulate and describe the helpseeker’s feelings.
-        """
-
-        return f"""
-        # System Role
+    # System Role
     You are a psychotherapist who uses Cognitive Behavioral Therapy to treat patients of all types.
 
     # Task
-    Your task is to generate a response following the below instructions.
+    Your task is to generate a response to the client following the below instructions.
 
     # Instructions
     1. Generate response based on given information: recent
@@ -66,32 +61,14 @@ class CBTPrompt:
     - Information: Provide useful information to the help-seeker,
     for example with data, facts, opinions, resources, or by answering questions.
     - Others: Exchange pleasantries and use other support strategies that do not fall into the above categories.
-    
-   # Given information
-
-    **recent utterances**: ```
-    {latest_dialogue}``
-
-    **CBT technique to employ**: ```
-    {technique}```
-
-    **description of CBT technique** : ```
-    {cls.cbt_doc}```
-
-    **CBT stage to employ:** ```
-    {stage}```
 
     # Reminder
     Be very casual and friendly in tone.
-
     """
+    )
 
-    # **utterance example of the stage:** ```
-    # {stage_example}```
-
-    @staticmethod
-    def cognitive_distortion_detection(latest_dialogue: str) -> str:
-        return f"""
+    cognitive_distortion_system = cleandoc(
+        """
     # System Role
     You are an expert in CBT techniques and detecting cognitive distortions.
 
@@ -108,14 +85,11 @@ class CBTPrompt:
     # Types of cognitive distortion
     "All-or-Nothing Thinking", "Overgeneralizing", "Labeling", "Fortune Telling", "Mind Reading", "Emotional Reasoning",
     "Should Statements", "Personalizing", "Disqualifying the Positive", "Catastrophizing", "Comparing and Despairing", "Blaming", "Negative Feeling or Emotion"
-
-    **recent utterances**:```
-    {latest_dialogue}```
     """
+    )
 
-    @staticmethod
-    def technique_selection(distortion_type: str, memory: str) -> str:
-        return f"""
+    technique_system = cleandoc(
+        """
     # System Role
     You are an expert in CBT techniques and a counseling agent.
 
@@ -128,26 +102,15 @@ class CBTPrompt:
 
     # CBT Techniques
     "Guided Discovery", "Efficiency Evaluation", "Pie Chart Technique", "Alternative Perspective", "Decatastrophizing", "Scaling Questions", "Socratic Questioning", "Pros and Cons Analysis", "Thought Experiment", "Evidence-Based Questioning",
-    "Reality Testing", "Continuum Technique", "Changing Rules
-    to Wishes", "Behavior Experiment", "Act ivity Scheduling",
-    "Problem-Solving Skills Training", "Self-Assertiveness Training", "Role-playing and Simulation", "Practice of Assertive
-    Conversation Skills", "Systematic Exposure", "Safety Behaviors Elimination"
-
-    **type of cognitive distortion to treat**: ```
-    {distortion_type}```
-
-    **relevant information about the client associated with that cognitive distortion**: ```
-    {memory}```
+    "Reality Testing", "Continuum Technique", "Changing Rules to Wishes", "Behavior Experiment", "Activity Scheduling",
+    "Problem-Solving Skills Training", "Self-Assertiveness Training", "Role-playing and Simulation", "Practice of Assertive Conversation Skills", "Systematic Exposure", "Safety Behaviors Elimination"
     """
+    )
 
-    @classmethod
-    def stage_example(
-        cls, technique: str, cbt_usage_log: str, latest_dialogue: str
-    ) -> str:
-        return f"""
+    stage_system = cleandoc(
+        f"""
     # System Role
     You are an expert in CBT techniques and a counseling agent.
-    You are going to apply {technique} in counseling.
 
     # Task Instruction
     Determine which stage should the counseling follow,
@@ -155,16 +118,16 @@ class CBTPrompt:
     Output a JSON with a key "stage_name".
 
     # Context
-    Following is the mapping of CBT techniques already used to the stage of each technique```{cbt_usage_log}```
-    If the technique in not present, it means it hasn't been used yet.
-    The conversation below is a conversation in which CBT has been applied. ```{latest_dialogue}```
-    This is the list of all possible stages. ```{cls.cbt_stages}```
+    You will be given the CBT technique you are going to apply, the mapping of CBT techniques
+    already used to the stage of each technique and a conversation in which CBT has been applied.
+    If the technique in not present in the mapping, it means it hasn't been used yet.
+    This is the list of all possible stages. ```{cbt_stages}```
     """
+    )
 
-    @staticmethod
-    def extract_insight(latest_dialogue: str) -> str:
-        return f"""
-    # System Role  
+    insight_system = cleandoc(
+        """
+    # System Role
     You are a psychotherapist who uses Cognitive Behavioral Therapy to help patients.
 
     # Task
@@ -175,8 +138,303 @@ class CBTPrompt:
     Even if the given utterance consists of multiple sentences, consider it as one utterance and extract insights.
     Insights are concise sentences about the patient's mental state, behavior, or emotions or any other relevant information.
     If nothing useful can be extracted, output "None".
+    """
+    )
+
+    turn_analysis_system = cleandoc(
+        f"""
+    # System Role
+    You are an expert in CBT techniques, detecting cognitive distortions and a counseling agent.
+
+    # Task
+    Analyze the client's latest utterance and plan the next counseling step.
+    Complete the four sub-tasks below and output a JSON with the keys
+    cognitive_distortion, insight, technique and stage_name.
+
+    # 1. cognitive_distortion
+    Search cognitive distortion just from the client's latest utterance.
+    Even if the given utterance consists of multiple sentences,
+    consider it as one utterance and identify cognitive distortions.
+    If there are multiple types of cognitive distortions, output the
+    most likely type of cognitive distortion. Also, assign a severity score from 1 to 5 on a Likert scale for the cognitive distortion.
+    Output an object with three keys(distortion_type, utterance, score).
+    If there is no cognitive distortions in the utterance, output "None" as distortion_type, an empty utterance and 0 as score.
+    Types of cognitive distortion:
+    "All-or-Nothing Thinking", "Overgeneralizing", "Labeling", "Fortune Telling", "Mind Reading", "Emotional Reasoning",
+    "Should Statements", "Personalizing", "Disqualifying the Positive", "Catastrophizing", "Comparing and Despairing", "Blaming", "Negative Feeling or Emotion"
+
+    # 2. insight
+    Extract insights from the client's latest utterance that can be used later for helping the patient.
+    Insights are concise sentences about the patient's mental state, behavior, or emotions or any other relevant information.
+    If nothing useful can be extracted, output "None".
+
+    # 3. technique
+    Given the cognitive distortion to treat and the recent utterances, choose only one CBT technique from the list below
+    and output only its name.
+    "Guided Discovery", "Efficiency Evaluation", "Pie Chart Technique", "Alternative Perspective", "Decatastrophizing", "Scaling Questions", "Socratic Questioning", "Pros and Cons Analysis", "Thought Experiment", "Evidence-Based Questioning",
+    "Reality Testing", "Continuum Technique", "Changing Rules to Wishes", "Behavior Experiment", "Activity Scheduling",
+    "Problem-Solving Skills Training", "Self-Assertiveness Training", "Role-playing and Simulation", "Practice of Assertive Conversation Skills", "Systematic Exposure", "Safety Behaviors Elimination"
+
+    # 4. stage_name
+    Determine which stage the counseling should follow when applying the chosen technique,
+    if enough progress is not yet made you give the current stage.
+    You will be given the mapping of CBT techniques already used to the stage of each technique.
+    If the technique in not present, it means it hasn't been used yet.
+    This is the list of all possible stages. ```{cbt_stages}```
+    """
+    )
+
+    summary_system = cleandoc(
+        """
+    # System Role
+    You are a psychotherapist who uses Cognitive Behavioral Therapy to help patients.
+
+    # Task
+    Your task is to keep a running summary of a counseling conversation.
+
+    # Instructions
+    Update the current summary with the new dialogue and output only the updated summary.
+    Keep the client's problems, feelings, cognitive distortions, the CBT techniques already
+    tried and any commitments made. Drop small talk.
+    Keep the summary under 200 words.
+    """
+    )
+
+    @classmethod
+    def load_docs(cls, force: bool = False):
+        """
+        Read and index docs/cbt_doc.md, once per process.
+
+        Args:
+            force (bool): Read the doc again even if it is already loaded.
+        """
+        with cls._docs_lock:
+            if cls._docs_loaded and not force:
+                return
+            with open(CBT_DOC_PATH, "r", encoding="utf-8") as file:
+                markdown_content = file.read()
+            cls.cbt_doc = markdown_content
+            cls.cbt_doc_index = cls.index_docs(markdown_content)
+            cls._docs_loaded = True
+
+    @staticmethod
+    def _doc_key(name: str) -> str:
+        return re.sub(r"[^a-z]", "", name.lower())
+
+    @classmethod
+    def index_docs(cls, markdown_content: str) -> dict:
+        """
+        Index the CBT doc by the cognitive distortions and techniques it describes.
+
+        Every bolded bullet (``- **Name:** description``) becomes an entry, and so
+        does every numbered section heading together with its introduction.
+        Entries under the cognitive distortions chapter are kept apart from the
+        CBT strategies so that e.g. "Catastrophizing" never matches "Decatastrophizing".
+
+        Args:
+            markdown_content (str): The content of docs/cbt_doc.md.
+
+        Returns:
+            dict: Mapping of "distortions" and "techniques" to dicts of normalized
+                names and their markdown description.
+        """
+        index = {"distortions": dict(), "techniques": dict()}
+        kind, key = "techniques", None
+        for line in markdown_content.splitlines():
+            bullet = re.match(r"-\s+\*\*(.+?):?\*\*:?\s*(.*)", line)
+            heading = re.match(r"(#+)\s+[\d.]+\s+(.+)", line)
+            if bullet:
+                key = cls._doc_key(bullet.group(1))
+                index[kind][key] = line.strip()
+            elif heading:
+                if len(heading.group(1)) == 2:
+                    kind = "distortions" if "distortion" in line.lower() else "techniques"
+                key = cls._doc_key(heading.group(2))
+                index[kind][key] = line.strip()
+            elif line.startswith("#"):
+                key = None
+            elif key and line.strip():
+                index[kind][key] += "\n" + line.strip()
+        return index
+
+    @classmethod
+    def doc_section(cls, name: str, kind: str = "techniques"):
+        """
+        Look up the description of a cognitive distortion or CBT technique.
+
+        Names are matched loosely, since the prompts and the doc spell them
+        differently (e.g. "Overgeneralizing" and "Overgeneralization").
+
+        Args:
+            name (str): The distortion or technique name.
+            kind (str): Either "techniques" or "distortions".
+
+        Returns:
+            str: The matching description, or None if the doc does not describe it.
+        """
+        sections = cls.cbt_doc_index.get(kind, dict())
+        key = cls._doc_key(name)
+        if not key or key == "none":
+            return None
+        if key in sections:
+            return sections[key]
+        match = difflib.get_close_matches(key, sections, n=1, cutoff=0.75)
+        if match:
+            return sections[match[0]]
+        for doc_key, section in sections.items():
+            if doc_key.startswith(key) or key.startswith(doc_key):
+                return section
+        return None
+
+    @classmethod
+    def technique_description(cls, technique: str, distortion_type: str = "None") -> str:
+        """
+        Select the parts of the CBT doc relevant to a technique and distortion.
+
+        Args:
+            technique (str): The CBT technique to employ.
+            distortion_type (str): The detected cognitive distortion.
+
+        Returns:
+            str: The relevant sections, or the whole doc if the technique is
+                "None" or not described in it.
+        """
+        technique_section = cls.doc_section(technique)
+        if technique_section is None:
+            return cls.cbt_doc
+        distortion_section = cls.doc_section(distortion_type, kind="distortions")
+        if distortion_section is None:
+            return technique_section
+        return f"{technique_section}\n{distortion_section}"
+
+    @staticmethod
+    def _messages(system: str, user: str) -> list:
+        return [
+            {"role": "system", "content": system},
+            {"role": "user", "content": user},
+        ]
+
+    @classmethod
+    def final_prompt(
+        cls,
+        latest_dialogue: str,
+        technique: str = "None",
+        stage: str = "None",
+        distortion_type: str = "None",
+    ) -> list:
+        """
+        utterance example of the stage you should go on
+        - Restatement or Paraphrasing: A simple, more concise
+        rephrasing of the help-seeker’s statements that could help
+        them see their situation more clearly.
+        - Reflection of Feelings: Articulate and describe the helpseeker’s feelings.
+        """
+
+        return cls._messages(
+            cls.final_system,
+            f"""# Given information
 
-    # Given information
     **recent utterances**: ```
     {latest_dialogue}```
-    """
+
+    **CBT technique to employ**: ```
+    {technique}```
+
+    **description of CBT technique** : ```
+    {cls.technique_description(technique, distortion_type)}```
+
+    **CBT stage to employ:** ```
+    {stage}```
+    """,
+        )
+
+    # **utterance example of the stage:** ```
+    # {stage_example}```
+
+    @staticmethod
+    def continue_reply(messages: list, partial_reply: str) -> list:
+        """
+        Ask to continue a reply that was cut off, or that was started under
+        an earlier plan, without repeating it.
+        """
+        return [
+            *messages,
+            {"role": "assistant", "content": partial_reply},
+            {
+                "role": "user",
+                "content": "Continue your last reply exactly where it stopped, "
+                "without repeating any of it.",
+            },
+        ]
+
+    @classmethod
+    def cognitive_distortion_detection(cls, latest_dialogue: str) -> list:
+        return cls._messages(
+            cls.cognitive_distortion_system,
+            f"""**recent utterances**:```
+    {latest_dialogue}```
+    """,
+        )
+
+    @classmethod
+    def technique_selection(cls, distortion_type: str, memory: str) -> list:
+        return cls._messages(
+            cls.technique_system,
+            f"""**type of cognitive distortion to treat**: ```
+    {distortion_type}```
+
+    **relevant information about the client associated with that cognitive distortion**: ```
+    {memory}```
+    """,
+        )
+
+    @classmethod
+    def stage_example(
+        cls, technique: str, cbt_usage_log: str, latest_dialogue: str
+    ) -> list:
+        return cls._messages(
+            cls.stage_system,
+            f"""You are going to apply {technique} in counseling.
+    Following is the mapping of CBT techniques already used to the stage of each technique```{cbt_usage_log}```
+    The conversation below is a conversation in which CBT has been applied. ```{latest_dialogue}```
+    """,
+        )
+
+    @classmethod
+    def extract_insight(cls, latest_dialogue: str) -> list:
+        return cls._messages(
+            cls.insight_system,
+            f"""# Given information
+    **recent utterances**: ```
+    {latest_dialogue}```
+    """,
+        )
+
+    @classmethod
+    def turn_analysis(
+        cls, client_utterance: str, latest_dialogue: str, cbt_usage_log: str
+    ) -> list:
+        return cls._messages(
+            cls.turn_analysis_system,
+            f"""Following is the mapping of CBT techniques already used to the stage of each technique```{cbt_usage_log}```
+
+    **recent utterances**:```
+    {latest_dialogue}```
+
+    **client's latest utterance**:```
+    {client_utterance}```
+    """,
+        )
+
+    @classmethod
+    def summarize_context(cls, summary: str, dialogue: str) -> list:
+        return cls._messages(
+            cls.summary_system,
+            f"""# Given information
+    **current summary**: ```
+    {summary}```
+
+    **new dialogue**: ```
+    {dialogue}```
+    """,
+        )
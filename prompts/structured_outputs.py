@@ -11,6 +11,18 @@ class StageExample(BaseModel):
     stage_name: str
 
 
+class TurnAnalysis(BaseModel):
+    cognitive_distortion: CognitiveDistortion
+    insight: str
+    technique: str
+    stage_name: str
+
+
+class RetrievedMemory(BaseModel):
+    insights: list[str]
+    distortions: list[CognitiveDistortion]
+
+
 class DialogueRequest(BaseModel):
     messages: str
 
@@ -1,12 +1,30 @@
+import asyncio
+import hmac
 import logging
 import os
+import time
+import uuid
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.responses import PlainTextResponse, StreamingResponse
 
-from agent.cocoa import CoCoAgent
+from agent.admission import AdmissionController, AdmissionRejected, retry_after_header
+from agent.async_cocoa import AsyncCoCoAgent
+from agent.cache import ResponseCache
+from agent.clients import close_async_llm_clients, get_async_llm_client
+from agent.preclassifier import NeutralUtteranceGate
+from agent.session_store import create_session_store
+from agent.sessions import SessionRegistry
+from agent.sse import SSEWriter
+from agent.tracing import process_metrics
+from agent.usage import process_usage
+from memory.backends import create_memory_backend
+from memory.consolidation import MemoryConsolidator
+from memory.embeddings import EmbeddingService
+from prompts.prompts import CBTPrompt
 from prompts.structured_outputs import DialogueRequest, DialogueResponse
 
 # Load environment variables from .env file
@@ -16,7 +34,19 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-coco_agent = None
+session_registry = None
+response_cache = None
+neutral_gate = None
+memory_backend = None
+memory_consolidator = None
+admission = None
+sse_writer = SSEWriter()
+background_tasks = set()
+# Seconds spent in each startup phase, and on the first request served.
+startup_timings = dict()
+ready = False
+# Critical prewarm steps whose last attempt failed.
+prewarm_failures = set()
 app = FastAPI()
 
 # Add CORS middleware
@@ -29,17 +59,245 @@ app.add_middleware(
 )
 
 
+LOOPBACK_HOSTS = {"127.0.0.1", "::1", "localhost"}
+
+
+def require_admin(request: Request):
+    # Guards the operational endpoints. With COCOA_ADMIN_TOKEN set they need
+    # "Authorization: Bearer <token>"; without it they only answer loopback
+    # clients, e.g. a scraper sidecar.
+    token = os.getenv("COCOA_ADMIN_TOKEN")
+    if token:
+        authorization = request.headers.get("Authorization", "")
+        if hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode()):
+            return
+    elif request.client is not None and request.client.host in LOOPBACK_HOSTS:
+        return
+    raise HTTPException(status_code=403, detail="Forbidden")
+
+
+async def sweep_sessions(registry: SessionRegistry, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        registry.evict_expired()
+
+
+def record_startup_timing(name: str, started: float):
+    elapsed = time.perf_counter() - started
+    startup_timings[name] = elapsed
+    process_metrics.set("cocoa_startup_seconds", elapsed, phase=name)
+
+
+async def prewarm(
+    llm_client, started: float, retry_delay: float = 1.0, max_retry_delay: float = 30
+):
+    # Load everything the first turn would otherwise wait for, then report
+    # ready. The docs only speed up the first turn, so a failure there is
+    # logged and skipped. The memory step (embedding model and indexes) and
+    # the LLM client are needed to serve turns: while either fails, /ready
+    # stays 503 and names it, and the failed steps are retried with backoff.
+    global ready
+    steps = {
+        "docs": lambda: asyncio.to_thread(CBTPrompt.load_docs),
+        "memory": lambda: asyncio.to_thread(memory_backend.warm),
+        "http_pool": lambda: asyncio.wait_for(llm_client.models.list(), 10),
+    }
+    critical = {"memory", "http_pool"}
+    pending = list(steps)
+    while True:
+        for name in pending:
+            step_started = time.perf_counter()
+            try:
+                await steps[name]()
+            except Exception as e:
+                logger.warning("Prewarm of %s failed: %s", name, type(e).__name__)
+                if name in critical:
+                    prewarm_failures.add(name)
+                    continue
+            prewarm_failures.discard(name)
+            record_startup_timing(f"prewarm_{name}", step_started)
+        if not prewarm_failures:
+            break
+        pending = sorted(prewarm_failures)
+        logger.warning("Not ready, retrying %s in %.0fs", ", ".join(pending), retry_delay)
+        await asyncio.sleep(retry_delay)
+        retry_delay = min(retry_delay * 2, max_retry_delay)
+    record_startup_timing("ready", started)
+    ready = True
+    logger.info("Ready after %.2fs", startup_timings["ready"])
+
+
+def close_session(session_id: str, agent: AsyncCoCoAgent, reason: str):
+    # Flush the session's pending memory writes in the background.
+    task = asyncio.get_running_loop().create_task(agent.aclose())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
 @app.on_event("startup")
 async def startup_event():
-    global coco_agent
-    coco_agent = CoCoAgent(os.getenv("OPENAI_API_KEY"))
-    logger.info("CoCoAgent initialized")
+    global session_registry, response_cache, neutral_gate, memory_backend
+    global memory_consolidator, sse_writer, admission
+    started = time.perf_counter()
+    api_key = os.getenv("OPENAI_API_KEY")
+    llm_client = get_async_llm_client(api_key)
+    if os.getenv("COCOA_RESPONSE_CACHE", "1") == "1":
+        response_cache = ResponseCache(
+            max_entries=int(os.getenv("COCOA_RESPONSE_CACHE_SIZE", "10000")),
+            ttl_seconds=float(os.getenv("COCOA_RESPONSE_CACHE_TTL", "3600")),
+            sqlite_path=os.getenv("COCOA_RESPONSE_CACHE_PATH"),
+        )
+    gate_threshold = os.getenv("COCOA_NEUTRAL_GATE_THRESHOLD", "0.8")
+    if gate_threshold != "off":
+        neutral_gate = NeutralUtteranceGate(threshold=float(gate_threshold))
+    memory_backend = create_memory_backend()
+    if os.getenv("COCOA_MEMORY_CONSOLIDATION", "1") == "1":
+        memory_consolidator = MemoryConsolidator(
+            similarity_threshold=float(os.getenv("COCOA_MEMORY_DEDUP_THRESHOLD", "0.92")),
+            max_per_session=int(os.getenv("COCOA_MEMORY_MAX_PER_SESSION", "200")),
+        )
+    sse_writer = SSEWriter(
+        max_buffer=int(os.getenv("COCOA_SSE_MAX_BUFFER", "64")),
+        max_delay=float(os.getenv("COCOA_SSE_MAX_DELAY", "0.05")),
+        keepalive_interval=float(os.getenv("COCOA_SSE_KEEPALIVE", "15")),
+    )
+    tokens_per_minute = os.getenv("COCOA_TOKENS_PER_MINUTE")
+    session_tokens_per_minute = os.getenv("COCOA_SESSION_TOKENS_PER_MINUTE")
+    admission = AdmissionController(
+        max_in_flight=int(os.getenv("COCOA_MAX_IN_FLIGHT", "64")),
+        max_queue_wait=float(os.getenv("COCOA_QUEUE_WAIT", "2")),
+        tokens_per_minute=int(tokens_per_minute) if tokens_per_minute else None,
+        session_tokens_per_minute=(
+            int(session_tokens_per_minute) if session_tokens_per_minute else None
+        ),
+        degrade_ratio=float(os.getenv("COCOA_DEGRADE_RATIO", "0.8")),
+    )
+    max_bytes = os.getenv("COCOA_SESSION_MAX_BYTES")
+    session_registry = SessionRegistry(
+        factory=lambda session_id: AsyncCoCoAgent(
+            api_key,
+            session_id=session_id,
+            llm_client=llm_client,
+            fused_analysis=os.getenv("COCOA_FUSED_ANALYSIS") == "1",
+            response_cache=response_cache,
+            neutral_gate=neutral_gate,
+            memory_backend=memory_backend,
+            memory_consolidator=memory_consolidator,
+            trace_sample_rate=float(os.getenv("COCOA_TRACE_SAMPLE_RATE", "0.01")),
+            speculative=os.getenv("COCOA_SPECULATIVE") == "1",
+            usage_meter=admission,
+        ),
+        max_sessions=int(os.getenv("COCOA_MAX_SESSIONS", "1000")),
+        ttl_seconds=float(os.getenv("COCOA_SESSION_TTL", "1800")),
+        max_bytes=int(max_bytes) if max_bytes else None,
+        on_evict=close_session,
+        store=create_session_store(),
+    )
+    background_tasks.add(
+        asyncio.create_task(
+            sweep_sessions(session_registry, max(session_registry.ttl_seconds / 4, 1))
+        )
+    )
+    logger.info("Session registry initialized")
+    record_startup_timing("startup", started)
+    task = asyncio.create_task(prewarm(llm_client, started))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in list(background_tasks):
+        task.cancel()
+    if session_registry is not None:
+        session_registry.close_all()
+        await session_registry.flush()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await close_async_llm_clients()
+
+
+@app.get("/sessions", dependencies=[Depends(require_admin)])
+async def sessions():
+    if session_registry is None:
+        raise HTTPException(status_code=500, detail="Session registry not initialized")
+    return session_registry.stats()
+
+
+@app.get("/ready")
+async def readiness():
+    # Readiness probe: 503 until the prewarm has loaded the embedding model
+    # and the memory indexes and reached the LLM API. Failed steps are
+    # listed while they are being retried.
+    if not ready:
+        if prewarm_failures:
+            raise HTTPException(
+                status_code=503,
+                detail={"message": "Prewarm failed", "failed": sorted(prewarm_failures)},
+            )
+        raise HTTPException(status_code=503, detail="Warming up")
+    return {"ready": True, "timings": startup_timings}
+
+
+@app.get("/admission", dependencies=[Depends(require_admin)])
+async def admission_stats():
+    # In-flight turns, tokens of the last minute (process-wide and aggregated
+    # over sessions) and how many turns were admitted, degraded or rejected.
+    if admission is None:
+        raise HTTPException(status_code=500, detail="Admission control not initialized")
+    return admission.stats()
+
+
+@app.get("/usage", dependencies=[Depends(require_admin)])
+async def usage():
+    # Token usage per pipeline step, including prompt tokens served from the
+    # provider's prompt cache, and the LLM calls the neutral gate skipped.
+    report = process_usage.report()
+    if neutral_gate is not None:
+        report["neutral_gate"] = neutral_gate.stats()
+    return report
+
+
+@app.get("/metrics", dependencies=[Depends(require_admin)])
+async def metrics():
+    # Span duration histograms and token, cache hit and error counters of
+    # every pipeline stage, in the Prometheus text format.
+    return PlainTextResponse(
+        process_metrics.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+@app.get("/cache", dependencies=[Depends(require_admin)])
+async def cache():
+    if response_cache is None:
+        raise HTTPException(status_code=404, detail="Response cache disabled")
+    return response_cache.stats()
+
+
+@app.get("/memory", dependencies=[Depends(require_admin)])
+async def memory():
+    if memory_consolidator is None:
+        raise HTTPException(status_code=404, detail="Memory consolidation disabled")
+    return memory_consolidator.stats()
+
+
+@app.get("/embeddings", dependencies=[Depends(require_admin)])
+async def embeddings():
+    embedding_function = getattr(memory_backend, "embedding_function", None)
+    if not isinstance(embedding_function, EmbeddingService):
+        raise HTTPException(status_code=404, detail="Embedding service not in use")
+    return embedding_function.stats()
 
 
 @app.post("/chat")
 async def chat(request: Request):
+    received = time.perf_counter()
     request_body = await request.json()
     messages = request_body.get("messages", [])
+    session_id = (
+        request_body.get("session_id")
+        or request.headers.get("X-Session-Id")
+        or str(uuid.uuid4())
+    )
 
     if not messages:
         raise HTTPException(status_code=400, detail="No messages provided")
@@ -56,17 +314,50 @@ async def chat(request: Request):
         "",
     )
 
-    if not coco_agent:
-        raise HTTPException(status_code=500, detail="CoCoAgent not initialized")
+    if session_registry is None:
+        raise HTTPException(status_code=500, detail="Session registry not initialized")
+
+    def turn_metadata(agent: AsyncCoCoAgent) -> dict:
+        turn = agent.last_turn
+        return {
+            "session_id": session_id,
+            "cognitive_distortion": turn.get("cognitive_distortion"),
+            "technique": turn.get("technique"),
+            "stage": turn.get("stage"),
+            "degraded": turn.get("degraded", False),
+        }
+
+    # Admission is decided before the response starts, so an overloaded
+    # server can still answer 429 instead of a stream.
+    try:
+        ticket = await admission.admit(session_id)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Server is over capacity, retry later",
+            headers={"Retry-After": retry_after_header(e.retry_after)},
+        )
 
     async def generate():
         try:
-            for chunk in coco_agent.process_dialogue(dialogue):
-                # Format each chunk as an SSE message
-                yield f"data: {chunk}\n\n"
-        except Exception as e:
-            logger.error(f"Error processing dialogue: {str(e)}")
-            yield f"data: {str(e)}\n\n"
+            async with session_registry.acquire(session_id) as coco_agent:
+                async for frame in sse_writer.stream(
+                    coco_agent.process_dialogue(dialogue, plan=not ticket.degraded),
+                    is_disconnected=request.is_disconnected,
+                    metadata=lambda: turn_metadata(coco_agent),
+                ):
+                    if frame.startswith("event: token") and (
+                        "first_request_ttft" not in startup_timings
+                    ):
+                        record_startup_timing("first_request_ttft", received)
+                    yield frame
+            if "first_request" not in startup_timings:
+                record_startup_timing("first_request", received)
+        except Exception:
+            logger.exception("Error opening session %s", session_id)
+            yield SSEWriter.json_event("error", {"message": "The reply could not be generated."})
+        finally:
+            ticket.release()
 
     return StreamingResponse(
         generate(),
@@ -74,5 +365,8 @@ async def chat(request: Request):
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
+            "X-Session-Id": session_id,
         },
+        # Releases the slot if the stream never started.
+        background=BackgroundTask(ticket.release),
     )
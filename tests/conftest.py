@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import sys
+
+import httpx
+import pytest
+
+# The packages live at the repository root and are not installed.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeClock:
+    """A clock that only moves when told to."""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+def fake_embed(texts):
+    """A deterministic bag-of-words embedding: texts sharing words are similar."""
+    embeddings = []
+    for text in texts:
+        vector = [0.001] * 16
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % 16] += 1.0
+        norm = sum(value * value for value in vector) ** 0.5
+        embeddings.append([value / norm for value in vector])
+    return embeddings
+
+
+class FakeOpenAITransport(httpx.ASGITransport):
+    """Serves the benchmark's stand-in OpenAI app in process and records requests.
+
+    ``fail`` maps a response schema name, or "stream" for streamed replies, to
+    the HTTP status returned instead of a completion.
+    """
+
+    def __init__(self, **app_kwargs):
+        from benchmarks.fake_openai import create_app
+
+        app_kwargs = {"latency": 0, "chunk_interval": 0, "chunks": 3, **app_kwargs}
+        super().__init__(app=create_app(**app_kwargs))
+        self.requests = list()
+        self.fail = dict()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @staticmethod
+    def kind(body: dict) -> str:
+        if body.get("stream"):
+            return "stream"
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            return response_format["json_schema"]["name"]
+        return "text"
+
+    def kinds(self) -> list:
+        return [self.kind(body) for body in self.requests]
+
+    async def handle_async_request(self, request):
+        if request.url.path.endswith("/chat/completions"):
+            body = json.loads(request.content)
+            self.requests.append(body)
+            status = self.fail.get(self.kind(body))
+            if status is not None:
+                return httpx.Response(
+                    status, json={"error": {"message": "injected failure"}}, request=request
+                )
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return await super().handle_async_request(request)
+        finally:
+            self.in_flight -= 1
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def memory_backend(tmp_path):
+    from memory.backends import SQLiteMemoryBackend
+
+    return SQLiteMemoryBackend(str(tmp_path / "memory.sqlite3"), embedding_function=fake_embed)
+
+
+@pytest.fixture
+def fake_openai():
+    return FakeOpenAITransport()
+
+
+@pytest.fixture
+def llm_client(fake_openai):
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(
+        api_key="test",
+        base_url="http://fake-openai/v1",
+        http_client=httpx.AsyncClient(transport=fake_openai),
+        max_retries=0,
+    )
+
+
+@pytest.fixture
+def make_agent(llm_client, memory_backend):
+    from agent.async_cocoa import AsyncCoCoAgent
+    from agent.resilience import ResilientCaller
+
+    def make_agent(session_id: str = "session", **kwargs):
+        kwargs.setdefault("resilience", ResilientCaller(max_attempts=1))
+        return AsyncCoCoAgent(
+            "test",
+            session_id=session_id,
+            llm_client=llm_client,
+            memory_backend=memory_backend,
+            **kwargs,
+        )
+
+    return make_agent
@@ -0,0 +1,89 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from agent.admission import AdmissionController, AdmissionRejected, retry_after_header
+
+
+def usage(tokens: int):
+    return SimpleNamespace(prompt_tokens=tokens, completion_tokens=0)
+
+
+def test_degrades_under_pressure(clock):
+    controller = AdmissionController(max_in_flight=2, degrade_ratio=0.5, clock=clock)
+
+    async def main():
+        first = await controller.admit("a")
+        second = await controller.admit("b")
+        first.release()
+        first.release()
+        second.release()
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert not first.degraded
+    assert second.degraded
+    assert controller.in_flight == 0
+    assert controller.counters["admitted"] == 1
+    assert controller.counters["degraded"] == 1
+
+
+def test_rejects_after_queue_wait(clock):
+    controller = AdmissionController(max_in_flight=1, max_queue_wait=0.01, clock=clock)
+
+    async def main():
+        held = await controller.admit("a")
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.admit("b")
+        held.release()
+        # The slot is free again once the turn is over.
+        (await controller.admit("b")).release()
+        return rejected.value
+
+    error = asyncio.run(main())
+    assert error.reason == "queue_timeout"
+    assert controller.waiting == 0
+    assert controller.counters["rejected_queue_timeout"] == 1
+
+
+def test_token_budget_window(clock):
+    controller = AdmissionController(tokens_per_minute=100, clock=clock)
+    controller.record_usage("a", usage(60))
+    clock.advance(30)
+    controller.record_usage("b", usage(60))
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        asyncio.run(controller.admit("c"))
+    assert rejected.value.reason == "token_budget"
+    # Dropping the first call brings the window below the budget.
+    assert rejected.value.retry_after == pytest.approx(30)
+
+    clock.advance(31)
+    asyncio.run(controller.admit("c")).release()
+    assert controller.stats()["tokens_last_minute"] == 60
+
+
+def test_session_token_budget(clock):
+    controller = AdmissionController(session_tokens_per_minute=100, clock=clock)
+    controller.record_usage("a", usage(150))
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        asyncio.run(controller.admit("a"))
+    assert rejected.value.reason == "session_token_budget"
+    asyncio.run(controller.admit("b")).release()
+
+    stats = controller.stats()
+    assert stats["sessions_over_budget"] == 1
+    assert stats["max_session_tokens_last_minute"] == 150
+
+
+def test_ignores_missing_usage(clock):
+    controller = AdmissionController(clock=clock)
+    controller.record_usage("a", None)
+    assert controller.stats()["tokens_last_minute"] == 0
+
+
+def test_retry_after_header():
+    assert retry_after_header(0) == "1"
+    assert retry_after_header(2.1) == "3"
@@ -0,0 +1,77 @@
+import asyncio
+
+from benchmarks.fake_openai import create_app
+
+
+def test_chat_returns_the_whole_reply(make_agent, fake_openai):
+    agent = make_agent()
+
+    async def main():
+        reply = await agent.chat("I keep thinking I will fail.")
+        await agent.aclose()
+        return reply
+
+    assert asyncio.run(main()) == "word word word "
+    assert agent.chat_history[-1] == {"role": "assistant", "content": "word word word "}
+    assert fake_openai.kinds()[-1] == "stream"
+    assert agent.usage.totals()["completion_tokens"] > 0
+
+
+def run_turns(agent, *utterances):
+    async def main():
+        replies = [await agent.chat(utterance) for utterance in utterances]
+        await agent.aclose()
+        return replies
+
+    return asyncio.run(main())
+
+
+def test_detection_and_insight_run_concurrently(make_agent, fake_openai):
+    # Slow calls overlap only if they are sent together.
+    fake_openai.app = create_app(latency=0.05, chunk_interval=0, chunks=3)
+    agent = make_agent()
+    run_turns(agent, "Everything is going to fall apart.")
+
+    assert fake_openai.kinds()[:2] == ["CognitiveDistortion", "text"]
+    assert fake_openai.max_in_flight == 2
+
+
+def test_planned_turn_selects_technique_and_stage(make_agent, fake_openai):
+    agent = make_agent()
+    run_turns(agent, "Everything is going to fall apart.")
+
+    # Technique selection is a text call; the stage depends on the technique.
+    assert fake_openai.kinds() == [
+        "CognitiveDistortion",
+        "text",
+        "text",
+        "StageExample",
+        "stream",
+    ]
+    assert agent.last_turn["technique"] == "Decatastrophizing"
+    assert agent.last_turn["stage"] == "Understanding and Conceptualization"
+
+
+def test_fused_analysis_replaces_the_separate_calls(make_agent, fake_openai):
+    agent = make_agent(fused_analysis=True)
+    run_turns(agent, "Everything is going to fall apart.")
+
+    assert fake_openai.kinds() == ["TurnAnalysis", "stream"]
+    assert agent.last_turn["cognitive_distortion"]["distortion_type"] == "Catastrophizing"
+    assert agent.last_turn["technique"] == "Decatastrophizing"
+
+
+def test_failed_fused_analysis_falls_back(make_agent, fake_openai):
+    fake_openai.fail["TurnAnalysis"] = 400
+    agent = make_agent(fused_analysis=True)
+    run_turns(agent, "Everything is going to fall apart.")
+
+    assert fake_openai.kinds() == [
+        "TurnAnalysis",
+        "CognitiveDistortion",
+        "text",
+        "text",
+        "StageExample",
+        "stream",
+    ]
+    assert agent.last_turn["stage"] == "Understanding and Conceptualization"
@@ -0,0 +1,87 @@
+import asyncio
+import json
+
+from agent.batch import BatchRunner, completed_conversations, load_corpus
+
+
+def read_records(path) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_load_corpus(tmp_path):
+    path = tmp_path / "corpus.jsonl"
+    path.write_text(
+        '{"id": 7, "turns": ["hi", "I failed"]}\n'
+        "\n"
+        '{"messages": [{"role": "user", "content": "hello"}, '
+        '{"role": "assistant", "content": "hi!"}]}\n',
+        encoding="utf-8",
+    )
+
+    assert load_corpus(str(path)) == [("7", ["hi", "I failed"]), ("line-3", ["hello"])]
+
+
+def test_completed_conversations_drops_half_done_records(tmp_path):
+    path = tmp_path / "results.jsonl"
+    path.write_text(
+        '{"conversation_id": "a", "turn": 0}\n'
+        '{"conversation_id": "b", "turn": 0}\n'
+        '{"conversation_id": "a", "done": true}\n',
+        encoding="utf-8",
+    )
+
+    assert completed_conversations(str(path)) == {"a"}
+    assert [record["conversation_id"] for record in read_records(path)] == ["a", "a"]
+    assert completed_conversations(str(tmp_path / "missing.jsonl")) == set()
+
+
+def test_rerun_resumes_unfinished_conversations(tmp_path, make_agent):
+    path = tmp_path / "results.jsonl"
+    path.write_text(
+        '{"conversation_id": "a", "turn": 0}\n'
+        '{"conversation_id": "a", "turn": 1}\n'
+        '{"conversation_id": "a", "done": true}\n'
+        '{"conversation_id": "b", "turn": 0}\n',
+        encoding="utf-8",
+    )
+    replayed = []
+
+    def factory(conversation_id):
+        replayed.append(conversation_id)
+        return make_agent(conversation_id)
+
+    runner = BatchRunner(factory, str(path), concurrency=2)
+    counters = asyncio.run(
+        runner.run([("a", ["hi", "bye"]), ("b", ["I failed", "again"]), ("c", ["hello"])])
+    )
+
+    assert sorted(replayed) == ["b", "c"]
+    assert counters == {"conversations": 2, "turns": 3, "failed": 0, "skipped": 1}
+    records = read_records(path)
+    turns_of_b = [
+        record["turn"]
+        for record in records
+        if record["conversation_id"] == "b" and "turn" in record
+    ]
+    assert turns_of_b == [0, 1]
+    finished = {record["conversation_id"] for record in records if record.get("done")}
+    assert finished == {"a", "b", "c"}
+
+
+def test_failed_conversation_is_recorded_and_closed(tmp_path, make_agent, fake_openai):
+    fake_openai.fail["stream"] = 400
+    agents = []
+
+    def factory(conversation_id):
+        agents.append(make_agent(conversation_id))
+        return agents[-1]
+
+    path = tmp_path / "results.jsonl"
+    counters = asyncio.run(BatchRunner(factory, str(path)).run([("a", ["I failed"])]))
+
+    assert counters["failed"] == 1
+    assert "error" in read_records(path)[-1]
+    assert agents[0].close_task is not None and agents[0].close_task.done()
+    # A failed conversation is replayed again by the next run.
+    assert completed_conversations(str(path)) == set()
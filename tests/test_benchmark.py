@@ -0,0 +1,87 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from agent.sse import SSEWriter
+from benchmarks.run_benchmark import build_report, compare, run_load, run_turn
+
+
+def chat_app(*frames: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/chat")
+    async def chat():
+        async def generate():
+            for frame in frames:
+                yield frame
+
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    return app
+
+
+def turn(app: FastAPI) -> dict:
+    async def main():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://server") as client:
+            return await run_turn(client, "session", "hi")
+
+    return asyncio.run(main())
+
+
+def test_completed_turn_is_timed():
+    sample = turn(
+        chat_app(
+            SSEWriter.event("token", "Hello "),
+            SSEWriter.event("token", "there"),
+            SSEWriter.json_event("done", {}),
+        )
+    )
+
+    assert (sample["chunks"], sample["chars"]) == (2, len("Hello there"))
+    assert 0 < sample["ttft"] <= sample["latency"]
+
+
+@pytest.mark.parametrize(
+    "frames",
+    [
+        [SSEWriter.event("token", "Hel"), SSEWriter.json_event("error", {"message": "failed"})],
+        [SSEWriter.event("token", "Hel")],
+    ],
+)
+def test_failed_turns_raise(frames):
+    with pytest.raises(RuntimeError):
+        turn(chat_app(*frames))
+
+
+def test_failed_turns_are_errors_not_samples(monkeypatch):
+    app = chat_app(SSEWriter.json_event("error", {"message": "failed"}))
+    original = httpx.AsyncClient
+
+    def client(**kwargs):
+        return original(transport=httpx.ASGITransport(app=app), **kwargs)
+
+    monkeypatch.setattr(httpx, "AsyncClient", client)
+    load = asyncio.run(run_load("http://server", sessions=2, turns=2))
+
+    assert load["samples"] == []
+    assert len(load["errors"]) == 4
+
+
+def test_reports_measure_characters_per_second():
+    samples = [
+        {"ttft": 0.1, "latency": 1.1, "chunks": 2, "chars": 100},
+        {"ttft": 0.2, "latency": 0.7, "chunks": 5, "chars": 100},
+    ]
+    report = build_report({}, {"samples": samples, "errors": [], "wall": 2}, {}, {})
+    results = report["results"]
+
+    assert results["chars_per_second"]["p50"] == pytest.approx(200)
+    assert "tokens_per_second" not in results
+    # Baselines from before the rename are still compared on the other metrics.
+    baseline = {"results": {**results, "tokens_per_second": {"p50": 3.0}}}
+    del baseline["results"]["chars_per_second"]
+    assert compare(report, baseline, tolerance=0.1) == []
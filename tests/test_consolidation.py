@@ -0,0 +1,51 @@
+from memory.consolidation import MemoryConsolidator
+
+
+def add(collection, id: str, document: str, session_id: str = "a", **metadata):
+    collection.upsert(
+        ids=[id], documents=[document], metadatas=[{"session_id": session_id, **metadata}]
+    )
+
+
+def test_near_duplicates_are_merged_into_the_oldest(memory_backend):
+    collection = memory_backend.get_collection("cd_memory")
+    add(collection, "1", "all is lost", distortion_type="Catastrophizing", score=2, created_at=1)
+    add(collection, "2", "all is lost", distortion_type="Catastrophizing", score=4, created_at=2)
+    add(collection, "3", "all is lost", distortion_type="Labeling", score=3, created_at=3)
+    add(collection, "4", "i hate mondays", distortion_type="Catastrophizing", created_at=4)
+
+    result = MemoryConsolidator().consolidate(collection, "a")
+
+    assert result == {"merged": 1, "dropped": 0}
+    found = collection.get(where={"session_id": "a"})
+    metadatas = dict(zip(found["ids"], found["metadatas"]))
+    # Records of another distortion type are never merged.
+    assert sorted(metadatas) == ["1", "3", "4"]
+    merged = metadatas["1"]
+    assert (merged["count"], merged["score"], merged["created_at"]) == (2, 4, 2)
+
+
+def test_other_sessions_are_untouched(memory_backend):
+    collection = memory_backend.get_collection("basic_memory")
+    add(collection, "1", "worried about work")
+    add(collection, "2", "worried about work")
+    add(collection, "3", "worried about work", session_id="b")
+
+    MemoryConsolidator().consolidate(collection, "a")
+
+    assert collection.get(where={"session_id": "b"})["ids"] == ["3"]
+    assert collection.count() == 2
+
+
+def test_sessions_are_capped_keeping_repeated_and_recent_memories(memory_backend):
+    collection = memory_backend.get_collection("basic_memory")
+    add(collection, "old", "likes hiking", created_at=1)
+    add(collection, "repeated", "fears exams", created_at=2, count=3)
+    add(collection, "new", "misses home", created_at=3)
+
+    consolidator = MemoryConsolidator(max_per_session=2)
+    result = consolidator.consolidate(collection, "a")
+
+    assert result == {"merged": 0, "dropped": 1}
+    assert sorted(collection.get(where={"session_id": "a"})["ids"]) == ["new", "repeated"]
+    assert consolidator.stats()["dropped"] == 1
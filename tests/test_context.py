@@ -0,0 +1,54 @@
+from agent.context import ConversationContext
+
+
+def message(text: str) -> dict:
+    return {"role": "user", "content": text}
+
+
+def test_trim_keeps_the_latest_messages():
+    history = [message("x" * 40) for _ in range(10)]
+    context = ConversationContext(history, max_tokens=30, min_messages=2)
+
+    assert context.trim()
+    assert len(history) == 2
+    assert len(context.pending) + context.dropped == 8
+    assert context.messages()[-2:] == history
+
+
+def test_summary_folds_pending_messages():
+    history = [message(str(number) * 40) for number in range(6)]
+    context = ConversationContext(history, max_tokens=30, min_messages=2)
+    context.trim()
+
+    summary, dialogue, folded = context.summary_input()
+    assert summary == "" and folded == len(context.pending)
+    context.apply_summary(" The client talked. ", folded)
+
+    assert context.pending == []
+    assert context.render().startswith("Summary of the earlier conversation: The client talked.")
+
+
+def test_pending_is_bounded_when_summaries_fail():
+    history = []
+    context = ConversationContext(history, max_tokens=30, min_messages=2)
+    for number in range(50):
+        history.append(message("x" * 40))
+        context.trim()
+
+    pending_tokens = sum(len(item["content"]) // 4 + 1 for item in context.pending)
+    assert pending_tokens <= 30
+    assert context.dropped == 50 - len(history) - len(context.pending)
+
+
+def test_summary_after_drops_keeps_unfolded_messages():
+    history = [message(text * 40) for text in "abc"]
+    context = ConversationContext(history, max_tokens=30, min_messages=2)
+    context.trim()
+    _, _, folded = context.summary_input()
+
+    # While the summary is written, "a" is dropped to make room for "b".
+    history.append(message("d" * 40))
+    context.trim()
+    context.apply_summary("summary", folded)
+
+    assert [item["content"][0] for item in context.pending] == ["b"]
@@ -0,0 +1,101 @@
+import threading
+
+import pytest
+
+from memory.embeddings import EmbeddingService
+
+
+class FakeModel:
+    def __init__(self, fail: bool = False):
+        self.calls = []
+        self.fail = fail
+        self.lock = threading.Lock()
+
+    def __call__(self, texts):
+        with self.lock:
+            self.calls.append(list(texts))
+        if self.fail:
+            raise RuntimeError("model crashed")
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+def service_with(model, **kwargs):
+    loaded = []
+
+    def loader(model_name):
+        loaded.append(model_name)
+        return model
+
+    service = EmbeddingService(loader=loader, **kwargs)
+    return service, loaded
+
+
+def test_model_is_loaded_once_on_first_use():
+    service, loaded = service_with(FakeModel(), max_wait=0)
+    assert loaded == []
+
+    service(["a"])
+    service(["b"])
+    assert loaded == [None]
+
+
+def test_vectors_are_cached_and_deduplicated():
+    model = FakeModel()
+    service, _ = service_with(model, max_wait=0)
+
+    first = service(["hello", "hi", "hello"])
+    second = service("hello")
+
+    assert model.calls == [["hello", "hi"]]
+    assert list(first[0]) == [5.0, 1.0] and first[0] is first[2]
+    assert second[0] is first[0]
+    assert service.stats()["hits"] == 1
+    assert service.stats()["misses"] == 2
+
+
+def test_cache_is_bounded():
+    model = FakeModel()
+    service, _ = service_with(model, max_wait=0, cache_size=2)
+    service(["a", "bb", "ccc"])
+    service(["a"])
+
+    assert service.stats()["cached_vectors"] == 2
+    assert model.calls[-1] == ["a"]
+
+
+def test_large_requests_are_split_into_batches():
+    model = FakeModel()
+    service, _ = service_with(model, max_wait=0, max_batch=2)
+    service(["a", "b", "c", "d", "e"])
+
+    assert [len(call) for call in model.calls] == [2, 2, 1]
+    assert service.stats()["mean_batch_size"] == pytest.approx(5 / 3)
+
+
+def test_concurrent_callers_share_a_batch():
+    model = FakeModel()
+    service, _ = service_with(model, max_wait=0.05)
+    results = dict()
+
+    def embed(text):
+        results[text] = service([text])[0]
+
+    threads = [threading.Thread(target=embed, args=(text,)) for text in ("a", "bb", "ccc")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(model.calls) == 1
+    assert sorted(model.calls[0]) == ["a", "bb", "ccc"]
+    assert {text: vector[0] for text, vector in results.items()} == {"a": 1, "bb": 2, "ccc": 3}
+
+
+def test_model_errors_reach_every_caller():
+    service, _ = service_with(FakeModel(fail=True), max_wait=0)
+
+    with pytest.raises(RuntimeError):
+        service(["a"])
+    # The next call runs a fresh batch instead of waiting forever.
+    with pytest.raises(RuntimeError):
+        service(["a"])
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+from conftest import fake_embed
+
+from memory.backends import ChromaMemoryBackend, MemoryBackend, SQLiteMemoryBackend
+
+
+class FakeEmbeddingFunction:
+    # Chroma checks that embedding functions take ``input``.
+    def __call__(self, input):
+        return fake_embed(input)
+
+
+@pytest.fixture(params=["sqlite", "chroma"])
+def backend(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteMemoryBackend(str(tmp_path / "memory.sqlite3"), embedding_function=fake_embed)
+    return ChromaMemoryBackend(
+        path=str(tmp_path / "chroma"), embedding_function=FakeEmbeddingFunction()
+    )
+
+
+def add(collection, session_id: str, *documents):
+    collection.upsert(
+        ids=[f"{session_id}-{number}" for number in range(len(documents))],
+        documents=list(documents),
+        metadatas=[{"session_id": session_id} for _ in documents],
+    )
+
+
+def test_memory_backend_is_abstract():
+    with pytest.raises(TypeError):
+        MemoryBackend()
+
+
+def test_queries_are_filtered_by_session(backend):
+    collection = backend.get_collection("basic_memory")
+    assert backend.get_collection("basic_memory") is collection
+    add(collection, "a", "afraid of losing the job", "worried about exams")
+    add(collection, "b", "afraid of losing the job")
+
+    found = collection.query(
+        query_embeddings=backend.embed(["losing the job"]),
+        n_results=5,
+        where={"session_id": "a"},
+    )
+    assert found["ids"] == [["a-0", "a-1"]]
+    assert found["distances"][0][0] < found["distances"][0][1]
+    assert collection.get(where={"session_id": {"$ne": "a"}})["ids"] == ["b-0"]
+
+    collection.delete(where={"session_id": "a"})
+    assert collection.count() == 1
+
+
+def test_agents_retrieve_only_their_session(make_agent):
+    first, second = make_agent("first"), make_agent("second")
+    add(first.basic_memory, "first", "afraid of losing the job")
+    add(second.basic_memory, "second", "afraid of losing the job too")
+
+    memory = asyncio.run(first.retrieve_memory("Catastrophizing", "losing the job"))
+    assert memory.insights == ["afraid of losing the job"]
+    assert first.memory_count(first.basic_memory) == 1
+
+
+def test_sqlite_workers_see_each_others_writes(tmp_path):
+    path = str(tmp_path / "memory.sqlite3")
+    worker = SQLiteMemoryBackend(path, embedding_function=fake_embed).get_collection("cd_memory")
+    other = SQLiteMemoryBackend(path, embedding_function=fake_embed).get_collection("cd_memory")
+
+    add(worker, "a", "everything is ruined")
+    assert other.query(query_texts=["ruined"], n_results=1)["ids"] == [["a-0"]]
+
+    add(worker, "b", "nothing works out")
+    assert other.query(query_texts=["nothing works"], n_results=1)["ids"] == [["b-0"]]
+
+
+def test_sqlite_rejects_unsafe_filters(tmp_path):
+    collection = SQLiteMemoryBackend(
+        str(tmp_path / "memory.sqlite3"), embedding_function=fake_embed
+    ).get_collection("cd_memory")
+
+    with pytest.raises(ValueError):
+        collection.get(where={"session_id') OR 1=1 --": "a"})
+    with pytest.raises(ValueError):
+        collection.get(where={"score": {"$gt": 1}})
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from agent.preclassifier import NeutralUtteranceGate
+
+
+@pytest.mark.parametrize("utterance", ["Hi!", "thank you so much", "Okay, sounds good.", "", "  "])
+def test_small_talk_is_neutral(utterance):
+    assert NeutralUtteranceGate().is_neutral(utterance)
+
+
+@pytest.mark.parametrize(
+    "utterance",
+    [
+        "I'm a total failure.",
+        "Hi, I can't sleep.",
+        "I should have known better",
+        "Everyone else is better than me",
+        "Thanks, but it's the worst day ever",
+    ],
+)
+def test_distortion_cues_are_forwarded(utterance):
+    assert NeutralUtteranceGate().score(utterance) == 0.0
+
+
+def test_long_utterances_are_forwarded():
+    gate = NeutralUtteranceGate()
+    assert gate.score("hello there") == 1.0
+    assert not gate.is_neutral("hi so i went to the store and bought some bread for dinner")
+
+
+def test_stats():
+    gate = NeutralUtteranceGate(threshold=0.9)
+    gate.is_neutral("hello")
+    gate.is_neutral("I hate myself")
+
+    assert gate.stats() == {"skipped": 1, "forwarded": 1, "skip_ratio": 0.5, "threshold": 0.9}
+
+
+def test_neutral_turn_skips_detection_and_insight(make_agent, fake_openai):
+    agent = make_agent(neutral_gate=NeutralUtteranceGate())
+
+    async def main():
+        reply = await agent.chat("Hello!")
+        await agent.aclose()
+        return reply
+
+    assert asyncio.run(main())
+    assert fake_openai.kinds() == ["stream"]
+    assert agent.last_turn["cognitive_distortion"]["distortion_type"] == "None"
@@ -0,0 +1,69 @@
+from prompts.prompts import CBTPrompt
+
+DOC = """# CBT
+
+## 2. The Types of Cognitive Distortions
+
+- **Catastrophizing**: Expect the worst outcome
+- **Overgeneralization**: Judge the whole from a limited part
+
+## 3. CBT Strategies
+
+### 3.1 Cognitive Restructuring
+
+Replace distorted thoughts.
+
+- **Decatastrophizing:** Examine how likely the worst outcome is
+  and how the client would cope with it.
+"""
+
+
+def with_doc(doc: str):
+    CBTPrompt.cbt_doc = doc
+    CBTPrompt.cbt_doc_index = CBTPrompt.index_docs(doc)
+
+
+def teardown_function():
+    CBTPrompt.load_docs(force=True)
+
+
+def test_index_keeps_distortions_and_techniques_apart():
+    index = CBTPrompt.index_docs(DOC)
+
+    assert {"catastrophizing", "overgeneralization"} <= set(index["distortions"])
+    assert "catastrophizing" not in index["techniques"]
+    assert "decatastrophizing" in index["techniques"]
+    assert index["techniques"]["decatastrophizing"].endswith("how the client would cope with it.")
+    assert index["techniques"]["cognitiverestructuring"].endswith("Replace distorted thoughts.")
+
+
+def test_doc_section_matches_names_loosely():
+    with_doc(DOC)
+
+    assert CBTPrompt.doc_section("Decatastrophizing").startswith("- **Decatastrophizing:**")
+    assert CBTPrompt.doc_section("Overgeneralizing", kind="distortions").startswith(
+        "- **Overgeneralization**"
+    )
+    assert CBTPrompt.doc_section("Catastrophizing", kind="distortions").startswith(
+        "- **Catastrophizing**"
+    )
+    assert CBTPrompt.doc_section("None") is None
+
+
+def test_technique_description_is_scoped():
+    with_doc(DOC)
+
+    description = CBTPrompt.technique_description("Decatastrophizing", "Catastrophizing")
+    assert "Examine how likely" in description
+    assert "Expect the worst outcome" in description
+    assert "Overgeneralization" not in description
+    # Without a known technique the whole doc is used.
+    assert CBTPrompt.technique_description("None") == DOC
+
+
+def test_real_doc_describes_the_prompted_techniques():
+    CBTPrompt.load_docs(force=True)
+
+    for technique in ("Decatastrophizing", "Behavior Experiment", "Systematic Exposure"):
+        assert CBTPrompt.doc_section(technique) is not None, technique
+    assert len(CBTPrompt.technique_description("Decatastrophizing")) < len(CBTPrompt.cbt_doc)
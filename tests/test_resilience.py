@@ -0,0 +1,106 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from agent.resilience import ResilientCaller, retry_after
+
+
+def rate_limit_error(retry_after_seconds: str = None):
+    headers = {"retry-after": retry_after_seconds} if retry_after_seconds else {}
+    response = httpx.Response(
+        429, headers=headers, request=httpx.Request("POST", "https://api.openai.com")
+    )
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+def flaky(failures: int, result="ok"):
+    calls = []
+
+    async def request():
+        calls.append(None)
+        if len(calls) <= failures:
+            raise rate_limit_error()
+        return result
+
+    return request, calls
+
+
+def test_retries_rate_limits():
+    caller = ResilientCaller(backoff_base=0.001, backoff_cap=0.001)
+    request, calls = flaky(2)
+
+    assert asyncio.run(caller.call("detection", request)) == "ok"
+    assert len(calls) == 3
+
+
+def test_gives_up_after_max_attempts():
+    caller = ResilientCaller(max_attempts=2, backoff_base=0.001, backoff_cap=0.001)
+    request, calls = flaky(5)
+
+    with pytest.raises(openai.RateLimitError):
+        asyncio.run(caller.call("detection", request))
+    assert len(calls) == 2
+
+
+def test_does_not_retry_other_errors():
+    caller = ResilientCaller(backoff_base=0.001)
+    calls = []
+
+    async def request():
+        calls.append(None)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        asyncio.run(caller.call("detection", request))
+    assert len(calls) == 1
+
+
+def test_deadline_bounds_slow_calls():
+    caller = ResilientCaller(deadlines={"detection": 0.05}, backoff_base=0.001)
+
+    async def request():
+        await asyncio.sleep(1)
+
+    async def main():
+        started = asyncio.get_running_loop().time()
+        with pytest.raises(asyncio.TimeoutError):
+            await caller.call("detection", request)
+        return asyncio.get_running_loop().time() - started
+
+    assert asyncio.run(main()) < 0.5
+
+
+def test_hedged_call_uses_first_answer():
+    caller = ResilientCaller(hedge_delay=0.01)
+    calls = []
+
+    async def request():
+        calls.append(None)
+        if len(calls) == 1:
+            await asyncio.sleep(1)
+            return "slow"
+        return "fast"
+
+    assert asyncio.run(caller.call("detection", request)) == "fast"
+    assert len(calls) == 2
+
+
+def test_unhedged_step_is_not_duplicated():
+    caller = ResilientCaller(hedge_delay=0.01)
+    calls = []
+
+    async def request():
+        calls.append(None)
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    assert asyncio.run(caller.call("response", request)) == "ok"
+    assert len(calls) == 1
+
+
+def test_retry_after_header():
+    assert retry_after(rate_limit_error("2")) == 2.0
+    assert retry_after(rate_limit_error()) == 0.0
+    assert retry_after(ValueError()) == 0.0
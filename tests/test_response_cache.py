@@ -0,0 +1,65 @@
+from agent.cache import ResponseCache
+
+
+def test_key_depends_on_model_and_messages():
+    messages = [{"role": "user", "content": "hello"}]
+    key = ResponseCache.make_key("gpt-4o-mini", messages)
+
+    assert key == ResponseCache.make_key("gpt-4o-mini", [dict(message) for message in messages])
+    assert key != ResponseCache.make_key("gpt-4o", messages)
+    assert key != ResponseCache.make_key("gpt-4o-mini", [{"role": "user", "content": "hi"}])
+
+
+def test_entries_expire(clock):
+    cache = ResponseCache(ttl_seconds=10, clock=clock)
+    cache.set("k", "v")
+    assert cache.get("k") == "v"
+
+    clock.advance(11)
+    assert cache.get("k") is None
+    assert cache.counters["expired"] == 1
+    assert cache.counters["misses"] == 1
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = ResponseCache(max_entries=2, clock=clock)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+    assert cache.counters["evictions"] == 1
+
+
+def test_disk_tier_survives_restart(tmp_path, clock):
+    path = str(tmp_path / "cache.sqlite3")
+    ResponseCache(sqlite_path=path, clock=clock).set("k", "v")
+
+    cache = ResponseCache(sqlite_path=path, clock=clock)
+    assert cache.on_disk
+    assert cache.get("k") == "v"
+    assert cache.get("k") == "v"
+    assert cache.counters["disk_hits"] == 1
+    assert cache.counters["memory_hits"] == 1
+
+    clock.advance(3601)
+    assert ResponseCache(sqlite_path=path, clock=clock).get("k") is None
+
+
+def test_disk_tier_is_trimmed(tmp_path, clock):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = ResponseCache(max_entries=10, sqlite_path=path, sqlite_max_entries=50, clock=clock)
+    for number in range(100):
+        clock.advance(1)
+        cache.set(f"k{number}", "v")
+
+    stats = cache.stats()
+    assert stats["disk_entries"] == 50
+    assert stats["memory_entries"] == 10
+    # The least recently accessed entries go first.
+    restarted = ResponseCache(sqlite_path=path, clock=clock)
+    assert restarted.get("k0") is None
+    assert restarted.get("k99") == "v"
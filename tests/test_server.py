@@ -0,0 +1,60 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+class FlakyMemoryBackend:
+    def __init__(self, failures: int):
+        self.failures = failures
+
+    def warm(self):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("embedding model unavailable")
+
+
+async def list_models():
+    return []
+
+
+@pytest.fixture
+def prewarm_state(monkeypatch):
+    monkeypatch.setattr(server, "ready", False)
+    monkeypatch.setattr(server, "prewarm_failures", set())
+    monkeypatch.setattr(server, "startup_timings", dict())
+    monkeypatch.setattr(server.CBTPrompt, "load_docs", lambda: None)
+
+
+def test_failed_critical_steps_keep_the_replica_unready(monkeypatch, prewarm_state):
+    monkeypatch.setattr(server, "memory_backend", FlakyMemoryBackend(failures=2))
+    llm_client = SimpleNamespace(models=SimpleNamespace(list=list_models))
+
+    async def main():
+        task = asyncio.create_task(server.prewarm(llm_client, 0, retry_delay=0.05))
+        await asyncio.sleep(0.01)
+        with pytest.raises(HTTPException) as failed:
+            await server.readiness()
+        await task
+        return failed.value, await server.readiness()
+
+    failed, ready = asyncio.run(main())
+    assert failed.status_code == 503
+    assert failed.detail["failed"] == ["memory"]
+    assert ready["ready"] is True
+    assert "prewarm_memory" in ready["timings"]
+
+
+def test_failed_docs_do_not_block_readiness(monkeypatch, prewarm_state):
+    def load_docs():
+        raise OSError("docs missing")
+
+    monkeypatch.setattr(server.CBTPrompt, "load_docs", load_docs)
+    monkeypatch.setattr(server, "memory_backend", FlakyMemoryBackend(failures=0))
+    llm_client = SimpleNamespace(models=SimpleNamespace(list=list_models))
+
+    asyncio.run(server.prewarm(llm_client, 0))
+    assert server.ready
@@ -0,0 +1,117 @@
+import zlib
+
+import pytest
+
+from agent.cocoa import CoCoAgent
+from agent.session_store import (
+    SNAPSHOT_VERSION,
+    FileSessionStore,
+    SessionStore,
+    SQLiteSessionStore,
+    decode_snapshot,
+    encode_snapshot,
+)
+from memory.backends import SQLiteMemoryBackend
+
+
+def fake_embed(texts):
+    return [[float(len(text)), 1.0, 0.0] for text in texts]
+
+
+@pytest.fixture(params=["file", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "file":
+        return FileSessionStore(str(tmp_path / "sessions"))
+    return SQLiteSessionStore(str(tmp_path / "sessions.sqlite3"))
+
+
+def test_snapshot_encoding_round_trip():
+    state = {"version": SNAPSHOT_VERSION, "chat_history": [{"role": "user", "content": "안녕"}]}
+    assert decode_snapshot(encode_snapshot(state)) == state
+
+
+def test_snapshot_of_other_version_is_rejected():
+    with pytest.raises(ValueError):
+        decode_snapshot(encode_snapshot({"version": SNAPSHOT_VERSION + 1}))
+
+
+def test_session_store_is_abstract():
+    with pytest.raises(TypeError):
+        SessionStore()
+
+
+def test_store_round_trip(store):
+    assert store.load("a") is None
+
+    state = {"version": SNAPSHOT_VERSION, "chat_history": []}
+    assert store.save("a", state) > 0
+    assert store.load("a") == state
+
+    store.save("a", {**state, "memory_writes": 2})
+    assert store.load("a")["memory_writes"] == 2
+
+    store.delete("a")
+    store.delete("a")
+    assert store.load("a") is None
+
+
+def test_unreadable_snapshot_is_treated_as_missing(store):
+    store.write("corrupt", b"not a snapshot")
+    store.write("old", zlib.compress(b'{"version": 0}'))
+
+    assert store.load("corrupt") is None
+    assert store.load("old") is None
+
+
+def test_agent_snapshot_round_trip(tmp_path):
+    backend = SQLiteMemoryBackend(str(tmp_path / "memory.sqlite3"), embedding_function=fake_embed)
+    agent = CoCoAgent("test", session_id="a", llm_client=object(), memory_backend=backend)
+    agent.chat_history.extend(
+        [
+            {"role": "user", "content": "I failed the exam."},
+            {"role": "assistant", "content": "What went through your mind?"},
+        ]
+    )
+    agent.context.summary = "The client is worried about school."
+    agent.context.pending.append({"role": "user", "content": "Earlier message."})
+    agent.cbt_usage_log["Decatastrophizing"] = "Understanding and Conceptualization"
+    agent.cd_memory.upsert(
+        ids=["m1"],
+        documents=["I will never pass."],
+        metadatas=[agent.memory_metadata(distortion_type="Catastrophizing")],
+    )
+
+    state = decode_snapshot(encode_snapshot(agent.snapshot(include_memory=True)))
+
+    other_backend = SQLiteMemoryBackend(
+        str(tmp_path / "other.sqlite3"), embedding_function=fake_embed
+    )
+    restored = CoCoAgent("test", session_id="a", llm_client=object(), memory_backend=other_backend)
+    restored.restore(state)
+
+    assert restored.chat_history == agent.chat_history
+    assert restored.context.history is restored.chat_history
+    assert restored.context.summary == agent.context.summary
+    assert restored.context.pending == agent.context.pending
+    assert restored.cbt_usage_log == agent.cbt_usage_log
+    memories = restored.cd_memory.get(where=restored.memory_filter)
+    assert memories["ids"] == ["m1"]
+    assert memories["documents"] == ["I will never pass."]
+
+
+def test_restore_into_another_session_copies_its_memories(tmp_path):
+    backend = SQLiteMemoryBackend(str(tmp_path / "memory.sqlite3"), embedding_function=fake_embed)
+    source = CoCoAgent("test", session_id="a", llm_client=object(), memory_backend=backend)
+    source.basic_memory.upsert(
+        ids=["m1"], documents=["Worried about work."], metadatas=[source.memory_metadata()]
+    )
+    state = source.snapshot(include_memory=True)
+
+    fork = CoCoAgent("test", session_id="b", llm_client=object(), memory_backend=backend)
+    fork.restore(state)
+    fork.restore(state)
+
+    assert source.basic_memory.get(where=source.memory_filter)["ids"] == ["m1"]
+    copies = fork.basic_memory.get(where=fork.memory_filter)
+    assert copies["documents"] == ["Worried about work."]
+    assert copies["ids"] != ["m1"]
@@ -0,0 +1,136 @@
+import asyncio
+
+from agent.session_store import FileSessionStore
+from agent.sessions import SessionRegistry
+
+
+class FakeContext:
+    def __init__(self):
+        self.summary = ""
+        self.pending = list()
+
+
+class FakeAgent:
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.chat_history = list()
+        self.context = FakeContext()
+        self.cbt_usage_log = dict()
+        self.closed = 0
+
+    async def aclose(self):
+        self.closed += 1
+
+    def snapshot(self) -> dict:
+        return {"version": 1, "chat_history": list(self.chat_history)}
+
+    def restore(self, state: dict):
+        self.chat_history[:] = state["chat_history"]
+
+
+def test_lru_eviction(clock):
+    evicted = []
+    registry = SessionRegistry(
+        FakeAgent,
+        max_sessions=2,
+        clock=clock,
+        on_evict=lambda session_id, agent, reason: evicted.append((session_id, reason)),
+    )
+    registry.get("a")
+    clock.advance(1)
+    registry.get("b")
+    clock.advance(1)
+    registry.get("a")
+    clock.advance(1)
+    registry.get("c")
+
+    assert "b" not in registry
+    assert "a" in registry and "c" in registry
+    assert evicted == [("b", "lru")]
+    assert registry.counters["evicted_lru"] == 1
+
+
+def test_ttl_eviction_spares_sessions_in_use(clock):
+    registry = SessionRegistry(FakeAgent, ttl_seconds=10, clock=clock)
+
+    async def main():
+        registry.get("idle")
+        async with registry.acquire("busy"):
+            clock.advance(11)
+            assert registry.evict_expired() == 1
+            assert "busy" in registry
+        clock.advance(11)
+        assert registry.evict_expired() == 1
+
+    asyncio.run(main())
+    assert len(registry) == 0
+    assert registry.counters["evicted_ttl"] == 2
+
+
+def test_memory_budget_eviction(clock):
+    registry = SessionRegistry(FakeAgent, max_bytes=25, size_of=lambda agent: 10, clock=clock)
+    for session_id in ("a", "b", "c"):
+        registry.get(session_id)
+        clock.advance(1)
+
+    assert "a" not in registry
+    assert registry.total_bytes() == 20
+    assert registry.counters["evicted_memory"] == 1
+
+
+def test_concurrent_acquire_builds_one_agent(clock):
+    built = []
+
+    def factory(session_id):
+        built.append(session_id)
+        return FakeAgent(session_id)
+
+    registry = SessionRegistry(factory, clock=clock)
+
+    async def turn():
+        async with registry.acquire("a") as agent:
+            await asyncio.sleep(0)
+            return agent
+
+    async def main():
+        return await asyncio.gather(*(turn() for _ in range(5)))
+
+    agents = asyncio.run(main())
+    assert built == ["a"]
+    assert all(agent is agents[0] for agent in agents)
+
+
+def test_paging_round_trip(tmp_path, clock):
+    registry = SessionRegistry(
+        FakeAgent, max_sessions=1, store=FileSessionStore(str(tmp_path)), clock=clock
+    )
+
+    async def main():
+        async with registry.acquire("a") as agent:
+            agent.chat_history.append({"role": "user", "content": "hello"})
+        async with registry.acquire("b"):
+            pass
+        await registry.flush()
+        assert "a" not in registry
+        assert agent.closed == 1
+
+        async with registry.acquire("a") as agent:
+            history = list(agent.chat_history)
+        await registry.flush()
+        return history
+
+    assert asyncio.run(main()) == [{"role": "user", "content": "hello"}]
+    assert registry.counters["paged_out"] == 2
+    assert registry.counters["paged_in"] == 1
+
+
+def test_close_forget_deletes_snapshot(tmp_path, clock):
+    store = FileSessionStore(str(tmp_path))
+    registry = SessionRegistry(FakeAgent, store=store, clock=clock)
+    registry.get("a").chat_history.append({"role": "user", "content": "hello"})
+    registry.close("a")
+    assert store.load("a") is not None
+
+    registry.get("a")
+    assert registry.close("a", forget=True)
+    assert store.load("a") is None
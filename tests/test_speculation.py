@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from agent.speculation import SpeculativeStream
+
+
+async def stream(*chunks, error: Exception = None, closed: list = None):
+    try:
+        for chunk in chunks:
+            await asyncio.sleep(0)
+            yield chunk
+        if error is not None:
+            raise error
+        # Keep the stream open until it is read to the end or cancelled.
+        await asyncio.sleep(0)
+    finally:
+        if closed is not None:
+            closed.append(True)
+
+
+async def collect(chunks) -> list:
+    return [chunk async for chunk in chunks]
+
+
+def test_chunks_are_handed_out_during_planning_and_after():
+    async def main():
+        speculation = SpeculativeStream(stream("a", "b", "c"))
+        planning = asyncio.Event()
+        task = asyncio.ensure_future(planning.wait())
+
+        early = []
+        async for chunk in speculation.until(task):
+            early.append(chunk)
+            if len(early) == 2:
+                planning.set()
+                await task
+        return speculation, early, await collect(speculation.rest())
+
+    speculation, early, rest = asyncio.run(main())
+    assert early == ["a", "b"]
+    assert rest == ["c"]
+    assert speculation.text == "abc"
+    assert speculation.complete and speculation.error is None
+
+
+def test_stream_errors_are_raised_by_rest():
+    async def main():
+        speculation = SpeculativeStream(stream("a", error=RuntimeError("upstream")))
+        with pytest.raises(RuntimeError):
+            await collect(speculation.rest())
+        return speculation
+
+    speculation = asyncio.run(main())
+    assert speculation.text == "a"
+    assert not speculation.complete
+    assert isinstance(speculation.error, RuntimeError)
+
+
+def test_cancel_closes_the_upstream_stream():
+    closed = []
+
+    async def main():
+        speculation = SpeculativeStream(stream("a", "b", "c", closed=closed))
+        await asyncio.sleep(0)
+        speculation.cancel()
+        await asyncio.sleep(0)
+        return speculation
+
+    speculation = asyncio.run(main())
+    assert closed == [True]
+    assert not speculation.complete
+
+
+def test_unchanged_plan_keeps_the_speculative_reply(make_agent, fake_openai):
+    agent = make_agent(speculative=True)
+
+    async def main():
+        replies = [
+            await agent.chat("Everything is going to fall apart."),
+            await agent.chat("It will all go wrong again."),
+        ]
+        await agent.aclose()
+        return replies
+
+    replies = asyncio.run(main())
+    assert replies == ["word word word ", "word word word "]
+    assert agent.speculation_counters == {"hit": 1, "miss": 0, "error": 0}
+    # The speculative stream is the only reply stream of the second turn.
+    assert fake_openai.kinds().count("stream") == 2
+    assert agent.last_turn["technique"] == "Decatastrophizing"
+
+
+def test_changed_plan_is_a_miss(make_agent):
+    agent = make_agent(speculative=True)
+
+    async def main():
+        await agent.chat("Everything is going to fall apart.")
+        agent.last_plan = ("Labeling", "Encouragement")
+        await agent.chat("It will all go wrong again.")
+        await agent.aclose()
+
+    asyncio.run(main())
+    assert agent.speculation_counters == {"hit": 0, "miss": 1, "error": 0}
+    assert agent.last_plan == ("Decatastrophizing", "Understanding and Conceptualization")
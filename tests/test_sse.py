@@ -0,0 +1,63 @@
+import asyncio
+
+from agent.sse import SSEWriter
+
+
+async def deltas(*texts, error=None):
+    for text in texts:
+        yield text
+    if error is not None:
+        raise error
+
+
+def collect(writer, chunks, **kwargs):
+    async def main():
+        return [frame async for frame in writer.stream(chunks, **kwargs)]
+
+    return asyncio.run(main())
+
+
+def test_multiline_data_is_framed_per_line():
+    assert SSEWriter.event("token", "a\r\nb\nc") == "event: token\ndata: a\ndata: b\ndata: c\n\n"
+
+
+def test_deltas_are_coalesced():
+    writer = SSEWriter(max_buffer=4, max_delay=1)
+    frames = collect(writer, deltas("ab", "cd", "e"), metadata=lambda: {"stage": "x"})
+
+    assert frames == [
+        SSEWriter.event("token", "abcd"),
+        SSEWriter.event("token", "e"),
+        SSEWriter.json_event("metadata", {"stage": "x"}),
+        SSEWriter.json_event("done", {}),
+    ]
+
+
+def test_failed_reply_ends_with_error_event():
+    frames = collect(SSEWriter(max_buffer=1), deltas("a", error=RuntimeError("secret")))
+
+    assert frames[-1].startswith("event: error\n")
+    assert "secret" not in frames[-1]
+    assert not any(frame.startswith("event: done") for frame in frames)
+
+
+def test_disconnect_cancels_reply():
+    cancelled = []
+
+    async def endless():
+        try:
+            while True:
+                await asyncio.sleep(0.01)
+                yield "a"
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def is_disconnected():
+        return True
+
+    writer = SSEWriter(max_buffer=1, disconnect_poll_interval=0.05)
+    frames = collect(writer, endless(), is_disconnected=is_disconnected)
+
+    assert cancelled == [True]
+    assert not any(frame.startswith("event: done") for frame in frames)
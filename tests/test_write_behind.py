@@ -0,0 +1,137 @@
+import asyncio
+
+import pytest
+
+from memory.consolidation import MemoryConsolidator
+from memory.write_behind import MemoryWriteBehind
+from prompts.structured_outputs import CognitiveDistortion
+
+
+class FakeCollection:
+    def __init__(self, name: str, failures: int = 0):
+        self.name = name
+        self.failures = failures
+        self.upserts = []
+
+    def upsert(self, ids, documents, metadatas=None):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("backend unavailable")
+        self.upserts.append(list(documents))
+
+
+def test_writes_are_batched_per_collection():
+    writer = MemoryWriteBehind(idle_delay=10)
+    basic, cd = FakeCollection("basic_memory"), FakeCollection("cd_memory")
+
+    async def main():
+        writer.add(basic, "a")
+        writer.add(cd, "b", metadata={"session_id": "s"})
+        writer.add(basic, "c")
+        assert writer.pending_count() == 3
+        await writer.close()
+
+    asyncio.run(main())
+    assert basic.upserts == [["a", "c"]]
+    assert cd.upserts == [["b"]]
+    assert writer.batches_written == 2
+    assert writer.pending_count() == 0
+
+
+def test_idle_and_full_queues_flush_in_background():
+    writer = MemoryWriteBehind(idle_delay=0.01, max_batch=2)
+    basic = FakeCollection("basic_memory")
+
+    async def main():
+        writer.add(basic, "a")
+        await asyncio.sleep(0.05)
+        writer.add(basic, "b")
+        writer.add(basic, "c")
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert basic.upserts == [["a"], ["b", "c"]]
+
+
+def test_failed_batch_is_retried_then_dropped():
+    writer = MemoryWriteBehind(idle_delay=10, max_attempts=2)
+    broken, healthy = FakeCollection("cd_memory", failures=5), FakeCollection("basic_memory")
+
+    async def main():
+        writer.add(broken, "a")
+        writer.add(healthy, "b")
+        with pytest.raises(RuntimeError):
+            await writer.flush()
+        # The failed batch is kept for the next flush, the other one was written.
+        assert writer.pending_count(broken) == 1
+        assert healthy.upserts == [["b"]]
+
+        with pytest.raises(RuntimeError):
+            await writer.flush()
+        assert writer.pending_count() == 0
+        await writer.flush()
+
+    asyncio.run(main())
+    assert writer.failed_writes == 2
+    assert writer.documents_dropped == 1
+
+
+def test_failing_memory_writes_do_not_fail_turns(make_agent):
+    agent = make_agent()
+    agent.memory_writer.max_attempts = 2
+
+    def upsert(**kwargs):
+        raise RuntimeError("backend unavailable")
+
+    agent.cd_memory.upsert = upsert
+
+    async def main():
+        return [
+            await agent.chat("Everything is going to fall apart."),
+            await agent.chat("I will lose my job."),
+            await agent.chat("Nobody will ever hire me."),
+        ]
+
+    assert all(asyncio.run(main()))
+    assert agent.memory_writer.failed_writes >= 2
+    assert agent.memory_writer.documents_dropped >= 1
+
+
+def queue_memories(agent, count: int):
+    distortion = CognitiveDistortion(
+        distortion_type="Catastrophizing", utterance="Everything is going to fall apart.", score=4
+    )
+    for _ in range(count):
+        agent.store_memory(distortion, "The client fears losing their job.")
+
+
+def test_close_writes_pending_memories_when_a_task_failed(make_agent):
+    agent = make_agent()
+    agent.memory_writer.idle_delay = 60
+
+    async def fail():
+        raise RuntimeError("summary failed")
+
+    async def main():
+        agent.summary_task = asyncio.ensure_future(fail())
+        queue_memories(agent, 1)
+        await agent.aclose()
+
+    asyncio.run(main())
+    assert agent.memory_count(agent.cd_memory) == 1
+    assert agent.memory_count(agent.basic_memory) == 1
+
+
+def test_close_consolidates_pending_memories(make_agent):
+    agent = make_agent(memory_consolidator=MemoryConsolidator(), consolidate_every=100)
+    agent.memory_writer.idle_delay = 60
+
+    async def main():
+        queue_memories(agent, 3)
+        await agent.aclose()
+
+    asyncio.run(main())
+    memories = agent.cd_memory.get(where=agent.memory_filter, include=["metadatas"])
+    assert len(memories["ids"]) == 1
+    assert memories["metadatas"][0]["count"] == 3